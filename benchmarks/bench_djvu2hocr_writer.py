@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: djvu2hocr page serialization
+
+Compares the streaming writer (write_page) with the lxml tree builder it
+replaced (process_page, kept in tests/djvu2hocr_lxml.py) on a synthetic
+dense page, after checking that both produce the same bytes.
+
+Usage:
+    python benchmarks/bench_djvu2hocr_writer.py [--lines N] [--words N] [--repeat N]
+
+Requires python-djvulibre and lxml, like djvu2hocr itself.
+"""
+
+import argparse
+import io
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# djvu2hocr lives in the bundled ocrodjvu package under bin/, the lxml
+# reference implementation next to the tests
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / "bin"))
+sys.path.append(str(PROJECT_ROOT / "tests"))
+
+from djvu import sexpr  # noqa: E402
+
+from lib import text_zones  # noqa: E402
+from lib.cli import djvu2hocr  # noqa: E402
+
+import djvu2hocr_lxml  # noqa: E402
+
+PAGE_WIDTH = 2480
+PAGE_HEIGHT = 3508
+
+
+def make_page(lines: int, words: int, seed: int = 0) -> str:
+    """
+    Build the text layer of a dense page
+
+    Args:
+        lines: Number of lines, spread over paragraphs of ten
+        words: Words per line
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        The page as a djvused s-expression
+    """
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz&<>\""
+    line_height = max(PAGE_HEIGHT // (lines + 1), 2)
+    word_width = max(PAGE_WIDTH // (words + 1), 2)
+    paragraphs = []
+    for first in range(0, lines, 10):
+        line_exprs = []
+        for n in range(first, min(first + 10, lines)):
+            y0 = PAGE_HEIGHT - (n + 1) * line_height
+            y1 = y0 + line_height - 1
+            word_exprs = []
+            for m in range(words):
+                x0 = m * word_width
+                text = "".join(rng.choice(letters) for _ in range(rng.randint(1, 9)))
+                text = text.replace("\\", "\\\\").replace('"', '\\"')
+                word_exprs.append(f'(word {x0} {y0} {x0 + word_width - 2} {y1} "{text}")')
+            line_exprs.append(f"(line 0 {y0} {PAGE_WIDTH} {y1} {' '.join(word_exprs)})")
+        paragraphs.append(f"(para 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} {' '.join(line_exprs)})")
+    return (
+        f"(page 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} "
+        f"(column 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} "
+        f"(region 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} {' '.join(paragraphs)})))"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--words", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    options = djvu2hocr.ArgumentParser().parse_args(["dummy.djvu"])
+    options.page_bbox = text_zones.BBox(0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+    page_sexpr = sexpr.Expression.from_string(make_page(args.lines, args.words))
+
+    def render(function):
+        output = io.StringIO()
+        function(djvu2hocr.ZoneTable(page_sexpr, PAGE_HEIGHT).root, options, file=output)
+        return output.getvalue()
+
+    functions = {"process_page": djvu2hocr_lxml.process_page, "write_page": djvu2hocr.write_page}
+    if render(functions["process_page"]) != render(functions["write_page"]):
+        sys.exit("write_page output differs from process_page")
+
+    results = {}
+    for name, function in functions.items():
+        best = min(timeit.repeat(lambda: render(function), number=1, repeat=args.repeat))
+        results[name] = best
+        print(f"{name:>14}: {best * 1000:8.2f} ms/page")
+    print(f"{'speedup':>14}: {results['process_page'] / results['write_page']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: hOCR scanning
+
+Times hocr.extract_text() on synthetic hOCR documents shaped like the
+output of Tesseract 3, Cuneiform 0.9 and djvu2hocr.
+
+Usage:
+    python benchmarks/bench_hocr_scan.py [--pages N] [--lines N] [--words N] [--repeat N]
+
+Requires python-djvulibre and lxml.
+"""
+
+import argparse
+import io
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# hocr lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / "bin"))
+
+from lib import hocr  # noqa: E402
+
+PAGE_WIDTH = 2480
+PAGE_HEIGHT = 3508
+CHAR_WIDTH = 16
+LINE_HEIGHT = 40
+
+
+def _words(rng: random.Random, words: int) -> list:
+    return ["".join(rng.choice("abcdefghij") for _ in range(rng.randint(1, 9))) for _ in range(words)]
+
+
+def _bbox(x0: int, y0: int, x1: int, y1: int) -> str:
+    return f"bbox {x0} {y0} {x1} {y1}"
+
+
+def tesseract_page(rng: random.Random, n: int, lines: int, words: int) -> str:
+    """A page as written by Tesseract 3: blocks, paragraphs, lines and words"""
+    out = [f"<div class='ocr_page' id='page_{n}' title='image \"page.tif\"; {_bbox(0, 0, PAGE_WIDTH, PAGE_HEIGHT)}; ppageno {n}'>"]
+    out.append(f" <div class='ocr_carea' id='block_{n}_1' title=\"{_bbox(0, 0, PAGE_WIDTH, lines * LINE_HEIGHT)}\">")
+    for p in range(0, lines, 10):
+        out.append(f"  <p class='ocr_par' id='par_{n}_{p}' lang='eng' title=\"{_bbox(0, p * LINE_HEIGHT, PAGE_WIDTH, (p + 10) * LINE_HEIGHT)}\">")
+        for l in range(p, min(p + 10, lines)):
+            y0, y1 = l * LINE_HEIGHT, l * LINE_HEIGHT + LINE_HEIGHT - 8
+            spans = []
+            x = 0
+            for w, text in enumerate(_words(rng, words)):
+                x1 = x + CHAR_WIDTH * len(text)
+                spans.append(f"<span class='ocrx_word' id='word_{n}_{l}_{w}' title='{_bbox(x, y0, x1, y1)}; x_wconf 91' lang='eng' dir='ltr'><strong>{text}</strong></span>")
+                x = x1 + CHAR_WIDTH
+            out.append(f"   <span class='ocr_line' id='line_{n}_{l}' title=\"{_bbox(0, y0, x, y1)}; baseline 0 -8\">" + "\n    ".join(spans) + "\n   </span>")
+        out.append("  </p>")
+    out.append(" </div>")
+    out.append("</div>")
+    return "\n".join(out)
+
+
+def cuneiform_page(rng: random.Random, n: int, lines: int, words: int) -> str:
+    """A page as written by Cuneiform 0.9: plain paragraphs with per-character bboxes"""
+    out = [f"<div class=\"ocr_page\" title=\"{_bbox(0, 0, PAGE_WIDTH, PAGE_HEIGHT)}; image page.tif\">"]
+    for p in range(0, lines, 10):
+        out.append("<p>")
+        for l in range(p, min(p + 10, lines)):
+            y0, y1 = l * LINE_HEIGHT, l * LINE_HEIGHT + LINE_HEIGHT - 8
+            text = " ".join(_words(rng, words))
+            boxes = " ".join(f"{i * CHAR_WIDTH} {y0} {(i + 1) * CHAR_WIDTH} {y1}" for i in range(len(text)))
+            out.append(
+                f"<span class=\"ocr_line\" title=\"{_bbox(0, y0, len(text) * CHAR_WIDTH, y1)}\">{text}"
+                f"<span class=\"ocr_cinfo\" title=\"x_bboxes {boxes}\"></span></span><br>"
+            )
+        out.append("</p>")
+    out.append("</div>")
+    return "\n".join(out)
+
+
+def djvu2hocr_page(rng: random.Random, n: int, lines: int, words: int) -> str:
+    """A page as written by djvu2hocr"""
+    out = [f'<div class="ocr_page" title="{_bbox(0, 0, PAGE_WIDTH, PAGE_HEIGHT)}">']
+    out.append(f'<div class="ocr_carea" title="{_bbox(0, 0, PAGE_WIDTH, lines * LINE_HEIGHT)}">')
+    out.append(f'<div class="ocrx_block" title="{_bbox(0, 0, PAGE_WIDTH, lines * LINE_HEIGHT)}">')
+    for p in range(0, lines, 10):
+        out.append(f'<p class="ocr_par" title="{_bbox(0, p * LINE_HEIGHT, PAGE_WIDTH, (p + 10) * LINE_HEIGHT)}">')
+        for l in range(p, min(p + 10, lines)):
+            y0, y1 = l * LINE_HEIGHT, l * LINE_HEIGHT + LINE_HEIGHT - 8
+            spans = []
+            x = 0
+            for text in _words(rng, words):
+                x1 = x + CHAR_WIDTH * len(text)
+                spans.append(f'<span class="ocrx_word" title="{_bbox(x, y0, x1, y1)}">{text}</span>')
+                x = x1 + CHAR_WIDTH
+            out.append(f'<span class="ocrx_line" title="{_bbox(0, y0, x, y1)}">' + " ".join(spans) + "</span>")
+        out.append("</p>")
+    out.append("</div>\n</div>\n</div>")
+    return "\n".join(out)
+
+
+FLAVOURS = {
+    "tesseract": ("tesseract 3.05.01", tesseract_page),
+    "cuneiform": ("openocr", cuneiform_page),
+    "djvu2hocr": ("djvu2hocr 0.12", djvu2hocr_page),
+}
+
+
+def make_document(flavour: str, pages: int, lines: int, words: int, seed: int = 0) -> bytes:
+    """
+    Build a synthetic hOCR document
+
+    Args:
+        flavour: One of FLAVOURS
+        pages: Number of pages
+        lines: Lines per page
+        words: Words per line
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        The document, UTF-8 encoded
+    """
+    ocr_system, make_page = FLAVOURS[flavour]
+    rng = random.Random(seed)
+    body = "\n".join(make_page(rng, n, lines, words) for n in range(1, pages + 1))
+    return (
+        "<!DOCTYPE html PUBLIC \"-//W3C//DTD XHTML 1.0 Transitional//EN\" "
+        "\"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd\">\n"
+        "<html xmlns=\"http://www.w3.org/1999/xhtml\">\n<head>\n"
+        "<meta http-equiv=\"Content-Type\" content=\"text/html; charset=UTF-8\" />\n"
+        f"<meta name=\"ocr-system\" content=\"{ocr_system}\" />\n"
+        "<title></title>\n</head>\n<body>\n"
+        f"{body}\n</body>\n</html>\n"
+    ).encode("UTF-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=60)
+    parser.add_argument("--words", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for flavour in FLAVOURS:
+        document = make_document(flavour, args.pages, args.lines, args.words)
+        for details, name in ((hocr.TEXT_DETAILS_WORD, "words"), (hocr.TEXT_DETAILS_CHARACTER, "chars")):
+            best = min(timeit.repeat(
+                lambda: hocr.extract_text(io.BytesIO(document), details=details),
+                number=1, repeat=args.repeat,
+            ))
+            print(f"{flavour:>10} {name:>5}: {best * 1000 / args.pages:8.2f} ms/page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Pipeline benchmark: DjVu2PDFConverter end to end with stand-in tools
+
+Runs whole conversions of synthetic documents with the fake ddjvu,
+tiffsplit, djvused and pdfbeads of benchmarks/fake_tools, which produce
+outputs of realistic size with a tunable latency, so that what is
+measured is the converter itself: scheduling of the steps, talking to
+djvused, writing the hOCR pages and moving files around.
+
+Each conversion is traced, and the time spent in the external commands is
+told apart from the time spent in the converter. The djvused session
+answers queries while the converter waits, so its share is counted with
+the converter, in the "extract text" step. Results can be saved as a
+JSON baseline, and later runs compared against it.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--pages N ...] [--repeat N]
+        [--page-bytes N] [--latency S] [--page-latency S]
+        [--save-baseline FILE] [--baseline FILE] [--threshold FRACTION]
+
+POSIX only: the fake tools are Python scripts run through their #! line.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from unittest import mock
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_converter import DjVu2PDFConverter  # noqa: E402
+from djvu2pdf_trace import Tracer  # noqa: E402
+
+FAKE_TOOLS = Path(__file__).resolve().parent / "fake_tools"
+
+
+def make_document(path: Path, pages: int, lines: int = 40, words: int = 8) -> Path:
+    """
+    Write a document for the fake tools
+
+    Args:
+        path: File to write
+        pages: Number of pages
+        lines: Lines of text per page
+        words: Words per line
+
+    Returns:
+        path
+    """
+    document = {"pages": pages, "lines": lines, "words": words, "bookmarks": max(pages // 10, 1)}
+    path.write_text(json.dumps(document), encoding="utf-8")
+    return path
+
+
+def run_conversion(input_file: Path, output_file: Path, environment: dict) -> dict:
+    """
+    Convert one document with the fake tools and break down the time spent
+
+    Args:
+        input_file: Document written by make_document()
+        output_file: Where to write the PDF
+        environment: DJVU2PDF_FAKE_* settings for the fake tools
+
+    Returns:
+        Wall time, time per step, time in external commands and the rest
+    """
+    tracer = Tracer()
+    converter = DjVu2PDFConverter(bin_dir=FAKE_TOOLS, tracer=tracer)
+    with mock.patch.dict("os.environ", environment):
+        start = time.perf_counter()
+        converter.convert(input_file, output_file)
+        wall = time.perf_counter() - start
+
+    steps = defaultdict(float)
+    for span in tracer.spans:
+        if span["name"] not in ("convert", "page"):
+            steps[span["name"]] += span["duration"]
+    command_time = sum(command["wall"] for command in tracer.commands)
+    return {
+        "wall": wall,
+        "commands": command_time,
+        "converter": wall - command_time,
+        "steps": dict(steps),
+        "pdf_bytes": output_file.stat().st_size,
+    }
+
+
+def benchmark(pages: int, repeat: int, environment: dict) -> dict:
+    """Best of ``repeat`` conversions of a ``pages``-page document"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        input_file = make_document(tmpdir / "book.djvu", pages)
+        runs = [run_conversion(input_file, tmpdir / "book.pdf", environment) for _ in range(repeat)]
+    best = min(runs, key=lambda run: run["wall"])
+    best["pages_per_second"] = pages / best["wall"]
+    return best
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare results with a baseline
+
+    Returns:
+        Descriptions of the sizes that got slower by more than ``threshold``
+    """
+    regressions = []
+    if baseline.get("config") != results["config"]:
+        print("warning: the baseline was run with different settings:", baseline.get("config"))
+    for pages, result in results["results"].items():
+        old = baseline.get("results", {}).get(pages)
+        if old is None:
+            continue
+        ratio = result["wall"] / old["wall"]
+        verdict = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{pages:>6} pages: {old['wall']:8.3f} s -> {result['wall']:8.3f} s ({ratio - 1:+6.1%}) {verdict}")
+        if verdict != "ok":
+            regressions.append(f"{pages} pages: {ratio - 1:+.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--page-bytes", type=int, default=16384, help="size of a page image")
+    parser.add_argument("--latency", type=float, default=0, help="seconds every tool invocation sleeps")
+    parser.add_argument("--page-latency", type=float, default=0,
+                        help="seconds the tools spend on every page decoded or encoded")
+    parser.add_argument("--save-baseline", type=Path, metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", type=Path, metavar="FILE", help="compare the results with FILE")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown reported as a regression (default: 0.1, i.e. 10%%)")
+    args = parser.parse_args()
+
+    environment = {
+        "DJVU2PDF_FAKE_PAGE_BYTES": str(args.page_bytes),
+        "DJVU2PDF_FAKE_LATENCY": str(args.latency),
+        "DJVU2PDF_FAKE_PAGE_LATENCY": str(args.page_latency),
+    }
+    results = {
+        "config": {"page_bytes": args.page_bytes, "latency": args.latency, "page_latency": args.page_latency},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+    for pages in args.pages:
+        result = benchmark(pages, args.repeat, environment)
+        results["results"][str(pages)] = result
+        steps = ", ".join(f"{name} {duration:.3f}" for name, duration in result["steps"].items())
+        print(f"{pages:>6} pages: {result['wall']:8.3f} s, {result['pages_per_second']:8.0f} pages/s, "
+              f"converter {result['converter']:.3f} s, commands {result['commands']:.3f} s")
+        print(f"{'':>14}{steps}")
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.exit("slower than the baseline: " + "; ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark suite: the text-layer hot paths of bin/lib
+
+Times the per-word Python work of djvu2hocr, hocr and text_zones, and the
+TOC parser, on synthetic text layers of configurable density:
+
+    write_page       djvu2hocr.write_page() of a word-level page
+    write_chars      djvu2hocr.write_chars() on every word of a character-level page
+    extract_text     hocr.extract_text() on a Tesseract hOCR document
+    group_words      text_zones.group_words() on the characters of a page
+    rotate           Zone.rotate() of a page by 90 degrees
+    sexpr            Zone.sexpr of a page
+    format_sexpr     Zone.format_sexpr() of a page
+    toc              djvu2pdf_toc_parser.translate_outline() of an outline
+
+For each case, the number of operations per second (best of --repeat) and
+the peak memory allocated by one operation (as seen by tracemalloc) are
+reported. Results can be saved as a JSON baseline, and later runs compared
+against it: a case is flagged when it gets slower, or needs more memory,
+by more than --threshold.
+
+Usage:
+    python benchmarks/bench_text_layer.py [CASE ...] [--lines N] [--words N]
+        [--pages N] [--bookmarks N] [--repeat N]
+        [--save-baseline FILE] [--baseline FILE] [--threshold FRACTION]
+
+Requires python-djvulibre and lxml, like djvu2hocr itself.
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+from bench_hocr_scan import make_document
+from bench_text_zones import PAGE_HEIGHT, PAGE_WIDTH, group, make_lines, text_zones
+from bench_toc_parser import make_outline
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu import sexpr  # noqa: E402
+
+from djvu2pdf_toc_parser import translate_outline  # noqa: E402
+from lib import hocr  # noqa: E402
+from lib.cli import djvu2hocr  # noqa: E402
+
+
+def make_djvu_page(lines: int, words: int, characters: bool, seed: int = 0) -> str:
+    """
+    Build the text layer of a page as djvused prints it
+
+    Args:
+        lines: Number of lines
+        words: Words per line
+        characters: Break every word down into character zones
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        The page as an s-expression
+    """
+    rng = random.Random(seed)
+    line_height = max(PAGE_HEIGHT // (lines + 1), 2)
+    word_width = max(PAGE_WIDTH // (words + 1), 2)
+    line_exprs = []
+    for n in range(lines):
+        y0 = PAGE_HEIGHT - (n + 1) * line_height
+        y1 = y0 + line_height - 1
+        word_exprs = []
+        for m in range(words):
+            x0 = m * word_width
+            text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(1, 9)))
+            if characters:
+                char_width = max((word_width - 2) // len(text), 1)
+                chars = " ".join(
+                    f'(char {x0 + i * char_width} {y0} {x0 + (i + 1) * char_width - 1} {y1} "{char}")'
+                    for i, char in enumerate(text)
+                )
+                word_exprs.append(f"(word {x0} {y0} {x0 + word_width - 2} {y1} {chars})")
+            else:
+                word_exprs.append(f'(word {x0} {y0} {x0 + word_width - 2} {y1} "{text}")')
+        line_exprs.append(f"(line 0 {y0} {PAGE_WIDTH} {y1} {' '.join(word_exprs)})")
+    return f"(page 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} {' '.join(line_exprs)})"
+
+
+def _djvu2hocr_options():
+    options = djvu2hocr.ArgumentParser().parse_args(["dummy.djvu"])
+    options.page_bbox = text_zones.BBox(0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+    return options
+
+
+def _word_zones(zone):
+    if zone.type == text_zones.const.TEXT_ZONE_WORD:
+        yield zone
+        return
+    for child in zone.children:
+        if isinstance(child, djvu2hocr.Zone):
+            yield from _word_zones(child)
+
+
+def make_cases(args) -> dict:
+    """Build the operation of each case, as a function taking no arguments"""
+    cases = {}
+
+    options = _djvu2hocr_options()
+    word_page = sexpr.Expression.from_string(make_djvu_page(args.lines, args.words, False))
+    cases["write_page"] = lambda: djvu2hocr.write_page(
+        djvu2hocr.ZoneTable(word_page, PAGE_HEIGHT).root, options, file=io.StringIO()
+    )
+
+    char_page = sexpr.Expression.from_string(make_djvu_page(args.lines, args.words, True))
+    char_words = list(_word_zones(djvu2hocr.ZoneTable(char_page, PAGE_HEIGHT).root))
+
+    def write_chars():
+        writer = djvu2hocr.HocrWriter(io.StringIO().write)
+        for word in char_words:
+            djvu2hocr.write_chars(writer, word.children, options)
+        writer.close()
+    cases["write_chars"] = write_chars
+
+    document = make_document("tesseract", args.pages, args.lines, args.words)
+    cases["extract_text"] = lambda: hocr.extract_text(io.BytesIO(document))
+
+    lines = make_lines(args.lines, args.words)
+    cases["group_words"] = lambda: group(lines)
+
+    page = group(lines)
+    cases["rotate"] = lambda: page.rotate(90)
+    cases["sexpr"] = lambda: page.sexpr
+    cases["format_sexpr"] = lambda: page.format_sexpr(80)
+
+    outline = make_outline(args.bookmarks, 4)
+    cases["toc"] = lambda: list(translate_outline(outline))
+
+    return cases
+
+
+def measure(operation, repeat: int) -> dict:
+    """
+    Time an operation and measure the memory it allocates
+
+    Returns:
+        Operations per second (best of ``repeat``) and peak allocation in KiB
+    """
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_second": number / best, "peak_kib": (peak - baseline) / 1024}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare results with a baseline
+
+    Returns:
+        Descriptions of the cases that regressed by more than ``threshold``
+    """
+    regressions = []
+    if baseline.get("config") != results["config"]:
+        print("warning: the baseline was run with different settings:", baseline.get("config"))
+    for name, result in results["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        speed = result["ops_per_second"] / old["ops_per_second"]
+        memory = result["peak_kib"] / old["peak_kib"] if old["peak_kib"] else 1.0
+        flags = []
+        if speed < 1 / (1 + threshold):
+            flags.append(f"{1 / speed - 1:+.1%} time")
+        if memory > 1 + threshold:
+            flags.append(f"{memory - 1:+.1%} memory")
+        print(f"{name:>14}: {speed - 1:+7.1%} ops/s, {memory - 1:+7.1%} peak  {'REGRESSION' if flags else 'ok'}")
+        if flags:
+            regressions.append(f"{name} ({', '.join(flags)})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cases", nargs="*", metavar="CASE", help="cases to run (default: all)")
+    parser.add_argument("--lines", type=int, default=60, help="lines per page")
+    parser.add_argument("--words", type=int, default=12, help="words per line")
+    parser.add_argument("--pages", type=int, default=5, help="pages of the hOCR document")
+    parser.add_argument("--bookmarks", type=int, default=10000, help="entries of the outline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save-baseline", type=Path, metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--baseline", type=Path, metavar="FILE", help="compare the results with FILE")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown or memory growth reported as a regression (default: 0.1, i.e. 10%%)")
+    args = parser.parse_args()
+
+    cases = make_cases(args)
+    unknown = set(args.cases) - set(cases)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}; choose from {', '.join(cases)}")
+    results = {
+        "config": {"lines": args.lines, "words": args.words, "pages": args.pages, "bookmarks": args.bookmarks},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {},
+    }
+    for name, operation in cases.items():
+        if args.cases and name not in args.cases:
+            continue
+        result = measure(operation, args.repeat)
+        results["results"][name] = result
+        print(f"{name:>14}: {result['ops_per_second']:10.1f} ops/s, {result['peak_kib']:10.1f} KiB peak")
+
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            sys.exit("regressions against the baseline: " + "; ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: text_zones bounding-box operations
+
+Times group_words() on a synthetic page, and Zone.rotate() with the affine
+fast path against the per-zone AffineTransform.inverse() calls it replaces,
+after checking that both give the same zones.
+
+Usage:
+    python benchmarks/bench_text_zones.py [--lines N] [--words N] [--repeat N]
+
+Requires python-djvulibre.
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# text_zones lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / "bin"))
+
+from lib import text_zones  # noqa: E402
+from lib import unicode_support  # noqa: E402
+
+const = text_zones.const
+
+PAGE_WIDTH = 2480
+PAGE_HEIGHT = 3508
+
+
+def make_lines(lines: int, words: int, seed: int = 0) -> list:
+    """
+    Build character zones of a dense page
+
+    Args:
+        lines: Number of lines
+        words: Words per line
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        A list of lines, each a list of (text, bbox) pairs, one per character
+    """
+    rng = random.Random(seed)
+    line_height = max(PAGE_HEIGHT // (lines + 1), 2)
+    char_width = max(PAGE_WIDTH // (words * 8), 2)
+    result = []
+    for n in range(lines):
+        y0 = n * line_height
+        chars = []
+        x = 0
+        for m in range(words):
+            if m:
+                chars.append((" ", (x, y0, x + char_width, y0 + line_height - 1)))
+                x += char_width
+            for _ in range(rng.randint(1, 7)):
+                chars.append(("x", (x, y0, x + char_width, y0 + line_height - 1)))
+                x += char_width
+        result.append(chars)
+    return result
+
+
+def group(lines: list) -> text_zones.Zone:
+    """Group characters into words, and the words into a page zone"""
+    page = text_zones.Zone(const.TEXT_ZONE_PAGE, (0, 0, PAGE_WIDTH, PAGE_HEIGHT))
+    for chars in lines:
+        zones = [text_zones.Zone(const.TEXT_ZONE_CHARACTER, bbox, [text]) for text, bbox in chars]
+        words = text_zones.group_words(
+            zones, text_zones.TEXT_DETAILS_CHARACTER, unicode_support.simple_word_break_iterator
+        )
+        bbox = text_zones.BBox()
+        for word in words:
+            bbox.update(word.bbox)
+        page += [text_zones.Zone(const.TEXT_ZONE_LINE, bbox, words)]
+    return page
+
+
+def rotate(page: text_zones.Zone, fast: bool) -> text_zones.Zone:
+    """Rotate the page by 90 degrees, with or without the affine fast path"""
+    if fast:
+        page.rotate(90)
+    else:
+        xform = text_zones.decode.AffineTransform((0, 0, PAGE_HEIGHT, PAGE_WIDTH), (0, 0, PAGE_WIDTH, PAGE_HEIGHT))
+        xform.mirror_y()
+        xform.rotate(90)
+        page._rotate(90, xform)
+    return page
+
+
+def dump(zone):
+    if isinstance(zone, text_zones.Zone):
+        return (str(zone.type), tuple(zone.bbox), [dump(child) for child in zone.children])
+    return zone
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--words", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines, args.words)
+    group_time = min(timeit.repeat(lambda: group(lines), number=1, repeat=args.repeat))
+    print(f"{'group_words':>14}: {group_time * 1000:8.2f} ms/page")
+
+    if dump(rotate(group(lines), False)) != dump(rotate(group(lines), True)):
+        sys.exit("affine rotation differs from AffineTransform.inverse()")
+    for name, fast in (("rotate inverse", False), ("rotate affine", True)):
+        pages = [group(lines) for _ in range(args.repeat)]
+        rotate_time = min(timeit.repeat(lambda: rotate(pages.pop(), fast), number=1, repeat=args.repeat))
+        print(f"{name:>14}: {rotate_time * 1000:8.2f} ms/page")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: serialising text zones for djvused
+
+Times Zone.format_sexpr() against building sexpr.Expression objects with
+Zone.sexpr and printing them with print_sexpr(), after checking that both
+describe the same text layer.
+
+Usage:
+    python benchmarks/bench_text_zones_sexpr.py [--lines N] [--words N] [--repeat N]
+
+Requires python-djvulibre.
+"""
+
+import argparse
+import io
+import sys
+import timeit
+
+from bench_text_zones import group, make_lines, text_zones
+
+
+def expression_path(page: text_zones.Zone, width) -> str:
+    """Serialise the page the way hocr2djvused used to"""
+    output = io.StringIO()
+    text_zones.print_sexpr(page.sexpr, output, width=width)
+    return output.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--words", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    page = group(make_lines(args.lines, args.words))
+    expected = text_zones.sexpr.Expression.from_string(expression_path(page, None))
+    for width in (None, 80):
+        if text_zones.sexpr.Expression.from_string(page.format_sexpr(width)) != expected:
+            sys.exit(f"format_sexpr(width={width}) differs from Zone.sexpr")
+
+    size = len(page.format_sexpr().encode("UTF-8"))
+    for width in (80, None):
+        mode = "pretty" if width else "compact"
+        for name, function in (
+            ("Expression", lambda: expression_path(page, width)),
+            ("format_sexpr", lambda: page.format_sexpr(width)),
+        ):
+            elapsed = min(timeit.repeat(function, number=1, repeat=args.repeat))
+            print(f"{name:>12} {mode:>7}: {elapsed * 1000:8.2f} ms/page, {size / elapsed / 2**20:7.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
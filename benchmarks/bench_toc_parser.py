@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: translating huge outlines for pdfbeads
+
+Builds a synthetic outline laid out the way djvused prints it and times
+translate_outline(), on the whole text and line by line, against the
+recursive, character-at-a-time parser it replaces.
+
+Usage:
+    python benchmarks/bench_toc_parser.py [--entries N] [--depth N] [--repeat N]
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_toc_parser import translate_outline  # noqa: E402
+
+
+def make_outline(entries: int, depth: int, seed: int = 0) -> str:
+    """
+    Build an outline
+
+    Args:
+        entries: Number of bookmarks
+        depth: Maximum nesting depth
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        The outline as printed by djvused
+    """
+    rng = random.Random(seed)
+    lines = ["(bookmarks"]
+    open_entries = 0
+    for n in range(entries):
+        level = rng.randint(0, min(open_entries, depth - 1))
+        while open_entries > level:
+            lines[-1] += " )"
+            open_entries -= 1
+        indent = " " * (level + 1)
+        lines.append(f'{indent}("Chapter {n} \\"quoted\\""')
+        lines.append(f'{indent} "#{n // 10 + 1}"')
+        open_entries += 1
+    lines[-1] += " )" * (open_entries + 1)
+    return "\n".join(lines) + "\n"
+
+
+def old_parse_sexp(toc_input, toc_output, indent_str, i):
+    """The recursive parser translate_outline() replaces"""
+    while True:
+        if toc_input[i] == '(':
+            i += 1
+            i, title = old_next_quote(toc_input, i)
+            i, page = old_next_quote(toc_input, i)
+            page = page[0] + page[2:]
+            toc_output += ["{0}{1} {2}".format(indent_str, title, page)]
+            i = old_parse_sexp(toc_input, toc_output, indent_str + '\t', i)
+        elif toc_input[i] == ')':
+            return i + 1
+        i += 1
+
+
+def old_next_quote(str, i):
+    j = i
+    while str[j] != '"':
+        j += 1
+    j += 1
+    output = ['"']
+    while True:
+        if str[j] == '"':
+            if str[j - 1] == "\\":
+                output.pop()
+                output += ["'"]
+            else:
+                output += [str[j]]
+                break
+        else:
+            output += [str[j]]
+        j += 1
+    return j + 1, ''.join(output)
+
+
+def old_translate(outline: str) -> list:
+    toc_output = []
+    old_parse_sexp(outline[len('(bookmarks'):], toc_output, '', 0)
+    return toc_output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    outline = make_outline(args.entries, args.depth)
+    lines = outline.splitlines(True)
+    expected = list(translate_outline(outline))
+    if len(expected) != args.entries or list(translate_outline(lines)) != expected:
+        sys.exit("translate_outline() lost entries")
+    if old_translate(outline) != expected:
+        sys.exit("translate_outline() differs from the recursive parser")
+
+    print(f"{args.entries} entries, {len(outline) / 2**20:.1f} MiB")
+    for name, function in (
+        ("recursive", lambda: old_translate(outline)),
+        ("whole text", lambda: list(translate_outline(outline))),
+        ("line by line", lambda: list(translate_outline(lines))),
+    ):
+        elapsed = min(timeit.repeat(function, number=1, repeat=args.repeat))
+        print(f"{name:>12}: {elapsed * 1000:8.1f} ms, {args.entries / elapsed:9.0f} entries/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark: word segmentation of a whole book
+
+Segments every line of a synthetic book the way hOCR conversion does (one
+word_break_iterator() call per line), with the simple space-to-space
+segmenter, and with UAX #29 rules using both the cached ICU break iterators
+and a new BreakIterator per call, as before caching.
+
+Usage:
+    python benchmarks/bench_word_break.py [--pages N] [--lines N] [--repeat N]
+
+The UAX #29 part requires PyICU.
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+# unicode_support lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / "bin"))
+
+from lib import unicode_support  # noqa: E402
+
+WORDS = ["the", "of", "and", "a", "DjVu", "żółw", "naïve", "co-operate", "1984,", "“quoted”", "end."]
+
+
+def make_book(pages: int, lines: int, seed: int = 0) -> list:
+    """
+    Build the lines of a synthetic book
+
+    Args:
+        pages: Number of pages
+        lines: Lines per page
+        seed: Random seed, so runs are comparable
+
+    Returns:
+        A list of lines of about 60 characters
+    """
+    rng = random.Random(seed)
+    book = []
+    for _ in range(pages * lines):
+        words = []
+        while sum(map(len, words)) + len(words) < 60:
+            words.append(rng.choice(WORDS))
+        book.append(" ".join(words))
+    return book
+
+
+def old_icu_word_break_iterator(text, locale):
+    """A new BreakIterator for every text, as before caching"""
+    icu = unicode_support.get_icu()
+    break_iterator = icu.BreakIterator.createWordInstance(locale)
+    break_iterator.setText(text)
+    return break_iterator
+
+
+def segment(book: list, function, *args) -> int:
+    """Segment every line; return the number of boundaries"""
+    return sum(len(list(function(line, *args))) for line in book)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    book = make_book(args.pages, args.lines)
+    cases = [
+        ("simple", unicode_support.simple_word_break_iterator, ()),
+    ]
+    try:
+        icu = unicode_support.get_icu()
+    except ImportError:
+        print("PyICU is not installed; skipping UAX #29", file=sys.stderr)
+    else:
+        locale = icu.Locale("en")
+        cases += [
+            ("uax29, new", old_icu_word_break_iterator, (locale,)),
+            ("uax29, cached", unicode_support.word_break_iterator, (locale,)),
+        ]
+        for line in book[:1000]:
+            if list(old_icu_word_break_iterator(line, locale)) != unicode_support.word_break_iterator(line, locale):
+                sys.exit(f"cached break iterator differs on {line!r}")
+
+    for name, function, extra in cases:
+        elapsed = min(timeit.repeat(lambda: segment(book, function, *extra), number=1, repeat=args.repeat))
+        print(f"{name:>16}: {elapsed * 1000:8.1f} ms/book, {len(book) / elapsed:9.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main()
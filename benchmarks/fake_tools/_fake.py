@@ -0,0 +1,144 @@
+"""
+Shared code of the stand-in DjVu tools used by bench_pipeline.py
+
+A "document" is a small JSON file describing a book rather than a real
+DjVu file, so that documents of any size cost nothing to create::
+
+    {"pages": 1000, "width": 2480, "height": 3508, "lines": 40, "words": 8, "bookmarks": 50}
+
+Page images and text layers are synthesized from it on demand. The cost
+of the tools is tuned with environment variables:
+
+    DJVU2PDF_FAKE_PAGE_BYTES    size of a page image (default: 16384)
+    DJVU2PDF_FAKE_LATENCY       seconds every invocation sleeps (default: 0)
+    DJVU2PDF_FAKE_PAGE_LATENCY  seconds spent on every page decoded or
+                                encoded (default: 0)
+"""
+
+import json
+import os
+import random
+import struct
+import sys
+import time
+
+_RECORD_HEADER = struct.Struct('>IQ')
+
+
+def load_document(path):
+    with open(path, encoding='utf-8') as file:
+        document = json.load(file)
+    document.setdefault('width', 2480)
+    document.setdefault('height', 3508)
+    document.setdefault('lines', 40)
+    document.setdefault('words', 8)
+    document.setdefault('bookmarks', 0)
+    return document
+
+
+def _env_float(name):
+    return float(os.environ.get(name) or 0)
+
+
+def page_bytes():
+    return int(os.environ.get('DJVU2PDF_FAKE_PAGE_BYTES') or 16384)
+
+
+def startup():
+    """Simulate the start-up cost of a tool"""
+    delay = _env_float('DJVU2PDF_FAKE_LATENCY')
+    if delay:
+        time.sleep(delay)
+
+
+def page_work(pages=1):
+    """Simulate decoding or encoding ``pages`` pages"""
+    delay = _env_float('DJVU2PDF_FAKE_PAGE_LATENCY')
+    if delay:
+        time.sleep(delay * pages)
+
+
+def write_record(file, page, size):
+    """Write one page image of a multi-page image file"""
+    file.write(_RECORD_HEADER.pack(page, size))
+    chunk = bytes([page % 256]) * min(size, 1 << 16)
+    remaining = size
+    while remaining > 0:
+        file.write(chunk[:remaining])
+        remaining -= len(chunk)
+
+
+def read_records(file):
+    """Generate ``page, data`` for each page image of a multi-page image file"""
+    while True:
+        header = file.read(_RECORD_HEADER.size)
+        if not header:
+            return
+        page, size = _RECORD_HEADER.unpack(header)
+        yield page, file.read(size)
+
+
+def _quote(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+_vocabulary = None
+
+
+def _word(n):
+    global _vocabulary
+    if _vocabulary is None:
+        rng = random.Random(0)
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        _vocabulary = [
+            _quote(''.join(rng.choice(letters) for _ in range(rng.randint(1, 9)))) for _ in range(997)
+        ]
+    return _vocabulary[n % len(_vocabulary)]
+
+
+def page_text(document, page):
+    """Text layer of a page, as ``djvused -u`` prints it"""
+    width, height = document['width'], document['height']
+    lines, words = document['lines'], document['words']
+    if not lines or not words:
+        return ''
+    line_height = max(height // (lines + 1), 2)
+    word_width = max(width // (words + 1), 2)
+    parts = ['(page 0 0 {0} {1}'.format(width, height)]
+    for n in range(lines):
+        y0 = height - (n + 1) * line_height
+        y1 = y0 + line_height - 1
+        parts.append('\n  (line 0 {0} {1} {2}'.format(y0, width - 1, y1))
+        first_word = (page * lines + n) * words
+        for m in range(words):
+            x0 = m * word_width
+            parts.append('\n   (word {0} {1} {2} {3} {4})'.format(
+                x0, y0, x0 + word_width - 2, y1, _word(first_word + m)))
+        parts.append(')')
+    parts.append(')')
+    return ''.join(parts)
+
+
+def outline(document):
+    """Outline of the document, as ``djvused -u`` prints it"""
+    bookmarks = document['bookmarks']
+    if not bookmarks:
+        return ''
+    pages = document['pages']
+    # Chapters with five sections each
+    parts = ['(bookmarks']
+    for n in range(bookmarks):
+        target = '"#{0}"'.format(n * pages // bookmarks + 1)
+        if n % 6 == 0:
+            if n:
+                parts.append(' )')
+            parts.append('\n ("Chapter {0}"\n  {1}'.format(n // 6 + 1, target))
+        else:
+            parts.append('\n  ("Section {0}.{1}"\n   {2} )'.format(n // 6 + 1, n % 6, target))
+    parts.append(' ) )')
+    return ''.join(parts)
+
+
+def fail(message):
+    sys.stderr.write('{0}: {1}\n'.format(os.path.basename(sys.argv[0]), message))
+    sys.exit(1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Load test: the HTTP conversion service under concurrent clients
+
+Starts djvu2pdf_service in this process with the stand-in tools of
+benchmarks/fake_tools, and lets a number of client threads each upload
+documents, poll until they are converted and download the PDF. Clients
+that are turned away with 429 wait for Retry-After (scaled down by
+--retry-scale) and try again.
+
+Reports the throughput, the latency of whole jobs (upload to download)
+and how often the queue was full.
+
+Usage:
+    python benchmarks/load_service.py [--clients N] [--jobs N] [--pages N]
+        [--workers N] [--queue N] [--page-latency S]
+
+POSIX only: the fake tools are Python scripts run through their #! line.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_service import ConversionServer, ConversionService  # noqa: E402
+
+FAKE_TOOLS = Path(__file__).resolve().parent / "fake_tools"
+
+
+class Client:
+    """One simulated user, submitting jobs one after the other"""
+
+    def __init__(self, address, document: bytes, retry_scale: float):
+        self.address = address
+        self.document = document
+        self.retry_scale = retry_scale
+        self.latencies = []
+        self.rejections = 0
+        self.failures = 0
+
+    def _request(self, method: str, path: str, body: bytes = None):
+        connection = http.client.HTTPConnection(*self.address, timeout=600)
+        try:
+            connection.request(method, path, body)
+            response = connection.getresponse()
+            return response.status, response.getheader("Retry-After"), response.read()
+        finally:
+            connection.close()
+
+    def run_job(self):
+        start = time.perf_counter()
+        while True:
+            status, retry_after, body = self._request("POST", "/jobs", self.document)
+            if status != 429:
+                break
+            self.rejections += 1
+            time.sleep(float(retry_after or 1) * self.retry_scale)
+        if status != 202:
+            self.failures += 1
+            return
+        job_id = json.loads(body)["id"]
+        while True:
+            job = json.loads(self._request("GET", f"/jobs/{job_id}")[2])
+            if job["state"] in ("done", "failed"):
+                break
+            time.sleep(0.02)
+        if job["state"] != "done" or not self._request("GET", f"/jobs/{job_id}/pdf")[2].startswith(b"%PDF"):
+            self.failures += 1
+            return
+        self._request("DELETE", f"/jobs/{job_id}")
+        self.latencies.append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--jobs", type=int, default=4, help="jobs per client")
+    parser.add_argument("--pages", type=int, default=20, help="pages per document")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--queue", type=int, default=4)
+    parser.add_argument("--page-latency", type=float, default=0.001,
+                        help="seconds the fake tools spend on every page")
+    parser.add_argument("--retry-scale", type=float, default=0.05,
+                        help="fraction of Retry-After that rejected clients wait")
+    args = parser.parse_args()
+
+    os.environ["DJVU2PDF_FAKE_PAGE_LATENCY"] = str(args.page_latency)
+    document = json.dumps({"pages": args.pages, "bookmarks": max(args.pages // 10, 1)}).encode("utf-8")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        service = ConversionService(Path(work_dir), args.workers, args.queue, FAKE_TOOLS)
+        service.start()
+        server = ConversionServer(("127.0.0.1", 0), service)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        clients = [Client(server.server_address[:2], document, args.retry_scale) for _ in range(args.clients)]
+
+        def run(client):
+            for _ in range(args.jobs):
+                client.run_job()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=run, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stats = service.stats()
+        server.shutdown()
+        server.server_close()
+        service.stop()
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    failures = sum(client.failures for client in clients)
+    rejections = sum(client.rejections for client in clients)
+    print(f"{len(latencies)} jobs in {elapsed:.2f} s: {len(latencies) / elapsed:.2f} jobs/s, "
+          f"{len(latencies) * args.pages / elapsed:.0f} pages/s")
+    if latencies:
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        print(f"latency: median {statistics.median(latencies):.2f} s, p95 {p95:.2f} s, max {latencies[-1]:.2f} s")
+    print(f"429 responses: {rejections} (service counted {stats['rejected']}), failed jobs: {failures}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
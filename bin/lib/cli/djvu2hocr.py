@@ -23,7 +23,13 @@ if not six.PY2:
 else:
     from cgi import escape
 
+import array
+import collections
+import functools
+import io
+import itertools
 import locale
+import multiprocessing
 import os
 import re
 import sys
@@ -38,7 +44,6 @@ from .. import unicode_support
 from .. import utils
 from .. import version
 
-from ..hocr import etree
 from ..text_zones import const
 from ..text_zones import sexpr
 
@@ -59,6 +64,7 @@ class ArgumentParser(cli.ArgumentParser):
         def pages(x):
             return utils.parse_page_numbers(x)
         group.add_argument('-p', '--pages', dest='pages', action='store', default=None, type=pages, help='pages to convert')
+        self.add_argument('-j', '--jobs', metavar='N', dest='jobs', type=int, default=1, help='number of processes converting page shards in parallel')
         group = self.add_argument_group(title='word segmentation options')
         group.add_argument('--word-segmentation', dest='word_segmentation', choices=('simple', 'uax29'), default='simple', help='word segmentation algorithm')
         # -l/--language is currently not very useful, as ICU don't have any specialisations for languages ocrodjvu supports:
@@ -66,9 +72,20 @@ class ArgumentParser(cli.ArgumentParser):
         group = self.add_argument_group(title='HTML output options')
         group.add_argument('--title', dest='title', help='document title', default='DjVu hidden text layer')
         group.add_argument('--css', metavar='STYLE', dest='css', help='CSS style', default='')
+        group.add_argument('--pdfbeads', dest='pdfbeads', action='store_true', help='use ocr_* instead of ocrx_* classes, as expected by pdfbeads')
+        group = self.add_argument_group(title='per-page output options')
+        group.add_argument('--page-dir', metavar='DIRECTORY', dest='page_dir', help='write one hOCR document per page into this directory')
+        group.add_argument('--page-template', metavar='TEMPLATE', dest='page_template', default='page_{n:0{width}d}.html',
+            help='file name template for --page-dir; {n} is the page number, {width} the number of digits of the last page (default: %(default)s)')
 
     def parse_args(self, args=None, namespace=None):
         options = cli.ArgumentParser.parse_args(self, args, namespace)
+        if options.jobs < 1:
+            self.error('the number of jobs must be positive')
+        if options.pdfbeads:
+            options.hocr_class = pdfbeads_hocr_class
+        else:
+            options.hocr_class = utils.identity
         if options.word_segmentation == 'uax29':
             options.icu = icu = unicode_support.get_icu()
             options.locale = icu.Locale(options.language)
@@ -77,56 +94,149 @@ class ArgumentParser(cli.ArgumentParser):
             options.locale = None
         return options
 
-class CharacterLevelDetails(Exception):
-    pass
+def pdfbeads_hocr_class(hocr_class):
+    '''
+    pdfbeads only understands the ocr_* spelling of hOCR classes.
+    '''
+    return hocr_class.replace('ocrx_', 'ocr_')
 
-class Zone(object):
+class ZoneTable(object):
+
+    '''
+    Text zones of a page, decoded once into flat arrays.
+
+    Zones are numbered in document order, so that zone i and its descendants
+    occupy entries i to end[i] - 1. Bounding boxes are stored in hOCR
+    coordinates (y axis pointing down). Texts of the leaf zones are
+    concatenated; zone i owns text[text_start[i]:text_end[i]], or no text if
+    text_start[i] is negative.
+    '''
+
+    __slots__ = (
+        'types', 'bboxes', 'parents', 'ends', 'child_counts',
+        'text', 'text_starts', 'text_ends',
+        'zones',
+    )
 
     def __init__(self, sexpr, page_height):
-        self._sexpr = sexpr
-        self._page_height = page_height
+        types = self.types = []
+        bboxes = self.bboxes = array.array('l')
+        parents = self.parents = array.array('l')
+        text_starts = self.text_starts = array.array('l')
+        text_ends = self.text_ends = array.array('l')
+        text = []
+        text_length = 0
+        stack = [(sexpr.value, -1)]
+        while stack:
+            value, parent = stack.pop()
+            if not isinstance(value, tuple) or len(value) < 5:
+                raise TypeError('{0!r} is not a text zone'.format(value))
+            types += [_get_text_zone_type(value[0])]
+            bboxes.extend((value[1], page_height - value[4], value[3], page_height - value[2]))
+            i = len(parents)
+            parents.append(parent)
+            last = value[-1]
+            if isinstance(last, tuple) or len(value) == 5:
+                text_starts.append(-1)
+                text_ends.append(-1)
+                stack += [(child, i) for child in reversed(value[5:])]
+                continue
+            if len(value) != 6:
+                raise TypeError('list of {0} (!= 6) elements'.format(len(value)))  # no coverage
+            if not isinstance(last, six.text_type):
+                if not isinstance(last, bytes):
+                    raise TypeError('last element is not a string')  # no coverage
+                last = last.decode('UTF-8', 'replace')
+            text += [last]
+            text_starts.append(text_length)
+            text_length += len(last)
+            text_ends.append(text_length)
+        self.text = ''.join(text)
+        n = len(parents)
+        ends = self.ends = array.array('l', range(1, n + 1))
+        child_counts = self.child_counts = array.array('l', [0]) * n
+        for i in range(n - 1, 0, -1):
+            parent = parents[i]
+            child_counts[parent] += 1
+            if ends[parent] < ends[i]:
+                ends[parent] = ends[i]
+        self.zones = [Zone(self, i) for i in range(n)]
+
+    @property
+    def root(self):
+        return self.zones[0]
+
+_text_zone_types = {}
+
+def _get_text_zone_type(symbol):
+    try:
+        return _text_zone_types[symbol]
+    except KeyError:
+        zone_type = _text_zone_types[symbol] = const.get_text_zone_type(symbol)
+        return zone_type
+
+class Zone(object):
+
+    '''
+    View of a single zone of a ZoneTable.
+    '''
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
 
     @property
     def type(self):
-        return const.get_text_zone_type(self._sexpr[0].value)
+        return self._table.types[self._index]
 
     @property
     def bbox(self):
-        return text_zones.BBox(
-            self._sexpr[1].value,
-            self._page_height - self._sexpr[4].value,
-            self._sexpr[3].value,
-            self._page_height - self._sexpr[2].value,
-        )
+        i = 4 * self._index
+        return tuple(self._table.bboxes[i:i + 4])
+
+    @property
+    def parent(self):
+        i = self._table.parents[self._index]
+        if i >= 0:
+            return self._table.zones[i]
 
     @property
     def text(self):
-        if len(self._sexpr) != 6:
-            raise TypeError('list of {0} (!= 6) elements'.format(len(self._sexpr)))  # no coverage
-        if not isinstance(self._sexpr[5], sexpr.StringExpression):
-            raise TypeError('last element is not a string')  # no coverage
-        if six.PY2:
-            return unicode(self._sexpr[5].value, 'UTF-8', 'replace')
-        return self._sexpr[5].value
+        table = self._table
+        start = table.text_starts[self._index]
+        if start < 0:
+            raise TypeError('zone has no text')  # no coverage
+        return table.text[start:table.text_ends[self._index]]
 
     @property
     def children(self):
-        for child in self._sexpr[5:]:
-            if isinstance(child, sexpr.ListExpression):
-                yield Zone(child, self._page_height)
-            else:
+        table = self._table
+        i = self._index + 1
+        end = table.ends[self._index]
+        if i == end:
+            if table.text_starts[self._index] >= 0:
                 yield self.text
-                return
+            return
+        zones = table.zones
+        ends = table.ends
+        while i < end:
+            yield zones[i]
+            i = ends[i]
 
     @property
     def n_children(self):
-        n = len(self._sexpr) - 5
-        if n <= 0:
-            raise TypeError('list of {0} (< 6) elements'.format(len(self._sexpr)))  # no coverage
+        table = self._table
+        if table.text_starts[self._index] >= 0:
+            return 1
+        n = table.child_counts[self._index]
+        if n == 0:
+            raise TypeError('zone has no children')  # no coverage
         return n
 
     def __repr__(self):
-        return '{tp}({sexpr!r})'.format(tp=type(self).__name__, sexpr=self._sexpr)
+        return '{tp}({type!r}, {bbox!r})'.format(tp=type(self).__name__, type=self.type, bbox=self.bbox)
 
 _xml_string_re = re.compile(
     u'''
@@ -136,147 +246,252 @@ _xml_string_re = re.compile(
     re.VERBOSE
 )
 
-def set_text(element, text):
-    last = None
+# hOCR output
+# ===========
+
+# The functions below write hOCR straight to a stream while walking the
+# zones, without building an lxml tree. The output is the same, byte for
+# byte, as serializing such a tree with lxml (tests/djvu2hocr_lxml.py keeps
+# that implementation as the reference). Whether a zone is replaced by words
+# of its own (character-level details, UAX #29 segmentation) is decided up
+# front by looking at its children.
+
+_xml_control_re = re.compile(u'[\x00-\x08\x0B\x0C\x0E-\x1F]')
+
+_escape_text = functools.partial(
+    re.compile(u'[&<>\r]').sub,
+    lambda m: _xml_escapes[m.group()]
+)
+
+_escape_attribute = functools.partial(
+    re.compile(u'[&<>"\t\n\r]').sub,
+    lambda m: _xml_escapes[m.group()]
+)
+
+_xml_escapes = {
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    '\t': '&#9;',
+    '\n': '&#10;',
+    '\r': '&#13;',
+}
+
+class HocrWriter(object):
+
+    '''
+    Minimal XML writer mimicking lxml serialization of element trees.
+
+    The tail of an element is written only when something else follows it,
+    so it can still be changed after the element has been closed.
+    '''
+
+    def __init__(self, write):
+        self._write = write
+        self._stack = []
+        self._start_tag_open = False
+        self._tail = None
+
+    def _flush(self):
+        if self._start_tag_open:
+            self._write('>')
+            self._start_tag_open = False
+        elif self._tail:
+            self._write(_escape_text(self._tail))
+        self._tail = None
+
+    def start(self, tag, attributes):
+        self._flush()
+        self._write('<' + tag + ''.join([
+            ' ' + name + '="' + _escape_attribute(value) + '"'
+            for name, value in attributes
+        ]))
+        self._start_tag_open = True
+        self._stack += [[tag, None]]
+
+    def end(self):
+        tag, tail = self._stack.pop()
+        if self._start_tag_open:
+            self._write('/>')
+            self._start_tag_open = False
+        else:
+            self._flush()
+            self._write('</' + tag + '>')
+        self._tail = tail
+
+    def text(self, text):
+        if text:
+            self._flush()
+            self._write(_escape_text(text))
+
+    @property
+    def has_parent(self):
+        return bool(self._stack)
+
+    def set_parent_tail(self, tail):
+        '''
+        Set tail of the innermost open element.
+        '''
+        if self._stack:
+            self._stack[-1][1] = tail
+
+    def set_tail(self, tail):
+        '''
+        Set tail of the most recently closed element.
+        '''
+        self._tail = tail
+
+    def close(self):
+        while self._stack:
+            self.end()
+        self._flush()
+
+def write_text(writer, text):
+    '''
+    Write text, replacing characters not allowed in XML with
+    <span class="djvu_char"> elements.
+    '''
+    if not _xml_control_re.search(text):
+        writer.text(text)
+        return
     for match in _xml_string_re.finditer(text):
-        if match.group(1):
-            if last is None:
-                element.text = match.group(1)
-            else:
-                last.tail = match.group(1)
+        writer.text(match.group(1))
         if match.group(2):
-            last = etree.Element('span')
-            last.set('class', 'djvu_char')
-            last.set('title', '#x{0:02x}'.format(ord(match.group(2))))
-            last.text = ' '
-            element.append(last)
-
-def break_chars(char_zone_list, options):
+            writer.start('span', (('class', 'djvu_char'), ('title', '#x{0:02x}'.format(ord(match.group(2))))))
+            writer.text(' ')
+            writer.end()
+
+def _format_bbox(bbox):
+    return '{0} {1} {2} {3}'.format(*bbox)
+
+def write_chars(writer, char_zone_list, options):
+    '''
+    Write words segmented from the texts of the character zones, with the
+    bounding box of each character.
+    Return the number of words written.
+    '''
     bbox_list = []
     text = []
     for char_zone in char_zone_list:
-        bbox = char_zone.bbox
+        x0, y0, x1, y1 = char_zone.bbox
         char_text = char_zone.text
         if not char_text:
             continue
-        for i, char in enumerate(char_text):
-            subbox = text_zones.BBox(
-                int(bbox.x0 + (bbox.x1 - bbox.x0) * 1.0 * i / len(char_text) + 0.5),
-                bbox.y0,
-                int(bbox.x0 + (bbox.x1 - bbox.x0) * 1.0 * (i + 1) / len(char_text) + 0.5),
-                bbox.y1,
-            )
-            bbox_list += [subbox]
+        n = len(char_text)
+        w = (x1 - x0) * 1.0
+        for i in range(n):
+            bbox_list += [(
+                int(x0 + w * i / n + 0.5),
+                y0,
+                int(x0 + w * (i + 1) / n + 0.5),
+                y1,
+            )]
         text += [char_text]
     text = ''.join(text)
-    break_iterator = unicode_support.word_break_iterator(text, options.locale)
-    element = None
+    word_class = options.hocr_class('ocrx_word')
+    n_words = 0
     i = 0
-    for j in break_iterator:
+    for j in unicode_support.word_break_iterator(text, options.locale):
         subtext = text[i:j]
         if subtext.isspace():
-            if element is not None:
-                element.tail = ' '
+            if n_words:
+                writer.set_tail(' ')
             i = j
             continue
-        bbox = text_zones.BBox()
-        for k in range(i, j):
-            bbox.update(bbox_list[k])
-        element = etree.Element('span')
-        element.set('class', 'ocrx_word')
-        element.set('title', 'bbox {bbox}; bboxes {bboxes}'.format(
-            bbox=' '.join(map(str, bbox)),
-            bboxes=', '.join(' '.join(map(str, bbox)) for bbox in bbox_list[i:j])
+        bboxes = bbox_list[i:j]
+        bbox = (
+            min(b[0] for b in bboxes),
+            min(b[1] for b in bboxes),
+            max(b[2] for b in bboxes),
+            max(b[3] for b in bboxes),
+        )
+        writer.start('span', (
+            ('class', word_class),
+            ('title', 'bbox {bbox}; bboxes {bboxes}'.format(
+                bbox=_format_bbox(bbox),
+                bboxes=', '.join(map(_format_bbox, bboxes)),
+            )),
         ))
-        set_text(element, subtext)
-        yield element
+        write_text(writer, subtext)
+        writer.end()
+        n_words += 1
         i = j
-
-def break_plain_text(text, bbox, options):
-    break_iterator = unicode_support.word_break_iterator(text, options.locale)
+    return n_words
+
+def write_plain_text(writer, text, bbox, options):
+    '''
+    Write words segmented from the text, with bounding boxes interpolated
+    from the bbox of the whole text.
+    Return the number of words written.
+    '''
+    x0, y0, x1, y1 = bbox
+    w = (x1 - x0) * 1.0
+    n = len(text)
+    word_class = options.hocr_class('ocrx_word')
+    n_words = 0
     i = 0
-    element = None
-    for j in break_iterator:
+    for j in unicode_support.word_break_iterator(text, options.locale):
         subtext = text[i:j]
         if subtext.isspace():
-            if element is not None:
-                element.tail = ' '
+            if n_words:
+                writer.set_tail(' ')
             i = j
             continue
-        subbox = text_zones.BBox(
-            int(bbox.x0 + (bbox.x1 - bbox.x0) * 1.0 * i / len(text) + 0.5),
-            bbox.y0,
-            int(bbox.x0 + (bbox.x1 - bbox.x0) * 1.0 * j / len(text) + 0.5),
-            bbox.y1,
-        )
-        element = etree.Element('span')
-        element.set('class', 'ocrx_word')
-        element.set('title', 'bbox ' + ' '.join(map(str, subbox)))
-        set_text(element, subtext)
-        yield element
+        subbox = (int(x0 + w * i / n + 0.5), y0, int(x0 + w * j / n + 0.5), y1)
+        writer.start('span', (('class', word_class), ('title', 'bbox ' + _format_bbox(subbox))))
+        write_text(writer, subtext)
+        writer.end()
+        n_words += 1
         i = j
+    return n_words
 
-def process_zone(parent, zone, last, options):
+def write_zone(writer, zone, last, options):
+    '''
+    Write the zone and its descendants as hOCR elements.
+    '''
     zone_type = zone.type
-    if zone_type <= const.TEXT_ZONE_LINE and parent is not None:
-        parent.tail = '\n'
-    try:
-        hocr_tag, hocr_class = hocr.djvu_zone_to_hocr(zone_type)
-    except LookupError as ex:
-        if ex[0] == const.TEXT_ZONE_CHARACTER:
-            raise CharacterLevelDetails
-        raise
-    self = etree.Element(hocr_tag)
-    self.set('class', hocr_class)
+    if zone_type <= const.TEXT_ZONE_LINE:
+        writer.set_parent_tail('\n')
+    children = list(zone.children)
+    n_children = len(children)
+    for child in children:
+        if isinstance(child, Zone) and child.type == const.TEXT_ZONE_CHARACTER:
+            # Do word segmentation by hand.
+            if write_chars(writer, children, options) and zone_type == const.TEXT_ZONE_WORD and not last:
+                writer.set_tail(' ')
+            return
+    hocr_tag, hocr_class = hocr.djvu_zone_to_hocr(zone_type)
     if zone_type == const.TEXT_ZONE_PAGE:
         bbox = options.page_bbox
     else:
         bbox = zone.bbox
-    self.set('title', 'bbox ' + ' '.join(map(str, bbox)))
-    n_children = zone.n_children
-    character_level_details = False
-    for n, child_zone in enumerate(zone.children):
-        last_child = n == n_children - 1
-        if isinstance(child_zone, Zone):
-            try:
-                process_zone(self, child_zone, last=last_child, options=options)
-            except CharacterLevelDetails:
-                # Do word segmentation by hand.
-                character_level_details = True
-                break
-    if character_level_details:
+    text = children[-1] if isinstance(children[-1], six.text_type) else None
+    if text is not None and zone_type >= const.TEXT_ZONE_WORD and options.icu is not None and writer.has_parent:
         # Do word segmentation by hand.
-        child = None
-        for child in break_chars(zone.children, options):
-            parent.append(child)
-        if child is not None and zone_type == const.TEXT_ZONE_WORD and not last:
-            child.tail = ' '
-        self = None
-    elif isinstance(child_zone, six.text_type):
-        text = child_zone
-        if zone_type >= const.TEXT_ZONE_WORD and options.icu is not None and parent is not None:
-            # Do word segmentation by hand.
-            child = None
-            for child in break_plain_text(text, bbox, options):
-                parent.append(child)
-            if child is not None and zone_type == const.TEXT_ZONE_WORD and not last:
-                child.tail = ' '
-            self = None
-        else:
-            # Word segmentation as provided by DjVu.
-            # There's no point in doing word segmentation if only line coordinates are provided.
-            set_text(self, text)
-            if zone_type == const.TEXT_ZONE_WORD and not last:
-                self.tail = ' '
-    if parent is not None and self is not None:
-        parent.append(self)
-    return self
-
-def process_page(page_text, options):
-    result = process_zone(None, page_text, last=True, options=options)
-    tree = etree.ElementTree(result)
-    sys.stdout.write(etree.tostring(tree, encoding='utf8', method='xml').decode('utf-8'))
-    #tree.write(sys.stdout, encoding='UTF-8')
+        if write_plain_text(writer, text, bbox, options) and zone_type == const.TEXT_ZONE_WORD and not last:
+            writer.set_tail(' ')
+        return
+    writer.start(hocr_tag, (('class', options.hocr_class(hocr_class)), ('title', 'bbox ' + _format_bbox(bbox))))
+    for n, child_zone in enumerate(children):
+        if isinstance(child_zone, Zone):
+            write_zone(writer, child_zone, last=(n == n_children - 1), options=options)
+    if text is not None:
+        # Word segmentation as provided by DjVu.
+        write_text(writer, text)
+    writer.end()
+    if text is not None and zone_type == const.TEXT_ZONE_WORD and not last:
+        writer.set_tail(' ')
+
+def write_page(page_text, options, file=None):
+    '''
+    Write hOCR for the page.
+    '''
+    if file is None:
+        file = sys.stdout
+    writer = HocrWriter(file.write)
+    write_zone(writer, page_text, last=True, options=options)
+    writer.close()
 
 hocr_header_template = '''\
 <?xml version="1.0" encoding="UTF-8"?>
@@ -299,6 +514,91 @@ hocr_footer = '''
 </html>
 '''
 
+def read_pages(path, pages):
+    '''
+    Read sizes and text layers of the pages from a single djvused process.
+    Yield (page number, page size, page text) triples.
+    '''
+    sed_script = temporary.file(suffix='.djvused',mode="w")
+    for n in pages:
+        print('select {0}; size; print-txt'.format(n), file=sed_script)
+    sed_script.flush()
+    djvused = ipc.Subprocess(
+        ['djvused', '-f', sed_script.name, os.path.abspath(path)],
+        stdout=ipc.PIPE,
+    )
+    for n in pages:
+        try:
+            page_size = [
+                int(str(sexpr.Expression.from_stream(djvused.stdout).value).split('=')[1])
+                for i in range(2)
+            ]
+            page_text = sexpr.Expression.from_stream(djvused.stdout)
+        except sexpr.ExpressionSyntaxError:
+            break
+        yield n, page_size, page_text
+    djvused.wait()
+
+def render_page(page_size, page_text, options):
+    options.page_bbox = text_zones.BBox(0, 0, page_size[0], page_size[1])
+    page_zone = ZoneTable(page_text, page_size[1]).root
+    output = io.StringIO()
+    write_page(page_zone, options, file=output)
+    return output.getvalue()
+
+# Parallel processing
+# ===================
+
+# Each worker process reads a shard of consecutive pages with its own djvused
+# process. Shards are handed out a few at a time, so that at most
+# 2 × jobs shards are being processed or waiting to be written.
+
+max_shard_size = 64
+
+_shard_options = None
+
+def _init_shard_worker(argv):
+    global _shard_options
+    _shard_options = ArgumentParser().parse_args(argv[1:])
+
+def _process_shard(pages):
+    options = _shard_options
+    return [
+        (n, render_page(page_size, page_text, options))
+        for n, page_size, page_text in read_pages(options.path, pages)
+    ]
+
+def render_pages(options, argv):
+    '''
+    Yield (page number, hOCR) pairs in page order.
+    '''
+    if options.jobs <= 1:
+        for n, page_size, page_text in read_pages(options.path, options.pages):
+            yield n, render_page(page_size, page_text, options)
+        return
+    pages = list(options.pages)
+    shard_size = max(1, min(max_shard_size, -(-len(pages) // (4 * options.jobs))))
+    shards = (pages[i:i + shard_size] for i in range(0, len(pages), shard_size))
+    pool = multiprocessing.Pool(options.jobs, _init_shard_worker, (argv,))
+    try:
+        pending = collections.deque(
+            pool.apply_async(_process_shard, (shard,))
+            for shard in itertools.islice(shards, 2 * options.jobs)
+        )
+        while pending:
+            shard_result = pending.popleft().get()
+            for shard in itertools.islice(shards, 1):
+                pending.append(pool.apply_async(_process_shard, (shard,)))
+            for item in shard_result:
+                yield item
+            del shard_result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
 def main(argv=sys.argv):
     options = ArgumentParser().parse_args(argv[1:])
     logger.info('Converting {path}:'.format(path=utils.smart_repr(options.path, system_encoding)))
@@ -312,39 +612,32 @@ def main(argv=sys.argv):
         finally:
             djvused.wait()
         options.pages = range(1, n_pages + 1)
-    page_iterator = iter(options.pages)
-    sed_script = temporary.file(suffix='.djvused',mode="w")
-    for n in options.pages:
-        print('select {0}; size; print-txt'.format(n), file=sed_script)
-    sed_script.flush()
-    djvused = ipc.Subprocess(
-        ['djvused', '-f', sed_script.name, os.path.abspath(options.path)],
-        stdout=ipc.PIPE,
-    )
     ocr_system = 'djvu2hocr {ver}'.format(ver=__version__)
     hocr_header = hocr_header_template.format(
         ocr_system=ocr_system,
-        ocr_capabilities=' '.join(hocr.djvu2hocr_capabilities),
+        ocr_capabilities=' '.join(map(options.hocr_class, hocr.djvu2hocr_capabilities)),
         title=escape(options.title),
         css=escape(options.css),
     )
     if not options.css:
         hocr_header = re.sub(hocr_header_style_re, '', hocr_header, count=1)
-    sys.stdout.write(hocr_header)
-    for n in page_iterator:
-        try:
-            page_size = [
-                int(str(sexpr.Expression.from_stream(djvused.stdout).value).split('=')[1])
-                for i in range(2)
-            ]
-            options.page_bbox = text_zones.BBox(0, 0, page_size[0], page_size[1])
-            page_text = sexpr.Expression.from_stream(djvused.stdout)
-        except sexpr.ExpressionSyntaxError:
-            break
+    if options.page_dir is None:
+        sys.stdout.write(hocr_header)
+    else:
+        if not os.path.isdir(options.page_dir):
+            os.makedirs(options.page_dir)
+        page_number_width = len(str(max(options.pages or [0])))
+    for n, page_hocr in render_pages(options, argv):
         logger.info('- Page #{n}'.format(n=n))
-        page_zone = Zone(page_text, page_size[1])
-        process_page(page_zone, options)
-    sys.stdout.write(hocr_footer)
-    djvused.wait()
+        if options.page_dir is None:
+            sys.stdout.write(page_hocr)
+            continue
+        page_path = os.path.join(options.page_dir, options.page_template.format(n=n, width=page_number_width))
+        with io.open(page_path, 'w', encoding='UTF-8') as page_file:
+            page_file.write(hocr_header)
+            page_file.write(page_hocr)
+            page_file.write(hocr_footer)
+    if options.page_dir is None:
+        sys.stdout.write(hocr_footer)
 
 # vim:ts=4 sts=4 sw=4 et
@@ -14,11 +14,16 @@
 # for more details.
 
 import argparse
+import collections
+import io
+import itertools
+import multiprocessing
+import os
 import sys
 
 from .. import cli
 from .. import hocr
-from .. import text_zones
+from .. import ipc
 from .. import version
 
 __version__ = version.__version__
@@ -36,7 +41,7 @@ class ArgumentParser(cli.ArgumentParser):
         self.add_argument('--version', action=version.VersionAction)
         self.add_argument('--rotation', dest='rotation', action='store', type=int, default=0, help='page rotation (in degrees)')
         def size(s):
-            return map(int, s.split('x', 1))
+            return tuple(map(int, s.split('x', 1)))
         self.add_argument('--page-size', metavar='WxH', dest='page_size', action='store', type=size, default=None, help='page size (in pixels)')
         group = self.add_argument_group(title='word segmentation options')
         group.add_argument('-t', '--details', dest='details', choices=('lines', 'words', 'chars'), action='store', default='words', help='amount of text details to extract')
@@ -45,35 +50,136 @@ class ArgumentParser(cli.ArgumentParser):
         group.add_argument('-l', '--language', dest='language', help=argparse.SUPPRESS or 'language for word segmentation', default='eng')
         self.add_argument('--html5', dest='html5', action='store_true', help='use HTML5 parser')
         self.add_argument('--fix-utf8', dest='fix_utf8', action='store_true', help='attempt to fix UTF-8 encoding issues')
+        self.add_argument('--fallback', dest='fallback', action='store_true', help='parse with the fast HTML parser, resorting to --fix-utf8 and --html5 only where needed')
+        self.add_argument('--compact', dest='compact', action='store_true', help='write every text layer on a single line')
+        self.add_argument('--djvu', metavar='DJVU-FILE', dest='djvu_path', help='apply the text layers to this DjVu document rather than printing a djvused script')
+        self.add_argument('-j', '--jobs', metavar='N', dest='jobs', type=int, default=1, help='number of processes converting input files in parallel')
         self.add_argument('input_files', metavar='FILE', nargs='*', type=argparse.FileType('r'), default=[sys.stdin], help='hOCR file to parse (default: standard input)')
 
     def parse_args(self, args=None, namespace=None):
         options = cli.ArgumentParser.parse_args(self, args, namespace)
         if options.rotation % 90 != 0:
             self.error('rotation must be a multiple of 90 degrees')
+        if options.jobs < 1:
+            self.error('the number of jobs must be positive')
         options.details = self._details_map[options.details]
         options.uax29 = options.language if options.word_segmentation == 'uax29' else None
         del options.word_segmentation
         return options
 
-def get_texts(options):
+def extract_texts(file, options):
+    if options.fallback:
+        # Read raw bytes, so that broken UTF-8 can be detected and fixed:
+        file = getattr(file, 'buffer', file)
+    return hocr.extract_zones_iter(file,
+        rotation=options.rotation,
+        details=options.details,
+        uax29=options.uax29,
+        html5=options.html5,
+        fix_utf8=options.fix_utf8,
+        fallback=options.fallback,
+        page_size=options.page_size,
+    )
+
+def format_text(zone, options):
+    return zone.format_sexpr(width=None if options.compact else 80)
+
+# Parallel processing
+# ===================
+
+# Each worker process converts whole input files. Files are handed out a few
+# at a time, so that at most 2 × jobs files are being processed or waiting to
+# be written.
+
+_worker_options = None
+
+def _init_worker(options):
+    global _worker_options
+    _worker_options = options
+
+def _process_file(path):
+    with open(path, 'r') as file:
+        return [format_text(zone, _worker_options) for zone in extract_texts(file, _worker_options)]
+
+def render_texts(options):
+    '''
+    Yield formatted text layers, in input order.
+    '''
+    paths = []
+    for file in options.input_files:
+        if file is sys.stdin:
+            paths = None
+            break
+        paths += [file.name]
+    if options.jobs <= 1 or paths is None or len(paths) <= 1:
+        for file in options.input_files:
+            for zone in extract_texts(file, options):
+                yield format_text(zone, options)
+        return
     for file in options.input_files:
-        texts = hocr.extract_text(file,
-            rotation=options.rotation,
-            details=options.details,
-            uax29=options.uax29,
-            html5=options.html5,
-            fix_utf8=options.fix_utf8,
-            page_size=options.page_size,
+        file.close()
+    worker_options = argparse.Namespace(**vars(options))
+    del worker_options.input_files
+    paths = iter(paths)
+    pool = multiprocessing.Pool(options.jobs, _init_worker, (worker_options,))
+    try:
+        pending = collections.deque(
+            pool.apply_async(_process_file, (path,))
+            for path in itertools.islice(paths, 2 * options.jobs)
         )
-        for text in texts:
-            yield text
+        while pending:
+            file_texts = pending.popleft().get()
+            for path in itertools.islice(paths, 1):
+                pending.append(pool.apply_async(_process_file, (path,)))
+            for text in file_texts:
+                yield text
+            del file_texts
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def write_script(texts, file):
+    for i, text in enumerate(texts):
+        file.write('select {0}\nremove-txt\nset-txt\n'.format(i + 1))
+        file.write(text)
+        file.write('\n.\n\n')
+
+def apply_script(texts, djvu_path):
+    '''
+    Feed the script to a single djvused process as the texts become
+    available; the document is saved once, when the script ends.
+    '''
+    djvused = ipc.Subprocess(
+        ['djvused', '-s', os.path.abspath(djvu_path)],
+        stdin=ipc.PIPE,
+    )
+    script = io.TextIOWrapper(djvused.stdin, encoding='UTF-8')
+    try:
+        write_script(texts, script)
+        script.close()
+    except:
+        if djvused.poll() is None:
+            # Don't let djvused save a half-updated document.
+            djvused.kill()
+            try:
+                djvused.wait()
+            except ipc.CalledProcessInterrupted:
+                pass
+            raise
+        # djvused gave up on its own; its exit status tells more than EPIPE.
+        djvused.wait()
+        raise
+    djvused.wait()
 
 def main(argv=sys.argv):
     options = ArgumentParser().parse_args(argv[1:])
-    for i, text in enumerate(get_texts(options)):
-        sys.stdout.write('select {0}\nremove-txt\nset-txt\n'.format(i + 1))
-        text_zones.print_sexpr(text, sys.stdout, width=80)
-        sys.stdout.write('\n.\n\n')
+    texts = render_texts(options)
+    if options.djvu_path is None:
+        write_script(texts, sys.stdout)
+    else:
+        apply_script(texts, options.djvu_path)
 
 # vim:ts=4 sts=4 sw=4 et
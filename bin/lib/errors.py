@@ -22,6 +22,11 @@ class MalformedOcrOutput(Exception):
             'malformed OCR output: {msg}'
             .format(msg=message)
         )
+        self.message = message
+
+    def __reduce__(self):
+        # so that the exception survives being passed between processes
+        return (type(self), (self.message,))
 
 class MalformedHocr(MalformedOcrOutput):
 
@@ -30,6 +35,7 @@ class MalformedHocr(MalformedOcrOutput):
             'malformed hOCR document: {msg}'
             .format(msg=message)
         )
+        self.message = message
 
 EXIT_FATAL = 1
 
@@ -20,7 +20,9 @@ The hOCR format specification:
 http://kba.github.io/hocr-spec/1.2/
 '''
 
+import bisect
 import functools
+import logging
 import re
 import six
 
@@ -39,6 +41,8 @@ from . import unicode_support
 
 const = text_zones.const
 
+logger = logging.getLogger('ocrodjvu.hocr')
+
 TEXT_DETAILS_LINE = const.TEXT_ZONE_LINE
 TEXT_DETAILS_WORD = const.TEXT_ZONE_WORD
 TEXT_DETAILS_CHARACTER = const.TEXT_ZONE_CHARACTER
@@ -189,73 +193,168 @@ def _apply_bboxes(djvu_class, bbox_source, text, settings, page_size):
         ]
     return [text]
 
-def _scan(node, settings, page_size=None):
-
-    def get_children(node):
-        result = []
-        if node.text:
-            result += [node.text]
-        for child in node.iterchildren():
-            result += _scan(child, settings, page_size)
-            if child.tail:
-                result += [child.tail]
-        return result
-
-    if not isinstance(node.tag, str) or node.tag == 'script': ## 2to3: was basestring
-        # Ignore non-elements.
-        return []
-
-    title = node.get('title') or ''
+def _get_bbox(title):
     m = bbox_re.search(title)
     if m is None:
-        bbox = text_zones.BBox()
-    else:
-        bbox = text_zones.BBox(
-            *(int(m.group(ident))
-            for ident in ('x0', 'y0', 'x1', 'y1'))
-        )
+        return text_zones.BBox()
+    return text_zones.BBox(
+        *(int(m.group(ident))
+        for ident in ('x0', 'y0', 'x1', 'y1'))
+    )
 
+def _get_djvu_class(node, bbox, settings):
     if settings.cuneiform and settings.cuneiform <= (0, 8):
         # Cuneiform ≤ 0.8 doesn't mark OCR elements in an hOCR way.
-        djvu_class = cuneiform_tag_to_djvu(node.tag)
+        return cuneiform_tag_to_djvu(node.tag)
+    hocr_classes = (node.get('class') or '').split()
+    djvu_class = None
+    for hocr_class in hocr_classes:
+        if settings.tesseract and hocr_class == 'ocrx_word' and not bbox:
+            # Some versions of Tesseract > 3.00 use ocrx_word for its own
+            # purposes.
+            pass
+        else:
+            djvu_class = hocr_class_to_djvu(hocr_class)
+        if djvu_class:
+            break
     else:
-        hocr_classes = (node.get('class') or '').split()
-        djvu_class = None
-        for hocr_class in hocr_classes:
-            if settings.tesseract and hocr_class == 'ocrx_word' and not bbox:
-                # Some versions of Tesseract > 3.00 use ocrx_word for its own
-                # purposes.
-                pass
+        if node.tag == 'p':
+            # Cuneiform ≥ 0.9 doesn't mark paragraphs in an hOCR way.
+            djvu_class = cuneiform_tag_to_djvu(node.tag)
+    return djvu_class
+
+class _ScanResult(object):
+
+    '''
+    Scan results for the children of an element, in document order, and
+    what is known about them so far.
+
+    Bounding boxes of child zones are added to bbox, unless it is None.
+    '''
+
+    __slots__ = (
+        'items', 'bbox',
+        'has_string', 'has_nonempty_string',
+        'has_zone', 'has_char_zone', 'has_nonchar_zone',
+    )
+
+    def __init__(self, bbox=None):
+        self.items = []
+        self.bbox = bbox
+        self.has_string = self.has_nonempty_string = False
+        self.has_zone = self.has_char_zone = self.has_nonchar_zone = False
+
+    def add_text(self, text):
+        if text:
+            self.add(text)
+
+    def add(self, item):
+        if isinstance(item, six.string_types):  ## 2to3: was basestring
+            self.has_string = True
+            if item and not item.isspace():
+                self.has_nonempty_string = True
+        elif isinstance(item, text_zones.Zone):
+            self.has_zone = True
+            if item.type == const.TEXT_ZONE_CHARACTER:
+                self.has_char_zone = True
             else:
-                djvu_class = hocr_class_to_djvu(hocr_class)
-            if djvu_class:
-                break
+                self.has_nonchar_zone = True
+            if self.bbox is not None:
+                self.bbox.update(item.bbox)
         else:
-            if node.tag == 'p':
-                # Cuneiform ≥ 0.9 doesn't mark paragraphs in an hOCR way.
-                djvu_class = cuneiform_tag_to_djvu(node.tag)
+            raise TypeError('Unexpected {tp} object; expected a string or a text zone'.format(tp=type(item).__name__))
+        self.items += [item]
 
-    if not djvu_class:
-        # Just process our children.
-        return get_children(node)
+class _ScanFrame(object):
 
-    if djvu_class is const.TEXT_ZONE_PAGE:
-        if not bbox:
-            if settings.page_size is None:
-                raise errors.MalformedHocr("page without bounding box information")
-            page_width, page_height = page_size = settings.page_size
-            bbox = text_zones.BBox(0, 0, page_width, page_height)
+    __slots__ = ('node', 'children', 'result', 'page_size', 'title', 'bbox', 'djvu_class')
+
+    def __init__(self, node, children, result, page_size, title=None, bbox=None, djvu_class=None):
+        self.node = node
+        self.children = children
+        self.result = result
+        self.page_size = page_size
+        self.title = title
+        self.bbox = bbox
+        self.djvu_class = djvu_class
+
+def _scan(node, settings, page_size=None):
+    '''
+    Scan the element and its descendants, in a single pass.
+    Return a list of text zones and strings.
+
+    Elements that are not zones share the scan result of the innermost zone
+    that contains them, so their children are added to it directly.
+    '''
+    top_result = _ScanResult()
+    stack = [_ScanFrame(None, iter([node]), top_result, page_size)]
+    while True:
+        frame = stack[-1]
+        child = next(frame.children, None)
+        if child is None:
+            if frame.node is None:
+                return top_result.items
+            del stack[-1]
+            result = stack[-1].result
+            if frame.djvu_class:
+                for item in _scan_zone(frame, settings):
+                    result.add(item)
+            if frame.node is not node:
+                result.add_text(frame.node.tail)
+            continue
+        if not isinstance(child.tag, str) or child.tag == 'script': ## 2to3: was basestring
+            # Ignore non-elements.
+            if child is not node:
+                frame.result.add_text(child.tail)
+            continue
+
+        title = child.get('title') or ''
+        bbox = _get_bbox(title)
+        djvu_class = _get_djvu_class(child, bbox, settings)
+
+        if not djvu_class:
+            # Just process our children.
+            frame.result.add_text(child.text)
+            stack += [_ScanFrame(child, child.iterchildren(), frame.result, frame.page_size)]
+            continue
+
+        page_size = frame.page_size
+        if djvu_class is const.TEXT_ZONE_PAGE:
+            if not bbox:
+                if settings.page_size is None:
+                    raise errors.MalformedHocr("page without bounding box information")
+                page_width, page_height = page_size = settings.page_size
+                bbox = text_zones.BBox(0, 0, page_width, page_height)
+            else:
+                if (bbox.x0, bbox.y0) != (0, 0):
+                    raise errors.MalformedHocr("page's bounding box should start with (0, 0)")
+                page_size = bbox.x1, bbox.y1
+            # Bounding box of the whole page is not affected by its children.
+            result = _ScanResult()
+        elif page_size is None:
+            # At this point page size should be already known.
+            raise errors.MalformedHocr('unable to determine page size')
         else:
-            if (bbox.x0, bbox.y0) != (0, 0):
-                raise errors.MalformedHocr("page's bounding box should start with (0, 0)")
-            page_size = bbox.x1, bbox.y1
-    elif page_size is None:
-        # At this point page size should be already known.
-        raise errors.MalformedHocr('unable to determine page size')
-
-    has_string = has_nonempty_string = False
-    has_zone = has_char_zone = has_nonchar_zone = False
-    children = get_children(node)
+            result = _ScanResult(bbox)
+        result.add_text(child.text)
+        stack += [_ScanFrame(child, child.iterchildren(), result, page_size, title, bbox, djvu_class)]
+
+def _scan_zone(frame, settings):
+    '''
+    Turn a zone element whose children have been scanned into a list of
+    text zones and strings.
+    '''
+    node = frame.node
+    title = frame.title
+    bbox = frame.bbox
+    djvu_class = frame.djvu_class
+    page_size = frame.page_size
+    children = frame.result.items
+    has_string = frame.result.has_string
+    has_nonempty_string = frame.result.has_nonempty_string
+    has_zone = frame.result.has_zone
+    has_char_zone = frame.result.has_char_zone
+    has_nonchar_zone = frame.result.has_nonchar_zone
     if djvu_class is const.TEXT_ZONE_PAGE:
         empty = [text_zones.Zone(type=djvu_class, bbox=bbox)]
     else:
@@ -263,33 +362,12 @@ def _scan(node, settings, page_size=None):
     if len(children) == 0:
         return empty
 
-    for child in children:
-        if isinstance(child, six.string_types):  ## 2to3: was basestring
-            has_string = True
-            if child and not child.isspace():
-                has_nonempty_string = True
-        elif isinstance(child, text_zones.Zone):
-            has_zone = True
-            if child.type == const.TEXT_ZONE_CHARACTER:
-                has_char_zone = True
-            else:
-                has_nonchar_zone = True
-        else:
-            raise TypeError('Unexpected {tp} object; expected a string or a text zone'.format(tp=type(child).__name__))
-
     if has_zone:
         # Catch obvious inconsistencies early.
         if has_nonempty_string:
             raise errors.MalformedHocr("plain text intermixed with structural elements")
         if has_char_zone and has_nonchar_zone:
             raise errors.MalformedHocr("character zones intermixed with non-character zones")
-        if djvu_class is const.TEXT_ZONE_PAGE:
-            # Bounding box of the whole page is not affected by its children.
-            pass
-        else:
-            for child in children:
-                if isinstance(child, text_zones.Zone):
-                    bbox.update(child.bbox)
         if djvu_class >= const.TEXT_ZONE_LINE:
             if isinstance(children[-1], str) and children[-1].isspace():  ## 2to3: was basestring
                 del children[-1]
@@ -369,23 +447,26 @@ def _scan(node, settings, page_size=None):
 
     return [text_zones.Zone(type=djvu_class, bbox=bbox, children=children)]
 
-def scan(node, settings):
-    result = []
-    for zone in _scan(node, settings, settings.page_size):
+def _check_top_level_text(text):
+    if text and not text.isspace():
+        raise errors.MalformedHocr("plain text intermixed with structural elements")
+
+def _top_level_zones(scan_result, settings):
+    for zone in scan_result:
         if isinstance(zone, str):  ## 2to3: was basestring
-            if zone == '' or zone.isspace():
-                continue
-            else:
-                raise errors.MalformedHocr("plain text intermixed with structural elements")
+            _check_top_level_text(zone)
+            continue
         if not isinstance(zone, text_zones.Zone):
             raise TypeError('Unexpected {tp} object; expected a text zone'.format(tp=type(zone).__name__))
-        result += [zone]
         zone.rotate(settings.rotation)
-    return result
+        yield zone
+
+def scan(node, settings):
+    return list(_top_level_zones(_scan(node, settings, settings.page_size), settings))
 
 class ExtractSettings(object):
 
-    def __init__(self, rotation=0, details=TEXT_DETAILS_WORD, uax29=None, html5=None, fix_utf8=False, page_size=None):
+    def __init__(self, rotation=0, details=TEXT_DETAILS_WORD, uax29=None, html5=None, fix_utf8=False, fallback=False, page_size=None):
         self.rotation = rotation
         self.details = details
         if uax29 is not None:
@@ -397,6 +478,7 @@ class ExtractSettings(object):
         self.uax29 = uax29
         self.html5 = html5
         self.fix_utf8 = fix_utf8
+        self.fallback = fallback
         self.page_size = page_size
         self.cuneiform = None
         self.tesseract = None
@@ -417,6 +499,8 @@ def extract_tesseract_bbox_data(node):
             yield ch, (x0 + w * i // n, y0, x0 + w * (i + 1) // n, y1), -1
 
 def read_document(stream, settings):
+    if settings.fallback and not settings.html5 and not settings.fix_utf8:
+        return _read_document_with_fallback(stream)
     if settings.fix_utf8:
         # Fix UTF-8 encoding and get rid of control characters that are not
         # allowed in XML.
@@ -444,18 +528,125 @@ def read_document(stream, settings):
     else:
         return etree.parse(stream, etree.HTMLParser())
 
-def extract_text(stream, **kwargs):
+# Errors that the HTML parser reports for perfectly usable hOCR:
+_harmless_html_errors = frozenset([
+    etree.ErrorTypes.HTML_UNKNOWN_TAG,
+])
+
+def _read_document_with_fallback(stream):
     '''
-    Extract DjVu text from an hOCR stream.
+    Parse the document with the fast lxml HTML parser, resorting to
+    utils.sanitize_utf8() only if the document is not valid UTF-8, and
+    re-parsing with html5lib only the pages on which the HTML parser
+    reported errors.
+    '''
+    contents = stream.read()
+    if isinstance(contents, six.text_type):
+        contents = contents.encode('UTF-8')
+        parser = etree.HTMLParser(encoding='UTF-8')
+    else:
+        parser = etree.HTMLParser()
+    problem = utils.find_utf8_problem(contents)
+    if problem is not None:
+        logger.warning('hOCR is not clean UTF-8 ({0}); sanitizing it'.format(problem))
+        contents = utils.sanitize_utf8(contents)
+        parser = etree.HTMLParser(encoding='UTF-8')
+    doc = etree.ElementTree(etree.fromstring(contents, parser))
+    error_lines = sorted(set(
+        error.line
+        for error in parser.error_log
+        if error.level >= etree.ErrorLevels.ERROR and error.type not in _harmless_html_errors
+    ))
+    if error_lines:
+        _reparse_pages(doc, contents, error_lines)
+    return doc
+
+def _is_page(element):
+    return 'ocr_page' in (element.get('class') or '').split()
+
+def _enclosing_page(element):
+    for ancestor in element.iterancestors(tag=etree.Element):
+        if _is_page(ancestor):
+            return ancestor
+
+def _cut_before_page(line, tag):
+    '''
+    Return the part of the line that precedes the start tag of a page.
+    '''
+    match = re.search(b'<' + re.escape(tag.encode('ASCII')) + br'\b[^>]*\bocr_page\b', line)
+    if match is None:
+        return b''
+    return line[:match.start()]
 
-    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
-    uax29: None or a PyICU locale
+def _reparse_pages(doc, contents, error_lines):
     '''
-    settings = ExtractSettings(**kwargs)
-    doc = read_document(stream, settings)
-    ocr_system = doc.find('/head/meta[@name="ocr-system"]')
+    Re-parse with html5lib the pages on which the HTML parser reported errors.
+
+    Every page is assumed to span the lines from its start tag up to the
+    start tag of the next page. Runs of adjacent broken pages are re-parsed
+    together. Pages that the HTML parser nested inside a broken page (e.g.
+    because of an unclosed element) are moved out of it.
+    '''
+    pages = [element for element in doc.iter(tag=etree.Element) if _is_page(element)]
+    page_lines = [page.sourceline for page in pages]
+    broken = set()
+    for line in error_lines:
+        i = bisect.bisect_right(page_lines, line) - 1
+        if i >= 0:
+            broken.add(i)
+    if not broken:
+        return
+    lines = contents.split(b'\n')
+    encoding = doc.docinfo.encoding or 'UTF-8'
+    i = 0
+    while i < len(pages):
+        if i not in broken:
+            i += 1
+            continue
+        # Pages starting on the same line must be re-parsed together:
+        while i > 0 and page_lines[i - 1] == page_lines[i]:
+            i -= 1
+        j = i + 1
+        while j in broken or (j < len(pages) and page_lines[j] == page_lines[j - 1]):
+            j += 1
+        first_line = page_lines[i]
+        last_line = page_lines[j] if j < len(pages) else len(lines)
+        logger.warning('HTML errors near line(s) {lines} of hOCR; re-parsing page(s) {i}-{j} with html5lib'.format(
+            lines=', '.join(str(line) for line in error_lines if first_line <= line <= last_line),
+            i=i + 1,
+            j=j,
+        ))
+        chunk_lines = lines[first_line - 1:last_line]
+        if j < len(pages):
+            # The next page starts on the last line.
+            chunk_lines[-1] = _cut_before_page(chunk_lines[-1], pages[j].tag)
+        chunk = b'\n'.join(chunk_lines).decode(encoding, 'replace')
+        try:
+            new_pages = [element for element in html5_support.parse(chunk).iter(tag=etree.Element) if _is_page(element)]
+        except ImportError as ex:
+            logger.warning('{0}; keeping what the HTML parser could make of the page(s)'.format(ex))
+            return
+        if len(new_pages) < j - i:
+            logger.warning('html5lib found only {n} page(s); keeping what the HTML parser could make of them'.format(n=len(new_pages)))
+        else:
+            replaced = set(pages[i:j])
+            nested = [page for page in pages[j:] if _enclosing_page(page) in replaced]
+            for old_page, new_page in zip(pages[i:j], new_pages):
+                new_page.tail = old_page.tail
+                old_page.getparent().replace(old_page, new_page)
+            last_page = new_page
+            for page in nested:
+                last_page.addnext(page)
+                last_page = page
+        i = j
+
+def _detect_ocr_system(head, settings):
+    ocr_system = ocr_capabilities = None
+    if head is not None:
+        ocr_system = head.find('meta[@name="ocr-system"]')
+        ocr_capabilities = head.find('meta[@name="ocr-capabilities"]')
     if ocr_system is None:
-        if doc.find('/head/meta[@name="ocr-capabilities"]') is None:
+        if ocr_capabilities is None:
             # This is wild guess. However, since ocr-system is a required meta
             # tag, the hOCR we are processing is broken anyway.
             settings.cuneiform = (0, 8)
@@ -463,17 +654,141 @@ def extract_text(stream, **kwargs):
         settings.cuneiform = (0, 9)
     elif ocr_system.get('content').split()[0] == 'tesseract':
         settings.tesseract = True
-    if settings.details < TEXT_DETAILS_WORD or (settings.uax29 and settings.details <= text_zones.TEXT_DETAILS_WORD):
+
+def _needs_tesseract_bbox_data(settings):
+    return settings.details < TEXT_DETAILS_WORD or (settings.uax29 and settings.details <= text_zones.TEXT_DETAILS_WORD)
+
+def _extract_zones(doc, settings):
+    _detect_ocr_system(doc.find('/head'), settings)
+    if _needs_tesseract_bbox_data(settings):
         tesseract_bbox_data = doc.find('//script[@type="application/x-ocrodjvu-tesseract"]')
         if tesseract_bbox_data is not None:
             settings.tesseract = True
             tesseract_bbox_data = extract_tesseract_bbox_data(tesseract_bbox_data)
             settings.bbox_data = tesseract_bbox_data
-    scan_result = scan(doc.find('/body'), settings)
-    return [zone.sexpr for zone in scan_result]
+    return scan(doc.find('/body'), settings)
+
+def extract_zones(stream, **kwargs):
+    '''
+    Extract DjVu text from an hOCR stream, as a list of text_zones.Zone
+    objects.
+
+    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
+    uax29: None or a PyICU locale
+    '''
+    settings = ExtractSettings(**kwargs)
+    doc = read_document(stream, settings)
+    return _extract_zones(doc, settings)
+
+def extract_text(stream, **kwargs):
+    '''
+    Extract DjVu text from an hOCR stream.
+
+    details: TEXT_DETAILS_LINES or TEXT_DETAILS_WORD or TEXT_DETAILS_CHAR
+    uax29: None or a PyICU locale
+    '''
+    return [zone.sexpr for zone in extract_zones(stream, **kwargs)]
+
+def extract_text_iter(stream, **kwargs):
+    '''
+    Extract DjVu text from an hOCR stream, one page at a time.
+
+    See extract_zones_iter() for details.
+    '''
+    for zone in extract_zones_iter(stream, **kwargs):
+        yield zone.sexpr
+
+def extract_zones_iter(stream, **kwargs):
+    '''
+    Extract DjVu text from an hOCR stream, one page (text_zones.Zone object)
+    at a time.
+
+    Unlike extract_zones(), the document is parsed incrementally, and every
+    page is discarded as soon as its text has been extracted, so memory usage
+    doesn't grow with the number of pages.
+
+    The whole document is read at once (as extract_zones() does) with the
+    HTML5 parser, with fix_utf8 or fallback, for hOCR produced by
+    Cuneiform ≤ 0.8, and when Tesseract bounding box data might be needed.
+    '''
+    settings = ExtractSettings(**kwargs)
+    if settings.html5 or settings.fix_utf8 or settings.fallback or _needs_tesseract_bbox_data(settings):
+        for zone in extract_zones(stream, **kwargs):
+            yield zone
+        return
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    events = _read_events(stream, parser)
+    head = None
+    for event, element in events:
+        if event == 'end' and element.tag == 'head':
+            head = element
+        elif event == 'start' and element.tag == 'body':
+            break
+    else:
+        return
+    body = element
+    _detect_ocr_system(head, settings)
+    if _get_djvu_class(body, _get_bbox(body.get('title') or ''), settings):
+        # The whole body is a single zone (e.g. hOCR produced by Cuneiform ≤ 0.8).
+        for event, element in events:
+            pass
+        for zone in _extract_zones(body.getroottree(), settings):
+            yield zone
+        return
+    # Depth of the current element within the outermost zone that contains
+    # it, or 0 if there is no such zone:
+    zone_depth = 0
+    for event, element in events:
+        if zone_depth:
+            zone_depth += 1 if event == 'start' else -1
+            if zone_depth:
+                continue
+            for zone in _top_level_zones(_scan(element, settings, settings.page_size), settings):
+                yield zone
+            element.clear(keep_tail=True)
+            _drop_previous_siblings(element)
+        elif event == 'start':
+            if element.tag != 'script' and _get_djvu_class(element, _get_bbox(element.get('title') or ''), settings):
+                zone_depth = 1
+        else:
+            # Everything inside this element has been dealt with; only the
+            # plain text is left to be checked.
+            if element.tag != 'script':
+                _check_top_level_text(element.text)
+            for child in element:
+                _check_top_level_text(child.tail)
+            element.clear(keep_tail=True)
+            if element is body:
+                break
+            _drop_previous_siblings(element)
+    for event, element in events:
+        pass
+
+def _drop_previous_siblings(element):
+    '''
+    Remove from the tree the siblings that precede the element; they have
+    been dealt with already, except for the plain text that follows them.
+    '''
+    parent = element.getparent()
+    while element.getprevious() is not None:
+        _check_top_level_text(parent[0].tail)
+        del parent[0]
+
+def _read_events(stream, parser, chunk_size=(1 << 16)):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        for event in parser.read_events():
+            yield event
+    parser.close()
+    for event in parser.read_events():
+        yield event
 
 __all__ = [
-    'extract_text',
+    'extract_text', 'extract_text_iter',
+    'extract_zones', 'extract_zones_iter',
     'TEXT_DETAILS_LINE', 'TEXT_DETAILS_WORD', 'TEXT_DETAILS_CHARACTER'
 ]
 
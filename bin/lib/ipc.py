@@ -23,6 +23,7 @@ import re
 import signal
 import warnings
 import sys
+import time
 
 from . import utils
 
@@ -88,6 +89,10 @@ del get_signal_names
 
 class Subprocess(subprocess.Popen):
 
+    # Resource usage of the child, once it has been waited for (where
+    # os.wait4() is available)
+    rusage = None
+
     @classmethod
     def override_env(cls, override):
         env = os.environ
@@ -117,6 +122,8 @@ class Subprocess(subprocess.Popen):
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(' '.join(pipes.quote(s) for s in commandline))
         self.__command = commandline[0]
+        self.__start_time = time.time()
+        self.__usage_logged = False
         try:
             subprocess.Popen.__init__(self, *args, **kwargs)
         except EnvironmentError as ex:
@@ -127,8 +134,45 @@ class Subprocess(subprocess.Popen):
             ex.filename = self.__command
             raise
 
+    def _wait4(self):
+        # Reap the child with os.wait4(), to keep its resource usage.
+        try:
+            (pid, status, self.rusage) = os.wait4(self.pid, 0)
+        except OSError as ex:
+            if ex.errno != errno.ECHILD:
+                raise
+            # Already reaped, by a poll() from another thread; Popen.wait()
+            # knows the status.
+            return
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def _log_usage(self):
+        if self.__usage_logged or not logger.isEnabledFor(logging.DEBUG):
+            return
+        self.__usage_logged = True
+        wall_time = time.time() - self.__start_time
+        rusage = self.rusage
+        if rusage is None:
+            logger.debug('{cmd}: {wall:.3f}s wall'.format(cmd=self.__command, wall=wall_time))
+            return
+        max_rss = rusage.ru_maxrss
+        if sys.platform == 'darwin':
+            max_rss //= 1024
+        logger.debug(
+            '{cmd}: {wall:.3f}s wall, {user:.3f}s user, {sys:.3f}s system, {rss} KiB max RSS'.format(
+                cmd=self.__command, wall=wall_time,
+                user=rusage.ru_utime, sys=rusage.ru_stime, rss=max_rss,
+            )
+        )
+
     def wait(self, *args, **kwargs):
+        if self.returncode is None and not (args or kwargs) and hasattr(os, 'wait4'):
+            self._wait4()
         return_code = subprocess.Popen.wait(self, *args, **kwargs)
+        self._log_usage()
         if return_code > 0:
             raise CalledProcessError(return_code, self.__command)
         if return_code < 0:
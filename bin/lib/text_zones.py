@@ -21,6 +21,8 @@ except ImportError:
 else:  # no coverage
     set_dll_search_path()
 
+import re
+
 from . import utils
 
 try:
@@ -74,13 +76,16 @@ class BBox(object):
         )
 
     def update(self, bbox):
-        for i, self_i in enumerate(self._coordinates):
-            if self_i is None:
-                self._coordinates[i] = bbox[i]
-            elif i < 2 and bbox[i] is not None and self[i] > bbox[i]:
-                self._coordinates[i] = bbox[i]
-            elif i > 1 and bbox[i] is not None and self[i] < bbox[i]:
-                self._coordinates[i] = bbox[i]
+        coordinates = self._coordinates
+        x0, y0, x1, y1 = bbox
+        if coordinates[0] is None or (x0 is not None and coordinates[0] > x0):
+            coordinates[0] = x0
+        if coordinates[1] is None or (y0 is not None and coordinates[1] > y0):
+            coordinates[1] = y0
+        if coordinates[2] is None or (x1 is not None and coordinates[2] < x1):
+            coordinates[2] = x1
+        if coordinates[3] is None or (y1 is not None and coordinates[3] < y1):
+            coordinates[3] = y1
 
 class Space(object):
     pass
@@ -110,22 +115,27 @@ class Zone(object):
             for child in self.children
             if not isinstance(child, Space)
         ] or ['']
-        x0, y0, x1, y1 = self.bbox
-        if x0 > x1:
-            x0, x1 = x1, x0
-        elif x0 == x1:
-            x1 += 1
-        if y0 > y1:
-            y0, y1 = y1, y0
-        elif y0 == y1:
-            y1 += 1
-        assert x0 < x1
-        assert y0 < y1
         return sexpr.Expression(
-            [self.type, x0, y0, x1, y1] +
+            [self.type] + list(_sexpr_bbox(self.bbox)) +
             children
         )
 
+    def format_sexpr(self, width=None):
+        '''
+        Return the zone as djvused text-layer syntax, as printed by
+        print_sexpr(self.sexpr, file, width), but without creating
+        sexpr.Expression objects.
+
+        If width is None, everything is written on a single line.
+        '''
+        layout = _SexprLayout(self)
+        output = []
+        if width is None:
+            layout.format_compact(output)
+        else:
+            layout.format(output, 0, width)
+        return ''.join(output)
+
     def __iter__(self):
         return iter(self.children)
 
@@ -150,6 +160,16 @@ class Zone(object):
             chld=self.children,
         )
 
+    def walk(self):
+        '''
+        Iterate over this zone and all its descendant zones, in document order.
+        '''
+        stack = [self]
+        while stack:
+            zone = stack.pop()
+            yield zone
+            stack += [child for child in reversed(zone.children) if isinstance(child, Zone)]
+
     def rotate(self, rotation, xform=None):
         for x in self.bbox:
             assert x is not None
@@ -167,6 +187,24 @@ class Zone(object):
                 xform = decode.AffineTransform((0, 0) + page_size, (0, 0) + page_size)
             xform.mirror_y()
             xform.rotate(rotation)
+        coefficients = affine_coefficients(xform.inverse, self.bbox)
+        if coefficients is None:
+            self._rotate(rotation, xform)
+            return
+        (a, b, c, d, e, f) = coefficients
+        for zone in self.walk():
+            x0, y0, x1, y1 = zone.bbox
+            assert None not in (x0, y0, x1, y1)
+            x0, y0, x1, y1 = a * x0 + b * y0 + c, d * x0 + e * y0 + f, a * x1 + b * y1 + c, d * x1 + e * y1 + f
+            if x0 > x1:
+                x0, x1 = x1, x0
+            if y0 > y1:
+                y0, y1 = y1, y0
+            zone.bbox = x0, y0, x1, y1
+
+    def _rotate(self, rotation, xform):
+        for x in self.bbox:
+            assert x is not None
         x0, y0, x1, y1 = self.bbox
         x0, y0 = xform.inverse((x0, y0))
         x1, y1 = xform.inverse((x1, y1))
@@ -177,7 +215,29 @@ class Zone(object):
         self.bbox = x0, y0, x1, y1
         for child in self:
             if isinstance(child, Zone):
-                child.rotate(rotation, xform)
+                child._rotate(rotation, xform)
+
+def affine_coefficients(mapping, bbox):
+    '''
+    Find (a, b, c, d, e, f) such that mapping((x, y)) is
+    (a * x + b * y + c, d * x + e * y + f).
+
+    Three points determine the coefficients; the corners of the bbox are
+    used to check them. Return None if the mapping is not affine on integer
+    points (e.g. because of rounding).
+    '''
+    c, f = mapping((0, 0))
+    a, d = mapping((1, 0))
+    b, e = mapping((0, 1))
+    a -= c
+    d -= f
+    b -= c
+    e -= f
+    x0, y0, x1, y1 = bbox
+    for x, y in (x0, y0), (x0, y1), (x1, y0), (x1, y1):
+        if tuple(mapping((x, y))) != (a * x + b * y + c, d * x + e * y + f):
+            return None
+    return a, b, c, d, e, f
 
 def group_words(zones, details, word_break_iterator):
     text = ''.join(z[0] for z in zones)
@@ -185,23 +245,8 @@ def group_words(zones, details, word_break_iterator):
         # One zone per line
         return [text]
     # One zone per word
-    split_zones = []
-    for zone in zones:
-        zone_text = zone[0]
-        if len(zone_text) == 1:
-            split_zones += [zone]
-            continue
-        x0, y0, x1, y1 = zone.bbox
-        w = x1 - x0
-        m = len(zone_text)
-        split_zones += [
-            Zone(zone.type, BBox(x0 + w * n // m, y0, x0 + w * (n + 1) // m, y1))
-            for n, ch in enumerate(zone_text)
-        ]
-        del x0, y0, x1, y1  # quieten pyflakes
-    zones = split_zones
-    del split_zones
-    assert len(text) == len(zones)
+    char_bboxes = _split(zones)
+    assert len(text) == len(char_bboxes)
     words = []
     i = 0
     for j in word_break_iterator(text):
@@ -209,22 +254,147 @@ def group_words(zones, details, word_break_iterator):
         if subtext.isspace():
             i = j
             continue
-        bbox = BBox()
-        for k in range(i, j):
-            bbox.update(zones[k].bbox)
+        if j - i == 1:
+            bbox = char_bboxes[i]
+        else:
+            x0, y0, x1, y1 = zip(*char_bboxes[i:j])
+            bbox = min(x0), min(y0), max(x1), max(y1)
         last_word = Zone(type=const.TEXT_ZONE_WORD, bbox=bbox)
         words += [last_word]
         if details > TEXT_DETAILS_CHARACTER:
             last_word += [subtext]
         else:
             last_word += [
-                Zone(type=const.TEXT_ZONE_CHARACTER, bbox=(x0, y0, x1, y1), children=[ch])
+                Zone(type=const.TEXT_ZONE_CHARACTER, bbox=char_bboxes[k], children=[text[k]])
                 for k in range(i, j)
-                for (x0, y0, x1, y1), ch in [(zones[k].bbox, text[k])]
             ]
         i = j
     return words
 
+def _split(zones):
+    '''
+    Split multi-character zones into equal-width characters.
+    Return bboxes of the characters.
+    '''
+    char_bboxes = []
+    for zone in zones:
+        m = len(zone[0])
+        if m == 1:
+            # Whitespace between zones has no bbox.
+            char_bboxes += [zone.bbox if isinstance(zone, Zone) else None]
+            continue
+        x0, y0, x1, y1 = zone.bbox
+        w = x1 - x0
+        char_bboxes += [
+            (x0 + w * n // m, y0, x0 + w * (n + 1) // m, y1)
+            for n in range(m)
+        ]
+    return char_bboxes
+
+# S-expression output
+# ===================
+
+def _sexpr_bbox(bbox):
+    x0, y0, x1, y1 = bbox
+    if x0 > x1:
+        x0, x1 = x1, x0
+    elif x0 == x1:
+        x1 += 1
+    if y0 > y1:
+        y0, y1 = y1, y0
+    elif y0 == y1:
+        y1 += 1
+    assert x0 < x1
+    assert y0 < y1
+    return x0, y0, x1, y1
+
+_sexpr_escapes = {
+    '"': '\\"',
+    '\\': '\\\\',
+    '\a': '\\a',
+    '\b': '\\b',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\v': '\\v',
+    '\f': '\\f',
+    '\r': '\\r',
+}
+
+_sexpr_escape_re = re.compile(r'["\\\x00-\x1F\x7F]')
+
+def _sexpr_escape(match):
+    char = match.group()
+    try:
+        return _sexpr_escapes[char]
+    except KeyError:
+        return '\\{0:03o}'.format(ord(char))
+
+def format_sexpr_string(s):
+    '''
+    Quote a string the way python-djvulibre prints it with
+    escape_unicode=False: only the quote, the backslash and control
+    characters are escaped.
+    '''
+    return '"' + _sexpr_escape_re.sub(_sexpr_escape, s) + '"'
+
+class _SexprLayout(object):
+
+    '''
+    A zone's s-expression split into pieces, each knowing the length it would
+    take on a single line.
+
+    Lengths are counted in UTF-8 bytes, as miniexp's pretty printer counts
+    columns.
+    '''
+
+    __slots__ = ('head', 'items', 'length')
+
+    def __init__(self, zone):
+        self.head = '({0} {1} {2} {3} {4}'.format(zone.type, *_sexpr_bbox(zone.bbox))
+        items = self.items = []
+        length = len(self.head) + 1
+        for child in zone.children:
+            if isinstance(child, Zone):
+                child = _SexprLayout(child)
+                length += child.length + 1
+            elif isinstance(child, Space):
+                continue
+            else:
+                child = format_sexpr_string(child)
+                length += len(child.encode('UTF-8')) + 1
+            items += [child]
+        if not items:
+            items += ['""']
+            length += 3
+        self.length = length
+
+    def format_compact(self, output):
+        output += [self.head]
+        for item in self.items:
+            if isinstance(item, _SexprLayout):
+                output += [' ']
+                item.format_compact(output)
+            else:
+                output += [' ', item]
+        output += [')']
+
+    def format(self, output, indent, width):
+        # Lay out the expression the way miniexp_pprint() does: if it doesn't
+        # fit on the current line, every sub-list goes on a line of its own,
+        # indented by one more column.
+        if indent + self.length <= width:
+            self.format_compact(output)
+            return
+        output += [self.head]
+        indent += 1
+        for item in self.items:
+            if isinstance(item, _SexprLayout):
+                output += ['\n', ' ' * indent]
+                item.format(output, indent, width)
+            else:
+                output += [' ', item]
+        output += [')']
+
 try:
     sexpr.Expression(0).as_string(escape_unicode=True)
 except TypeError:
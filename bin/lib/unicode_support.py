@@ -13,6 +13,8 @@
 # FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License
 # for more details.
 
+import threading
+
 from . import utils
 
 def get_icu():
@@ -37,6 +39,23 @@ def simple_word_break_iterator(text):
             space = not space
     yield len(text)
 
+_icu_word_break_iterators = threading.local()
+
+def _get_icu_word_break_iterator(locale):
+    # Creating an ICU break iterator is expensive (it loads the break rules),
+    # so every thread keeps one per locale and only resets its text.
+    try:
+        cache = _icu_word_break_iterators.cache
+    except AttributeError:
+        cache = _icu_word_break_iterators.cache = {}
+    key = locale.getName()
+    try:
+        return cache[key]
+    except KeyError:
+        icu = get_icu()
+        break_iterator = cache[key] = icu.BreakIterator.createWordInstance(locale)
+        return break_iterator
+
 def word_break_iterator(text, locale=None):
     '''
     Create an instance of word break iterator.
@@ -46,9 +65,10 @@ def word_break_iterator(text, locale=None):
     '''
     if locale is None:
         return simple_word_break_iterator(text)
-    icu = get_icu()
-    break_iterator = icu.BreakIterator.createWordInstance(locale)
+    break_iterator = _get_icu_word_break_iterator(locale)
     break_iterator.setText(text)
-    return break_iterator
+    # The break iterator is reused for the next text, so the positions must be
+    # collected before returning.
+    return list(break_iterator)
 
 # vim:ts=4 sts=4 sw=4 et
@@ -24,9 +24,11 @@ import six
 from six.moves import range
 import sys
 
-def enhance_import_error(exception, package, homepage):
+def enhance_import_error(exception, package, debian_package, homepage):
     message = str(exception)
     message += '; please install the {pkg} package'.format(pkg=package)
+    if debian_package is not None:
+        message += ' ({deb} in Debian)'.format(deb=debian_package)
     message += ' <{url}>'.format(url=homepage)
     exception.args = [message]
     exception.msg = [message]
@@ -86,19 +88,19 @@ def sanitize_utf8(text):
     Replace invalid UTF-8 sequences and control characters (except CR, LF, TAB
     and space) with Unicode replacement characters.
     '''
-    if isinstance(text,six.binary_type):
+    binary = isinstance(text, six.binary_type)
+    if binary:
         try:
             text = text.decode('UTF-8')
         except UnicodeDecodeError as exc:
             text = text.decode('UTF-8', 'replace')
             message = str(exc)
-            message = re.sub("^'utf8' codec can't decode ", '', message)
+            message = re.sub("^'utf-?8' codec can't decode ", '', message)
             warnings.warn(
                 message,
                 category=EncodingWarning,
                 stacklevel=2,
             )
-        text = text.encode('UTF-8')
     match = _control_characters_regex.search(text)
     if match:
         byte = ord(match.group())
@@ -113,8 +115,27 @@ def sanitize_utf8(text):
     # allowed in UTF-8), but which Python happily accept. However, they haven't
     # seemed to occur in real-world documents.
     # http://www.w3.org/TR/2008/REC-xml-20081126/#NT-Char
+    if binary:
+        text = text.encode('UTF-8')
     return text
 
+def find_utf8_problem(data):
+    '''
+    Describe the first invalid UTF-8 sequence or control character (except
+    CR, LF and TAB) in the bytes, i.e. the first thing that sanitize_utf8()
+    would replace. Return None if there is no such thing.
+
+    Positions are byte offsets into data.
+    '''
+    try:
+        text = data.decode('UTF-8')
+    except UnicodeDecodeError as exc:
+        return 'byte 0x{byte:02x} in position {i}: invalid UTF-8'.format(byte=six.indexbytes(data, exc.start), i=exc.start)
+    match = _control_characters_regex.search(text)
+    if match:
+        i = len(text[:match.start()].encode('UTF-8'))
+        return 'byte 0x{byte:02x} in position {i}: control character'.format(byte=ord(match.group()), i=i)
+
 def identity(x):
     '''
     identity(x) -> x
@@ -28,8 +28,12 @@ a = Analysis(
     hiddenimports=[
         'tkinter',
         'tkinterdnd2',
+        'djvu2pdf_cancel',
         'djvu2pdf_converter',
+        'djvu2pdf_progress',
+        'djvu2pdf_session',
         'djvu2pdf_toc_parser',
+        'djvu2pdf_trace',
     ],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+asyncio API of the converter
+
+AsyncDjVu2PDFConverter.convert() is a coroutine. The external tools run
+as asyncio subprocesses and djvused is read through asyncio pipes, so a
+single event loop can drive many conversions at once, without a thread
+per conversion. Cancelling the task that awaits convert() kills the
+command that is running, stops djvused and removes the work directory.
+
+Stages can be limited across all the conversions of a converter: with
+stage_limits={"extract": 2, "pdf": 1}, at most two conversions run ddjvu
+at the same time, and only one runs pdfbeads. The stage names are those of
+the progress events.
+
+Progress events go to event_callback, which may be a coroutine function.
+Events are delivered in order, one at a time, and all of them have been
+delivered when convert() returns.
+
+Example::
+
+    converter = AsyncDjVu2PDFConverter(stage_limits={"pdf": 2})
+    await asyncio.gather(*(converter.convert(path, path.with_suffix(".pdf")) for path in paths))
+"""
+
+import argparse
+import asyncio
+import contextlib
+import inspect
+import os
+import subprocess
+import sys
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Dict, Optional
+
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
+from djvu2pdf_converter import (ConversionOutputs, DjVu2PDFConverter, InputSource, OutputTarget, _Command,
+                                 _ExtraOutputWriter, _Query, _Stage)
+from djvu2pdf_progress import STAGE_COSTS, ProgressTracker
+from djvu2pdf_session import DEFAULT_TIMEOUT, DjVuDocumentSession
+
+# The stages that keep a CPU busy; the others mostly wait for djvused or the disk
+DEFAULT_STAGE_LIMITS = {stage: os.cpu_count() or 1 for stage in ("extract", "split", "pdf")}
+
+# djvused prints a page's text layer on one line per zone, but be generous
+_LINE_LIMIT = 1 << 24
+
+
+class AsyncDjVuDocumentSession:
+    """
+    The queries of DjVuDocumentSession, answered through asyncio pipes
+
+    djvused runs scripts and is read from as DjVuDocumentSession does it.
+    Use the session as an async context manager, which stops djvused.
+    """
+
+    def __init__(self, input_file: Path, djvused: str = "djvused", timeout: Optional[float] = DEFAULT_TIMEOUT):
+        """
+        Args:
+            input_file: Path to DjVu file
+            djvused: djvused executable to run
+            timeout: Seconds djvused may stay silent while answering; None waits forever
+        """
+        self.input_file = Path(input_file)
+        self.djvused = str(djvused)
+        self.timeout = timeout
+        self._process = None
+        self._next_page = None
+        self._stderr = None
+        self._scripts = None
+        self._script_count = 0
+        self._lock = asyncio.Lock()
+        self._page_count = None
+        self._page_sizes = {}
+        self._page_texts = {}
+        self._outline = None
+        self._page_ids = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    def kill(self):
+        """Stop djvused at once"""
+        if self._process is not None and self._process.returncode is None:
+            try:
+                self._process.kill()
+            except OSError:
+                pass
+
+    async def start(self):
+        """Prepare the session; djvused is started when queries are asked"""
+        self._stderr = tempfile.TemporaryFile()
+        self._scripts = tempfile.TemporaryDirectory(prefix="djvused-")
+
+    async def _stop(self):
+        """Stop the djvused process running, if any"""
+        process, self._process = self._process, None
+        self._next_page = None
+        if process is not None:
+            if process.returncode is None:
+                with contextlib.suppress(OSError):
+                    process.kill()
+            await process.wait()
+
+    async def close(self):
+        """Stop djvused; memoized answers stay available"""
+        try:
+            await self._stop()
+        finally:
+            if self._scripts is not None:
+                self._scripts.cleanup()
+            if self._stderr is not None:
+                self._stderr.close()
+
+    def _error(self, message: str) -> RuntimeError:
+        """Build an error including whatever djvused printed on stderr"""
+        error_msg = f"{message}: djvused {self.input_file}\n"
+        try:
+            self._stderr.seek(0)
+            stderr = self._stderr.read().decode('utf-8', 'replace')
+        except (OSError, ValueError):
+            stderr = ''
+        if stderr:
+            error_msg += f"Error output: {stderr}"
+        return RuntimeError(error_msg)
+
+    async def _start(self, commands: str):
+        """Start djvused on a script, in place of the process running"""
+        await self._stop()
+        self._script_count += 1
+        script = Path(self._scripts.name) / f"script{self._script_count}.djvused"
+        script.write_text(commands, encoding='utf-8')
+        # -u: print text as UTF-8 rather than octal escapes
+        self._process = await asyncio.create_subprocess_exec(
+            self.djvused, "-u", "-f", str(script), str(self.input_file),
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=self._stderr,
+            limit=_LINE_LIMIT,
+        )
+
+    async def _readline(self) -> Optional[str]:
+        """The next line djvused prints, or None once it has exited successfully"""
+        process = self._process
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), self.timeout)
+        except asyncio.TimeoutError:
+            await self._stop()
+            raise self._error(f"djvused printed nothing for {self.timeout:g} seconds") from None
+        if not line:
+            self._process = None
+            if await process.wait() != 0:
+                raise self._error("djvused exited unexpectedly")
+            return None
+        return line.decode('utf-8', 'replace')
+
+    async def _read_answer(self, sentinel: Optional[str] = None) -> str:
+        """Everything djvused prints up to ``sentinel`` (excluded), or up to its end"""
+        lines = []
+        while True:
+            line = await self._readline()
+            if line is None:
+                if sentinel is not None:
+                    raise self._error("djvused exited unexpectedly")
+                return ''.join(lines)
+            if line == sentinel:
+                return ''.join(lines)
+            lines.append(line)
+
+    async def _query(self, command: str) -> str:
+        """Run djvused commands and return everything they printed"""
+        await self._start(f"{command}\n")
+        return await self._read_answer()
+
+    async def _count_pages(self):
+        if self._page_count is None:
+            self._page_count = int(await self._query("n"))
+
+    async def page_count(self) -> int:
+        """Number of pages in the document"""
+        async with self._lock:
+            await self._count_pages()
+        return self._page_count
+
+    async def _load_page(self, page: int):
+        async with self._lock:
+            await self._count_pages()
+            if not 1 <= page <= self._page_count:
+                raise self._error(f"No page {page} in a document of {self._page_count} pages")
+            if self._process is None or self._next_page != page:
+                await self._start(DjVuDocumentSession._pages_script(page, self._page_count))
+            self._next_page = page + 1
+            output = await self._read_answer(f"{self._page_count}\n")
+            size_match = DjVuDocumentSession._size_re.match(output)
+            if size_match is None:
+                raise self._error(f"Cannot determine the size of page {page}")
+            self._page_sizes[page] = int(size_match.group('width')), int(size_match.group('height'))
+            self._page_texts[page] = output[size_match.end():].strip()
+            if page == self._page_count:
+                await self._stop()
+
+    async def page_size(self, page: int):
+        """(width, height) of a page (1-indexed)"""
+        if page not in self._page_sizes:
+            await self._load_page(page)
+        return self._page_sizes[page]
+
+    async def page_text(self, page: int) -> str:
+        """Text layer of a page (1-indexed) as an s-expression, or '' if it has none"""
+        if page not in self._page_texts:
+            await self._load_page(page)
+        return self._page_texts[page]
+
+    async def outline(self) -> str:
+        """Document outline as printed by djvused, or '' if there is none"""
+        if self._outline is None:
+            async with self._lock:
+                self._outline = (await self._query("print-outline")).strip()
+        return self._outline
+
+    async def page_ids(self) -> Dict[str, int]:
+        """Page numbers by page id and by page title"""
+        if self._page_ids is None:
+            async with self._lock:
+                self._page_ids = DjVuDocumentSession._parse_page_ids(await self._query("ls"))
+        return self._page_ids
+
+    def forget_page(self, page: int):
+        """Drop the memoized text of a page that will not be asked for again"""
+        self._page_texts.pop(page, None)
+
+
+class AsyncDjVu2PDFConverter(DjVu2PDFConverter):
+    """Converter whose convert() is a coroutine"""
+
+    def __init__(self, bin_dir: Optional[Path] = None, progress_callback=None, tracer=None,
+                 event_callback=None, progress_interval: float = 0.1,
+                 stage_limits: Optional[Dict[str, Optional[int]]] = None):
+        """
+        Initialize converter
+
+        Args:
+            bin_dir, progress_callback, tracer, progress_interval: As for DjVu2PDFConverter
+            event_callback: Function or coroutine function to call with a
+                    ProgressEvent for every progress update
+            stage_limits: Most conversions that may be in each stage at the
+                    same time, by stage name; None lifts a limit. Merged into
+                    DEFAULT_STAGE_LIMITS
+        """
+        super().__init__(bin_dir, progress_callback, tracer, event_callback, progress_interval)
+        limits = dict(DEFAULT_STAGE_LIMITS, **(stage_limits or {}))
+        unknown = set(limits) - set(STAGE_COSTS)
+        if unknown:
+            raise ValueError(f"Unknown stage: {', '.join(sorted(unknown))}")
+        if any(limit is not None and limit < 1 for limit in limits.values()):
+            raise ValueError("Stage limits must be positive")
+        self.stage_limits = {stage: limit for stage, limit in limits.items() if limit is not None}
+        # One set of semaphores per event loop: they cannot be shared between loops
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    @contextlib.asynccontextmanager
+    async def _limit(self, stage: str):
+        """Wait until the conversion may enter ``stage``"""
+        limit = self.stage_limits.get(stage)
+        if limit is None:
+            yield
+            return
+        semaphores = self._semaphores.setdefault(asyncio.get_running_loop(), {})
+        if stage not in semaphores:
+            semaphores[stage] = asyncio.Semaphore(limit)
+        async with semaphores[stage]:
+            yield
+
+    async def _run_command_async(self, cmd: list, cwd: Path) -> subprocess.CompletedProcess:
+        """Run a command and return the result"""
+        self._resolve_command(cmd)
+        try:
+            return await self.tracer.run_async(cmd, cwd=cwd, check=True)
+        except subprocess.CalledProcessError as e:
+            raise self._command_error(cmd, e) from e
+
+    async def _deliver_events(self, events: asyncio.Queue):
+        """Pass progress events on in order until None comes"""
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            self.progress_callback(event.message, int(event.percent))
+            result = self.event_callback(event)
+            if inspect.isawaitable(result):
+                await result
+
+    async def convert(self, input_file: InputSource, output_file: OutputTarget,
+                      outputs: Optional[ConversionOutputs] = None, cancel: Optional[CancellationToken] = None) -> None:
+        """
+        Convert DjVu file to PDF
+
+        Args:
+            input_file: Path to input .djvu file, its contents as bytes, or a
+                    binary stream to read it from. Files and streams are read
+                    and written in the loop's default executor
+            output_file: Path to output .pdf file, or a binary stream to write it to
+            outputs: Additional outputs to produce from the same decode
+            cancel: Token to cancel the conversion with from another thread, as
+                    if the task had been cancelled; convert() then raises
+                    ConversionCancelled
+
+        Raises:
+            ConversionCancelled: The conversion was cancelled through ``cancel``
+        """
+        input_file = self._input_source(input_file)
+        output_file = self._output_target(output_file)
+
+        extra_outputs = _ExtraOutputWriter(self, outputs)
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        # Held page events are delivered by the loop too
+        progress = ProgressTracker(events.put_nowait, self.progress_interval, timer=loop.call_later)
+        progress.start()
+        delivery = asyncio.ensure_future(self._deliver_events(events))
+
+        task = asyncio.current_task()
+        finished = False
+
+        def cancel_task():
+            # Runs in the loop: the conversion may have ended since the token was cancelled
+            if not finished:
+                task.cancel()
+
+        on_cancel = contextlib.nullcontext()
+        if cancel is not None:
+            on_cancel = cancel.on_cancel(lambda: loop.call_soon_threadsafe(cancel_task))
+
+        try:
+            with on_cancel, tempfile.TemporaryDirectory() as tmpdir:
+                tmpdir = Path(tmpdir)
+                temp_input = tmpdir / "input.djvu"
+                await _in_thread(self._spool_input, input_file, temp_input)
+
+                djvused = self._resolve_command(["djvused"])[0]
+                with extra_outputs, self.tracer.span("convert", input=self._describe_input(input_file)):
+                    async with AsyncDjVuDocumentSession(temp_input, djvused) as session:
+                        await self._convert_with_session_async(session, temp_input, output_file, tmpdir,
+                                                               extra_outputs, progress, cancel)
+            events.put_nowait(None)
+            await delivery
+        except asyncio.CancelledError:
+            if cancel is None or not cancel.cancelled:
+                raise
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            raise ConversionCancelled() from None
+        finally:
+            finished = True
+            progress.close()
+            if not delivery.done():
+                delivery.cancel()
+
+    async def _convert_with_session_async(self, session: AsyncDjVuDocumentSession, input_file: Path,
+                                          output_file: OutputTarget, tmpdir: Path,
+                                          extra_outputs: _ExtraOutputWriter, progress: ProgressTracker,
+                                          cancel: Optional[CancellationToken] = None):
+        """The steps of DjVu2PDFConverter._convert_with_session(), awaiting the tools"""
+        num_pages = await session.page_count()
+        await self._run_steps_async(self._page_range_steps(input_file, tmpdir, 1, num_pages, num_pages,
+                                                           extra_outputs, progress, cancel), session, tmpdir)
+        await self._run_steps_async(self._document_steps(tmpdir, output_file, progress, cancel), session, tmpdir)
+
+    async def _run_steps_async(self, steps, session: AsyncDjVuDocumentSession, tmpdir: Path):
+        """
+        Run conversion steps, as DjVu2PDFConverter._run_steps() does, awaiting
+        the tools and djvused
+
+        Each stage waits for its stage limit, and holds it until the next
+        stage starts.
+        """
+        async with contextlib.AsyncExitStack() as stage_limit:
+            reply, error = None, None
+            while True:
+                try:
+                    request = steps.send(reply) if error is None else steps.throw(error)
+                except StopIteration:
+                    return
+                try:
+                    if isinstance(request, _Stage):
+                        await stage_limit.aclose()
+                        await stage_limit.enter_async_context(self._limit(request.name))
+                        reply = None
+                    elif isinstance(request, _Command):
+                        reply = await self._run_command_async(request.argv, tmpdir)
+                    elif isinstance(request, _Query):
+                        reply = getattr(session, request.method)(*request.args)
+                        if inspect.isawaitable(reply):
+                            reply = await reply
+                    else:
+                        reply = await _in_thread(request.function, *request.args)
+                    error = None
+                except BaseException as e:
+                    reply, error = None, e
+
+
+async def _in_thread(function, *args):
+    """
+    Call a blocking function in the loop's default executor
+
+    Cancelling waits for the function to return, so that it is not left
+    writing into a work directory that is being removed.
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, function, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        with contextlib.suppress(Exception):
+            await future
+        raise
+
+
+def _parse_limit(text: str):
+    stage, separator, limit = text.partition("=")
+    if not separator or not limit.isdigit():
+        raise argparse.ArgumentTypeError(f"expected STAGE=N, got {text!r}")
+    return stage, int(limit)
+
+
+async def _convert_all(converter: AsyncDjVu2PDFConverter, input_files, output_dir: Path) -> int:
+    results = await asyncio.gather(
+        *(converter.convert(path, output_dir / path.with_suffix(".pdf").name) for path in input_files),
+        return_exceptions=True)
+    failures = 0
+    for path, result in zip(input_files, results):
+        if isinstance(result, Exception):
+            failures += 1
+            print(f"{path}: Error: {result}", file=sys.stderr)
+        else:
+            print(f"{path}: converted")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert several DjVu files to PDF at the same time")
+    parser.add_argument("input_files", type=Path, nargs="+", help="input .djvu files")
+    parser.add_argument("-o", "--output-dir", type=Path, default=Path("."),
+                        help="directory for the PDF files (default: the current directory)")
+    parser.add_argument("--limit", type=_parse_limit, action="append", default=[], metavar="STAGE=N",
+                        help="run STAGE (extract, split, text, toc or pdf) for at most N files at a time")
+    parser.add_argument("--bin-dir", type=Path, help="directory containing djvused, ddjvu, tiffsplit and pdfbeads")
+    args = parser.parse_args()
+
+    try:
+        converter = AsyncDjVu2PDFConverter(args.bin_dir, stage_limits=dict(args.limit))
+    except ValueError as e:
+        parser.error(str(e))
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    if asyncio.run(_convert_all(converter, args.input_files, args.output_dir)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Cancellation of conversions
+
+A CancellationToken is passed to convert() and cancelled from any other
+thread. The conversion then kills the commands it is running, together
+with whatever they started themselves, schedules no more pages, removes
+its work directory and raises ConversionCancelled.
+
+Commands of a cancellable conversion run in a process group of their own,
+so that killing the group reaches their children too: pdfbeads, for one,
+is a Ruby script that runs further tools.
+"""
+
+import contextlib
+import os
+import signal
+import subprocess
+import sys
+import threading
+from typing import Callable
+
+
+class ConversionCancelled(Exception):
+    """The conversion was cancelled through its CancellationToken"""
+
+    def __init__(self, message: str = "Conversion cancelled"):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """
+    Asks a conversion to stop
+
+    cancel() may be called from any thread, any number of times. Functions
+    registered with on_cancel() are called from the thread that cancels.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel, and call the registered functions"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self):
+        """Raise ConversionCancelled if cancel() has been called"""
+        if self._event.is_set():
+            raise ConversionCancelled()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until cancelled, or for ``timeout`` seconds; True if cancelled"""
+        return self._event.wait(timeout)
+
+    @contextlib.contextmanager
+    def on_cancel(self, callback: Callable[[], None]):
+        """
+        Call ``callback`` on cancellation while in the with block
+
+        It is called at once if the token is already cancelled.
+        """
+        with self._lock:
+            registered = not self._event.is_set()
+            if registered:
+                self._callbacks.append(callback)
+        if not registered:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+def process_group_options() -> dict:
+    """Popen keyword arguments that start the command in a new process group"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def kill_process_group(process):
+    """
+    Kill a command started with process_group_options(), and its children
+
+    ``process`` may be a subprocess.Popen or an asyncio.subprocess.Process.
+    Commands that have already been waited for are left alone: their
+    process id may belong to someone else by now.
+    """
+    if process.returncode is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    try:
+        process.kill()
+    except OSError:
+        pass
@@ -4,6 +4,7 @@ DjVu to PDF converter - Windows portable version
 Converts DjVu files to searchable PDF with embedded text layers
 """
 
+import contextlib
 import os
 import sys
 import tempfile
@@ -11,14 +12,85 @@ import shutil
 import subprocess
 import re
 import io
+import argparse
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Callable
+from typing import BinaryIO, Callable, Optional, Union
+
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
+from djvu2pdf_progress import ProgressEvent, ProgressTracker
+from djvu2pdf_session import DjVuDocumentSession
+from djvu2pdf_trace import NullTracer, Tracer, TRACE_FORMATS, TRACE_FORMAT_ENV
+
+
+# What convert() accepts besides paths: the document's bytes or a binary
+# stream to read it from, and a binary stream to write the PDF to
+InputSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+OutputTarget = Union[str, os.PathLike, BinaryIO]
+
+_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class ConversionOutputs:
+    """
+    Additional outputs produced alongside the PDF
+
+    All of them are derived from the page images and the text layer that
+    the PDF is built from, so each one only adds its own encoding cost.
+
+    Attributes:
+        hocr: Combined hOCR file, or a directory when hocr_per_page is set
+        hocr_per_page: Write one hOCR file per page into the hocr directory
+        text: UTF-8 plain text file, pages separated by form feeds
+        thumbnails: Directory for PNG thumbnails (requires Pillow)
+        thumbnail_size: Maximum thumbnail width and height in pixels
+    """
+    hocr: Optional[Path] = None
+    hocr_per_page: bool = False
+    text: Optional[Path] = None
+    thumbnails: Optional[Path] = None
+    thumbnail_size: int = 256
+
+
+# What the conversion steps ask of the code driving them. The steps are
+# generators yielding these requests, so that the blocking converter and
+# the asyncio one share them and differ only in how they run the tools and
+# query djvused.
+
+@dataclass
+class _Stage:
+    """The conversion enters a stage; the reply is None"""
+    name: str
+
+
+@dataclass
+class _Command:
+    """Run a tool in the work directory; the reply is its CompletedProcess"""
+    argv: list
+
+
+@dataclass
+class _Query:
+    """Call a method of the djvused session; the reply is what it returns"""
+    method: str
+    args: tuple = ()
+
+
+@dataclass
+class _Call:
+    """Call a function that blocks on file I/O; the reply is what it returns"""
+    function: Callable
+    args: tuple = ()
 
 
 class DjVu2PDFConverter:
     """Handles DjVu to PDF conversion using external tools"""
 
-    def __init__(self, bin_dir: Optional[Path] = None, progress_callback: Optional[Callable] = None):
+    def __init__(self, bin_dir: Optional[Path] = None, progress_callback: Optional[Callable] = None,
+                 tracer: Optional[NullTracer] = None,
+                 event_callback: Optional[Callable[[ProgressEvent], None]] = None,
+                 progress_interval: float = 0.1):
         """
         Initialize converter
 
@@ -26,69 +98,71 @@ class DjVu2PDFConverter:
             bin_dir: Directory containing binary tools (djvused, ddjvu, etc.)
                     If None, assumes tools are in system PATH
             progress_callback: Function to call with progress updates (message, percent)
+            tracer: Records the time spent in each step and command. If None,
+                    tracing is set up from the DJVU2PDF_TRACE environment variable
+            event_callback: Function to call with a ProgressEvent for every
+                    progress update, with rate and time estimates
+            progress_interval: Minimum number of seconds between two per-page
+                    progress updates
         """
-        self.bin_dir = bin_dir
+        # Absolute: commands run in the conversion's work directory
+        self.bin_dir = Path(bin_dir).absolute() if bin_dir else None
         self.progress_callback = progress_callback or (lambda msg, pct: None)
-
-    def _run_command(self, cmd: list, shell: bool = False, **kwargs) -> subprocess.CompletedProcess:
-        """Run a command and return the result"""
-        if self.bin_dir and not shell:
-            # Prepend bin_dir to first command if it's not an absolute path
-            if not os.path.isabs(cmd[0]):
-                cmd_name = cmd[0]
-                # On Windows, use .bat extension for pdfbeads
-                if sys.platform == "win32" and cmd_name == "pdfbeads":
-                    cmd_name = f"{cmd_name}.bat"
-                cmd[0] = str(self.bin_dir / cmd_name)
+        self.event_callback = event_callback or (lambda event: None)
+        self.progress_interval = progress_interval
+        self.tracer = tracer if tracer is not None else Tracer.from_environment()
+
+    def _resolve_command(self, cmd: list) -> list:
+        """Prepend bin_dir to the program name if it's not an absolute path"""
+        if self.bin_dir and not os.path.isabs(cmd[0]):
+            cmd_name = cmd[0]
+            # On Windows, use .bat extension for pdfbeads
+            if sys.platform == "win32" and cmd_name == "pdfbeads":
+                cmd_name = f"{cmd_name}.bat"
+            cmd[0] = str(self.bin_dir / cmd_name)
+        return cmd
+
+    def _run_command(self, cmd: list, shell: bool = False, cancel: Optional[CancellationToken] = None,
+                     **kwargs) -> subprocess.CompletedProcess:
+        """Run a command and return the result; cancelling ``cancel`` kills it"""
+        if not shell:
+            self._resolve_command(cmd)
 
         try:
-            return subprocess.run(cmd, shell=shell, check=True, capture_output=True, text=True, **kwargs)
+            return self.tracer.run(cmd, shell=shell, check=True, capture_output=True, text=True, cancel=cancel,
+                                   **kwargs)
         except subprocess.CalledProcessError as e:
-            # Provide detailed error message with stderr output
-            error_msg = f"Command failed: {' '.join(str(c) for c in cmd)}\n"
-            if e.stderr:
-                error_msg += f"Error output: {e.stderr}"
-            raise RuntimeError(error_msg) from e
+            raise self._command_error(cmd, e) from e
 
-    def _update_progress(self, message: str, percent: int):
+    def _command_error(self, cmd: list, error: subprocess.CalledProcessError) -> RuntimeError:
+        """Error for a failed command, including its stderr output"""
+        error_msg = f"Command failed: {' '.join(str(c) for c in cmd)}\n"
+        if error.stderr:
+            error_msg += f"Error output: {error.stderr}"
+        return RuntimeError(error_msg)
+
+    def _update_progress(self, event: ProgressEvent):
         """Update progress"""
-        self.progress_callback(message, percent)
+        self.event_callback(event)
+        self.progress_callback(event.message, int(event.percent))
 
-    def _extract_text_with_djvused(self, input_file: Path, page: int) -> str:
+    def _page_text(self, size: tuple, sexpr_text: str) -> tuple:
         """
-        Extract text from a page using djvused and generate simple hOCR
+        The size and the words of a page
 
         Args:
-            input_file: Path to DjVu file
-            page: Page number (1-indexed)
+            size: (width, height) of the page
+            sexpr_text: Text layer of the page, as printed by djvused
 
         Returns:
-            Basic hOCR output as string
+            (width, height, words) tuple
         """
-        # Get page size and text content using djvused
-        cmd = ["djvused", "-e", f"select {page}; size; print-txt", str(input_file)]
-        result = self._run_command(cmd)
-
-        lines = result.stdout.strip().split('\n')
-        if len(lines) < 2:
-            # No text on this page, return empty hOCR
-            return self._generate_empty_hocr()
-
-        # Parse page size (first two lines: width=X\nheight=Y)
-        try:
-            width = int(lines[0].split('=')[1])
-            height = int(lines[1].split('=')[1])
-        except:
-            width = height = 0
-
-        # Extract all text content (skip size lines)
-        text_content = '\n'.join(lines[2:]) if len(lines) > 2 else ""
+        width, height = size
 
         # Parse s-expression and extract text
-        words = self._parse_djvu_text(text_content)
+        words = self._parse_djvu_text(sexpr_text)
 
-        # Generate simple hOCR HTML
-        return self._generate_hocr(width, height, words)
+        return width, height, words
 
     def _parse_djvu_text(self, sexpr_text: str) -> list:
         """
@@ -110,7 +184,11 @@ class DjVu2PDFConverter:
 
     def _generate_hocr(self, width: int, height: int, words: list) -> str:
         """Generate hOCR HTML from extracted words"""
-        hocr_lines = [
+        return '\n'.join([self._hocr_header(), self._hocr_page(width, height, words), self._hocr_footer()])
+
+    def _hocr_header(self) -> str:
+        """Opening part of an hOCR document, up to and including <body>"""
+        return '\n'.join([
             '<?xml version="1.0" encoding="UTF-8"?>',
             '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" ',
             '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">',
@@ -121,8 +199,11 @@ class DjVu2PDFConverter:
             '<title>DjVu OCR</title>',
             '</head>',
             '<body>',
-            f'<div class="ocr_page" title="bbox 0 0 {width} {height}">',
-        ]
+        ])
+
+    def _hocr_page(self, width: int, height: int, words: list) -> str:
+        """The ocr_page element for a single page"""
+        hocr_lines = [f'<div class="ocr_page" title="bbox 0 0 {width} {height}">']
 
         # Add words
         for text, x0, y0, x1, y1 in words:
@@ -132,131 +213,323 @@ class DjVu2PDFConverter:
                 f'<span class="ocr_word" title="bbox {x0} {y0} {x1} {y1}">{text}</span> '
             )
 
-        hocr_lines.extend([
-            '</div>',
-            '</body>',
-            '</html>'
-        ])
-
+        hocr_lines.append('</div>')
         return '\n'.join(hocr_lines)
 
-    def _generate_empty_hocr(self) -> str:
-        """Generate empty hOCR for pages with no text"""
-        return '''<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
-"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
-<html xmlns="http://www.w3.org/1999/xhtml">
-<head>
-<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
-<title>DjVu OCR</title>
-</head>
-<body>
-<div class="ocr_page" title="bbox 0 0 0 0"></div>
-</body>
-</html>'''
-
-    def convert(self, input_file: Path, output_file: Path) -> None:
+    def _hocr_footer(self) -> str:
+        """Closing part of an hOCR document"""
+        return '</body>\n</html>'
+
+    def convert(self, input_file: InputSource, output_file: OutputTarget,
+                outputs: Optional[ConversionOutputs] = None, cancel: Optional[CancellationToken] = None) -> None:
         """
         Convert DjVu file to PDF
 
         Args:
-            input_file: Path to input .djvu file
-            output_file: Path to output .pdf file
+            input_file: Path to input .djvu file, its contents as bytes, or a
+                    binary stream to read it from
+            output_file: Path to output .pdf file, or a binary stream to
+                    write it to
+            outputs: Additional outputs to produce from the same decode
+            cancel: Token to cancel the conversion with, from another thread.
+                    convert() then raises ConversionCancelled
+
+        Raises:
+            ConversionCancelled: The conversion was cancelled through ``cancel``
         """
-        input_file = Path(input_file).resolve()
-        output_file = Path(output_file).resolve()
-
-        if not input_file.exists():
-            raise FileNotFoundError(f"Input file not found: {input_file}")
-
-        # Create temporary directory for conversion
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        input_file = self._input_source(input_file)
+        output_file = self._output_target(output_file)
+
+        extra_outputs = _ExtraOutputWriter(self, outputs)
+        progress = ProgressTracker(self._update_progress, self.progress_interval)
+        progress.start()
+
+        # Create temporary directory for conversion. The commands run in it,
+        # but the process keeps its working directory, so that several
+        # conversions can run in threads at the same time.
         with tempfile.TemporaryDirectory() as tmpdir:
             tmpdir = Path(tmpdir)
-            original_dir = Path.cwd()
 
             try:
-                os.chdir(tmpdir)
-
                 # Copy input file to temp directory with ASCII-safe name
                 # This avoids issues with Unicode/special characters in filenames
                 temp_input = tmpdir / "input.djvu"
-                shutil.copy2(input_file, temp_input)
-
-                self._perform_conversion(temp_input, output_file, tmpdir)
+                self._spool_input(input_file, temp_input)
+
+                with extra_outputs, self.tracer.span("convert", input=self._describe_input(input_file)):
+                    self._perform_conversion(temp_input, output_file, tmpdir, extra_outputs, progress, cancel)
+            except ConversionCancelled:
+                raise
+            except Exception as e:
+                # Whatever broke when the commands were killed
+                if cancel is not None and cancel.cancelled:
+                    raise ConversionCancelled() from e
+                raise
             finally:
-                os.chdir(original_dir)
+                progress.close()
 
-    def _perform_conversion(self, input_file: Path, output_file: Path, tmpdir: Path):
+    def _perform_conversion(self, input_file: Path, output_file: OutputTarget, tmpdir: Path,
+                            extra_outputs: Optional['_ExtraOutputWriter'] = None,
+                            progress: Optional[ProgressTracker] = None,
+                            cancel: Optional[CancellationToken] = None):
         """Perform the actual conversion steps"""
 
+        # All document queries go through one session, which reads the pages from a single djvused script
+        djvused = self._resolve_command(["djvused"])[0]
+        with DjVuDocumentSession(input_file, djvused) as session:
+            with cancel.on_cancel(session.kill) if cancel is not None else contextlib.nullcontext():
+                self._convert_with_session(session, input_file, output_file, tmpdir, extra_outputs, progress, cancel)
+
+    def _convert_with_session(self, session: DjVuDocumentSession, input_file: Path, output_file: OutputTarget,
+                              tmpdir: Path, extra_outputs: Optional['_ExtraOutputWriter'] = None,
+                              progress: Optional[ProgressTracker] = None,
+                              cancel: Optional[CancellationToken] = None):
+        """Perform the conversion steps, querying the document through ``session``"""
+
+        if progress is None:
+            progress = ProgressTracker(self._update_progress, self.progress_interval)
+
+        # Steps 1-4: Render the pages and write their hOCR
+        # The page count comes first: the time estimates are per page
+        num_pages = session.page_count()
+        self._render_pages(session, input_file, tmpdir, num_pages, extra_outputs, progress, cancel)
+
+        # Steps 5-7: Build the PDF
+        self._run_steps(self._document_steps(tmpdir, output_file, progress, cancel), session, tmpdir, cancel)
+
+    def _run_steps(self, steps, session: DjVuDocumentSession, tmpdir: Path,
+                   cancel: Optional[CancellationToken] = None):
+        """
+        Run conversion steps, answering their requests with blocking calls
+
+        Errors are raised inside the steps, so that their spans end where
+        the error happened.
+        """
+        reply, error = None, None
+        while True:
+            try:
+                request = steps.send(reply) if error is None else steps.throw(error)
+            except StopIteration:
+                return
+            try:
+                if isinstance(request, _Stage):
+                    reply = None
+                elif isinstance(request, _Command):
+                    reply = self._run_command(request.argv, cwd=tmpdir, cancel=cancel)
+                elif isinstance(request, _Query):
+                    reply = getattr(session, request.method)(*request.args)
+                else:
+                    reply = request.function(*request.args)
+                error = None
+            except BaseException as e:
+                reply, error = None, e
+
+    def _document_steps(self, tmpdir: Path, output_file: OutputTarget, progress: ProgressTracker,
+                        cancel: Optional[CancellationToken] = None):
+        """The steps building the PDF from the rendered pages, as a generator of requests"""
+        tracer = self.tracer
+
+        # Step 5: Generate TOC
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        progress.stage("toc", "Generating table of contents...")
+        yield _Stage("toc")
+        with tracer.span("table of contents"):
+            toc_output_file = tmpdir / "toc.out.txt"
+            outline = yield _Query("outline")
+            page_ids = (yield _Query("page_ids")) if self._outline_needs_page_ids(outline) else None
+            self._write_toc(toc_output_file, outline, page_ids)
+
+        # Step 6: Generate final PDF with pdfbeads
+        progress.stage("pdf", "Generating PDF...")
+        yield _Stage("pdf")
+        output_pdf = tmpdir / "output.pdf"
+        with tracer.span("build pdf"):
+            yield _Command(self._pdfbeads_command(tmpdir, toc_output_file, output_pdf))
+        progress.add_bytes(output_pdf.stat().st_size)
+
+        # Step 7: Move output to final destination
+        progress.stage("finalize", "Finalizing...")
+        yield _Stage("finalize")
+        with tracer.span("finalize"):
+            yield _Call(self._deliver_output, (output_pdf, output_file))
+        progress.finish("Conversion complete!")
+
+    @staticmethod
+    def _input_source(input_file: InputSource) -> InputSource:
+        """Resolve and check an input path; bytes and streams are kept as they are"""
+        if isinstance(input_file, (bytes, bytearray, memoryview)) or hasattr(input_file, "read"):
+            return input_file
+        input_file = Path(input_file).resolve()
+        if not input_file.exists():
+            raise FileNotFoundError(f"Input file not found: {input_file}")
+        return input_file
+
+    @staticmethod
+    def _output_target(output_file: OutputTarget) -> OutputTarget:
+        """Resolve an output path; streams are kept as they are"""
+        if hasattr(output_file, "write"):
+            return output_file
+        return Path(output_file).resolve()
+
+    @staticmethod
+    def _describe_input(input_file: InputSource) -> str:
+        """How the input is named in traces: its path, or the kind of source it is"""
+        if isinstance(input_file, Path):
+            return str(input_file)
+        if isinstance(input_file, (bytes, bytearray, memoryview)):
+            return "<bytes>"
+        return str(getattr(input_file, "name", "<stream>"))
+
+    @staticmethod
+    def _spool_input(input_file: InputSource, temp_input: Path):
+        """Write the document to ``temp_input``, reading a stream only once"""
+        if isinstance(input_file, Path):
+            shutil.copy2(input_file, temp_input)
+        elif isinstance(input_file, (bytes, bytearray, memoryview)):
+            temp_input.write_bytes(input_file)
+        else:
+            with open(temp_input, "wb") as spool:
+                shutil.copyfileobj(input_file, spool, _CHUNK_SIZE)
+
+    @staticmethod
+    def _deliver_output(output_pdf: Path, output_file: OutputTarget):
+        """Move the finished PDF to its path, or copy it into the output stream"""
+        if isinstance(output_file, Path):
+            shutil.move(str(output_pdf), str(output_file))
+        else:
+            with open(output_pdf, "rb") as pdf:
+                shutil.copyfileobj(pdf, output_file, _CHUNK_SIZE)
+            output_file.flush()
+
+    def _render_pages(self, session: DjVuDocumentSession, input_file: Path, tmpdir: Path, num_pages: int,
+                      extra_outputs: Optional['_ExtraOutputWriter'], progress: ProgressTracker,
+                      cancel: Optional[CancellationToken] = None):
+        """
+        Write tmp_page_N.tiff and tmp_page_N.html into ``tmpdir`` for every page
+
+        This is the part of the conversion whose cost grows with the page
+        count; subclasses may hand it out to other processes.
+        """
+        self._render_page_range(session, input_file, tmpdir, 1, num_pages, num_pages, extra_outputs, progress,
+                                cancel)
+
+    def _render_page_range(self, session: DjVuDocumentSession, input_file: Path, tmpdir: Path,
+                           first: int, last: int, num_pages: int, extra_outputs, progress: ProgressTracker,
+                           cancel: Optional[CancellationToken] = None):
+        """
+        Render pages ``first`` to ``last`` into ``tmpdir``
+
+        Args:
+            session: djvused session for the document
+            input_file: The DjVu document
+            tmpdir: Empty directory for the page files
+            first: First page to render (1-indexed)
+            last: Last page to render
+            num_pages: Page count of the whole document, for zero-padding page numbers
+            extra_outputs: Receives every page through add_page(), or None
+            progress: Progress tracker of the conversion
+            cancel: Stops the conversion between two pages, and kills the commands
+        """
+        steps = self._page_range_steps(input_file, tmpdir, first, last, num_pages, extra_outputs, progress, cancel)
+        self._run_steps(steps, session, tmpdir, cancel)
+
+    def _page_range_steps(self, input_file: Path, tmpdir: Path, first: int, last: int, num_pages: int,
+                          extra_outputs, progress: ProgressTracker, cancel: Optional[CancellationToken] = None):
+        """The steps of _render_page_range(), as a generator of requests"""
+        tracer = self.tracer
+
         # Step 1: Extract TIFF pages
-        self._update_progress("Extracting pages from DjVu...", 10)
+        progress.stage("extract", "Extracting pages from DjVu...", pages_total=num_pages)
+        yield _Stage("extract")
         multipage_tiff = tmpdir / "tmp_multipage.tiff"
 
-        cmd = ["ddjvu", "-format=tiff", str(input_file), str(multipage_tiff)]
-        self._run_command(cmd)
+        with tracer.span("extract pages"):
+            cmd = ["ddjvu", "-format=tiff", str(input_file), str(multipage_tiff)]
+            if (first, last) != (1, num_pages):
+                cmd.insert(2, f"-page={first}-{last}")
+            yield _Command(cmd)
+        progress.add_bytes(multipage_tiff.stat().st_size)
 
         # Step 2: Split TIFF into individual pages
-        self._update_progress("Splitting pages...", 20)
-        cmd = ["tiffsplit", str(multipage_tiff), "tmp_page_"]
-        self._run_command(cmd)
-        multipage_tiff.unlink()  # Remove temporary multipage tiff
-
-        # Step 3: Get number of pages and rename files
-        self._update_progress("Processing pages...", 30)
-        cmd = ["djvused", "-e", "n", str(input_file)]
-        result = self._run_command(cmd)
-        num_pages = int(result.stdout.strip())
+        progress.stage("split", "Splitting pages...")
+        yield _Stage("split")
+        with tracer.span("split pages"):
+            yield _Command(["tiffsplit", str(multipage_tiff), str(tmpdir / "tmp_page_")])
+            multipage_tiff.unlink()  # Remove temporary multipage tiff
+
+        # Step 3: Rename files
+        progress.stage("rename", "Processing pages...")
+        yield _Stage("rename")
+        with tracer.span("rename pages"):
+            self._rename_split_pages(tmpdir, first, num_pages)
+        strlen_num_pages = len(str(num_pages))
+
+        # Step 4: Extract OCR content for each page
+        progress.stage("text", "Extracting OCR text...")
+        yield _Stage("text")
+        with tracer.span("extract text", pages=last - first + 1):
+            for i in range(first, last + 1):
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                page_num = str(i).zfill(strlen_num_pages)
+
+                with tracer.span("page", page=i):
+                    size = yield _Query("page_size", (i,))
+                    page_text = self._page_text(size, (yield _Query("page_text", (i,))))
+                    yield _Query("forget_page", (i,))
+                    progress.add_bytes(self._write_page_hocr(tmpdir, page_num, page_text, extra_outputs))
+
+                progress.page(i, f"Extracting OCR text... ({i}/{num_pages})")
+
+    def _rename_split_pages(self, tmpdir: Path, first: int, num_pages: int):
+        """Rename the files written by tiffsplit to tmp_page_N.tiff, numbering them from ``first``"""
         strlen_num_pages = len(str(num_pages))
 
         # Rename split pages with proper numbering
         page_files = sorted(tmpdir.glob("tmp_page_*"))
-        for i, page_file in enumerate(page_files, start=1):
+        for i, page_file in enumerate(page_files, start=first):
             page_num = str(i).zfill(strlen_num_pages)
             new_name = tmpdir / f"tmp_page_{page_num}.tiff"
             page_file.rename(new_name)
 
-        # Step 4: Extract OCR content for each page
-        self._update_progress("Extracting OCR text...", 40)
-        for i in range(1, num_pages + 1):
-            page_num = str(i).zfill(strlen_num_pages)
-            html_file = tmpdir / f"tmp_page_{page_num}.html"
-
-            # Extract text using djvused and generate hOCR
-            ocr_output = self._extract_text_with_djvused(input_file, i)
-
-            # Apply sed-like substitution: s/ocrx/ocr/g (for compatibility)
-            ocr_content = ocr_output.replace("ocrx", "ocr")
-            html_file.write_text(ocr_content, encoding='utf-8')
-
-            # Update progress for OCR extraction
-            ocr_progress = 40 + int(50 * i / num_pages)
-            self._update_progress(f"Extracting OCR text... ({i}/{num_pages})", ocr_progress)
-
-        # Step 5: Generate TOC
-        self._update_progress("Generating table of contents...", 90)
-        toc_file = tmpdir / "toc.txt"
-        cmd = ["djvused", "-e", "print-outline", str(input_file)]
-        result = self._run_command(cmd)
-        toc_file.write_text(result.stdout, encoding='utf-8')
-
-        # Parse TOC using the Python parser
-        from djvu2pdf_toc_parser import parse_sexp
-        toc_input = toc_file.read_text(encoding='utf-8')
-        toc_output_file = tmpdir / "toc.out.txt"
-
-        if len(toc_input) > 0:
-            prefix = '(bookmarks'
-            if len(toc_input) > len(prefix):
-                toc_output = []
-                parse_sexp(toc_input[len(prefix):], toc_output, '', 0)
-                toc_output_file.write_text('\n'.join(toc_output), encoding='utf-8')
-        else:
-            toc_output_file.write_text('', encoding='utf-8')
+    def _write_page_hocr(self, tmpdir: Path, page_num: str, page_text: tuple, extra_outputs) -> int:
+        """
+        Write tmp_page_N.html for a page, and pass the page on to the additional outputs
 
-        # Step 6: Generate final PDF with pdfbeads
-        self._update_progress("Generating PDF...", 95)
+        Args:
+            tmpdir: Work directory of the conversion
+            page_num: Zero-padded page number used in file names
+            page_text: (width, height, words) as returned by _page_text()
+            extra_outputs: Receives the page through add_page(), or None
 
+        Returns:
+            Size of the hOCR file in bytes
+        """
+        # Generate hOCR; the parsed page is shared with the additional outputs
+        ocr_output = self._generate_hocr(*page_text)
+        if extra_outputs is not None:
+            extra_outputs.add_page(page_num, tmpdir / f"tmp_page_{page_num}.tiff", page_text, ocr_output)
+
+        # Apply sed-like substitution: s/ocrx/ocr/g (for compatibility)
+        html_file = tmpdir / f"tmp_page_{page_num}.html"
+        html_file.write_text(ocr_output.replace("ocrx", "ocr"), encoding='utf-8')
+        return html_file.stat().st_size
+
+    @staticmethod
+    def _outline_needs_page_ids(outline: str) -> bool:
+        """Whether the outline links to pages by id or title rather than by number"""
+        return re.search(r'"#(?!\d+")', outline) is not None
+
+    def _write_toc(self, toc_file: Path, outline: str, page_ids: Optional[dict]):
+        """Write the outline in the format pdfbeads reads with --toc"""
+        from djvu2pdf_toc_parser import translate_outline
+        toc_file.write_text('\n'.join(translate_outline(outline, page_ids)), encoding='utf-8')
+
+    def _pdfbeads_command(self, tmpdir: Path, toc_file: Path, output_pdf: Path) -> list:
+        """The pdfbeads command line building ``output_pdf`` from the pages in ``tmpdir``"""
         # Build page pairs (tiff, html) for pdfbeads
         page_tiffs = sorted(tmpdir.glob("tmp_page_*.tiff"))
         page_pairs = []
@@ -270,36 +543,148 @@ class DjVu2PDFConverter:
         if not page_pairs:
             raise RuntimeError("No page TIFF files were generated")
 
-        output_pdf = tmpdir / "output.pdf"
-        cmd = ["pdfbeads", "--toc", str(toc_output_file), "-o", str(output_pdf)] + page_pairs
+        return ["pdfbeads", "--toc", str(toc_file), "-o", str(output_pdf)] + page_pairs
+
+
+class _ExtraOutputWriter:
+    """
+    Writes the additional outputs of a conversion page by page
+
+    Files are opened once up front and every page is appended as soon as the
+    converter has rendered and parsed it, so nothing is decoded twice and
+    nothing is accumulated in memory.
+    """
+
+    def __init__(self, converter: DjVu2PDFConverter, outputs: Optional[ConversionOutputs]):
+        self.converter = converter
+        outputs = outputs or ConversionOutputs()
+        # Resolve now, against the caller's working directory
+        self.outputs = ConversionOutputs(
+            hocr=Path(outputs.hocr).resolve() if outputs.hocr else None,
+            hocr_per_page=outputs.hocr_per_page,
+            text=Path(outputs.text).resolve() if outputs.text else None,
+            thumbnails=Path(outputs.thumbnails).resolve() if outputs.thumbnails else None,
+            thumbnail_size=outputs.thumbnail_size,
+        )
+        self._hocr_file = None
+        self._text_file = None
+        self._image_module = None
+        self._pages_written = 0
+
+    @property
+    def active(self) -> bool:
+        """Whether any additional output was requested"""
+        outputs = self.outputs
+        return bool(outputs.hocr or outputs.text or outputs.thumbnails)
+
+    def __enter__(self):
+        outputs = self.outputs
+        if outputs.thumbnails:
+            # Fail before the expensive steps rather than after them
+            try:
+                from PIL import Image
+            except ImportError as e:
+                raise RuntimeError("Thumbnail output requires the Pillow package") from e
+            self._image_module = Image
+            Path(outputs.thumbnails).mkdir(parents=True, exist_ok=True)
+        if outputs.hocr:
+            if outputs.hocr_per_page:
+                Path(outputs.hocr).mkdir(parents=True, exist_ok=True)
+            else:
+                self._hocr_file = open(outputs.hocr, 'w', encoding='utf-8')
+                self._hocr_file.write(self.converter._hocr_header() + '\n')
+        if outputs.text:
+            self._text_file = open(outputs.text, 'w', encoding='utf-8')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._hocr_file is not None:
+            self._hocr_file.write(self.converter._hocr_footer() + '\n')
+            self._hocr_file.close()
+        if self._text_file is not None:
+            self._text_file.close()
+        return False
+
+    def add_page(self, page_num: str, tiff_file: Path, page_text: tuple, ocr_output: str):
+        """
+        Add one page to every requested output
 
-        try:
-            self._run_command(cmd)
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(f"pdfbeads failed to generate the final PDF: {e.stderr}")
+        Args:
+            page_num: Zero-padded page number used in file names
+            tiff_file: Rendered page image
+            page_text: (width, height, words) as parsed from djvused
+            ocr_output: The page's complete hOCR document
+        """
+        outputs = self.outputs
+        width, height, words = page_text
 
-        # Step 7: Move output to final destination
-        self._update_progress("Finalizing...", 99)
-        shutil.move(str(output_pdf), str(output_file))
-        self._update_progress("Conversion complete!", 100)
+        if outputs.hocr:
+            if outputs.hocr_per_page:
+                (Path(outputs.hocr) / f"page_{page_num}.html").write_text(ocr_output, encoding='utf-8')
+            else:
+                self._hocr_file.write(self.converter._hocr_page(width, height, words) + '\n')
 
+        if self._text_file is not None:
+            if self._pages_written:
+                self._text_file.write('\f')
+            self._text_file.write(' '.join(word[0] for word in words) + '\n')
 
-if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: djvu2pdf_converter.py <input.djvu> <output.pdf>")
-        sys.exit(1)
+        if self._image_module is not None:
+            with self._image_module.open(tiff_file) as image:
+                image.thumbnail((outputs.thumbnail_size, outputs.thumbnail_size))
+                image.save(Path(outputs.thumbnails) / f"page_{page_num}.png")
 
-    input_file = Path(sys.argv[1])
-    output_file = Path(sys.argv[2])
+        self._pages_written += 1
 
-    def progress(msg, pct):
-        print(f"[{pct:3d}%] {msg}")
 
-    converter = DjVu2PDFConverter(progress_callback=progress)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert a DjVu file to a searchable PDF")
+    parser.add_argument("input_file", help="input .djvu file, or - for standard input")
+    parser.add_argument("output_file", help="output .pdf file, or - for standard output")
+    parser.add_argument("--hocr", type=Path, help="also write a combined hOCR file (a directory with --hocr-per-page)")
+    parser.add_argument("--hocr-per-page", action="store_true", help="write one hOCR file per page into the --hocr directory")
+    parser.add_argument("--text", type=Path, help="also write the plain UTF-8 text")
+    parser.add_argument("--thumbnails", type=Path, metavar="DIR", help="also write PNG thumbnails into DIR")
+    parser.add_argument("--thumbnail-size", type=int, default=256, metavar="PIXELS", help="maximum thumbnail size (default: 256)")
+    parser.add_argument("--trace", type=Path, metavar="FILE",
+                        help="write the time spent in each step and command to FILE (default: $DJVU2PDF_TRACE)")
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS,
+                        help="format of the trace: chrome (chrome://tracing, Perfetto) or json (default: chrome)")
+    args = parser.parse_args()
+
+    if args.hocr_per_page and not args.hocr:
+        parser.error("--hocr-per-page requires --hocr")
+
+    outputs = ConversionOutputs(
+        hocr=args.hocr,
+        hocr_per_page=args.hocr_per_page,
+        text=args.text,
+        thumbnails=args.thumbnails,
+        thumbnail_size=args.thumbnail_size,
+    )
+
+    input_file = sys.stdin.buffer if args.input_file == "-" else Path(args.input_file)
+    output_file = sys.stdout.buffer if args.output_file == "-" else Path(args.output_file)
+    # Standard output may be taken by the PDF
+    messages = sys.stderr if args.output_file == "-" else sys.stdout
+
+    def progress(event):
+        print(f"[{int(event.percent):3d}%] {event.describe()}", file=messages)
+
+    tracer = None
+    if args.trace:
+        tracer = Tracer(args.trace, args.trace_format or os.environ.get(TRACE_FORMAT_ENV) or "chrome")
+    elif args.trace_format:
+        parser.error("--trace-format requires --trace")
+
+    converter = DjVu2PDFConverter(tracer=tracer, event_callback=progress)
 
     try:
-        converter.convert(input_file, output_file)
-        print(f"Successfully converted {input_file} to {output_file}")
+        converter.convert(input_file, output_file, outputs)
+        print(f"Successfully converted {args.input_file} to {args.output_file}", file=messages)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if tracer is not None:
+            tracer.save()
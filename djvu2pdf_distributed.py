@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+"""
+Distributed conversion: pages rendered by worker processes or hosts
+
+The coordinator splits a document into shards of consecutive pages and
+hands them out to workers. A worker renders the pages of its shard with
+ddjvu and tiffsplit, reads their text layer with djvused, and sends back
+one TIFF and one hOCR file per page. The coordinator then builds the table
+of contents and the PDF from all the pages, exactly as a local conversion
+does: pdfbeads has to see every page to share fonts and image settings,
+so only the page rendering is spread out.
+
+Workers connect to the coordinator and ask for work, so they can join at
+any time during a conversion. A busy worker sends a heartbeat every few
+seconds. A worker that disconnects or stays silent for three heartbeat
+intervals is given up, and its shard goes back to the queue for the next
+worker. A shard that fails max_attempts times fails the conversion.
+
+Protocol: every message is a 4-byte big-endian length, a UTF-8 JSON
+object of that length, and the contents of the files that the object's
+"files" member lists as [name, size] pairs, back to back:
+
+    worker -> coordinator   {"type": "hello", "worker": NAME}
+    coordinator -> worker   {"type": "document", "pages": N, "heartbeat": SECONDS, "files": [[NAME, SIZE]]}
+    coordinator -> worker   {"type": "shard", "id": ID, "first": P, "last": Q, "texts": BOOL}
+    worker -> coordinator   {"type": "heartbeat"}
+    worker -> coordinator   {"type": "result", "id": ID, "pages": [[P, WIDTH, HEIGHT, WORDS], ...], "files": [...]}
+    worker -> coordinator   {"type": "error", "id": ID, "message": TEXT}
+    coordinator -> worker   {"type": "done"}
+
+"pages" of a result only lists the page text when the shard asked for it
+with "texts", which the coordinator does when it writes additional
+outputs (hOCR, plain text, thumbnails).
+
+Usage:
+    python djvu2pdf_distributed.py coordinate INPUT OUTPUT [--listen HOST:PORT] [--local-workers N]
+    python djvu2pdf_distributed.py worker HOST:PORT [--forever]
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from djvu2pdf_cancel import kill_process_group, process_group_options
+from djvu2pdf_converter import ConversionOutputs, DjVu2PDFConverter
+from djvu2pdf_progress import ProgressTracker
+from djvu2pdf_session import DjVuDocumentSession
+from djvu2pdf_trace import NULL_TRACER
+
+logger = logging.getLogger("djvu2pdf.distributed")
+
+_LENGTH = struct.Struct(">I")
+_MAX_HEADER = 64 << 20
+_CHUNK_SIZE = 1 << 16
+
+
+class ProtocolError(Exception):
+    """The other side broke the protocol or hung up"""
+
+
+def parse_address(text: str) -> Tuple[str, int]:
+    """Split HOST:PORT; the host may be empty or a bracketed IPv6 address"""
+    host, separator, port = text.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError(f"expected HOST:PORT, got {text!r}")
+    return host.strip("[]"), int(port)
+
+
+def send_message(connection: socket.socket, message: dict, files=()):
+    """
+    Send a message, followed by the contents of ``files``
+
+    Args:
+        connection: Connected socket
+        message: JSON-serializable object; its "files" member is filled in
+        files: Paths of the files to send, under their base names
+    """
+    files = [Path(path) for path in files]
+    message = dict(message, files=[[path.name, path.stat().st_size] for path in files])
+    header = json.dumps(message).encode("utf-8")
+    connection.sendall(_LENGTH.pack(len(header)) + header)
+    for path in files:
+        with open(path, "rb") as file:
+            connection.sendfile(file)
+
+
+def _read_exactly(rfile, size: int) -> bytes:
+    data = rfile.read(size)
+    if len(data) != size:
+        raise ProtocolError("connection closed")
+    return data
+
+
+def receive_message(rfile, directory: Optional[Path] = None) -> dict:
+    """
+    Receive a message, writing the files that come with it into ``directory``
+
+    Args:
+        rfile: Binary file object of the socket (socket.makefile("rb"))
+        directory: Where to write the files; a message with files is a
+                   protocol error if this is None
+
+    Returns:
+        The message
+    """
+    length, = _LENGTH.unpack(_read_exactly(rfile, _LENGTH.size))
+    if length > _MAX_HEADER:
+        raise ProtocolError(f"message of {length} bytes")
+    try:
+        message = json.loads(_read_exactly(rfile, length).decode("utf-8"))
+    except ValueError as e:
+        raise ProtocolError(f"malformed message: {e}") from e
+    if not isinstance(message, dict):
+        raise ProtocolError("malformed message")
+    for name, size in message.get("files") or ():
+        # Plain names only: the sender picks them, the receiver picks the directory
+        if directory is None or Path(name).name != name or name in ("", ".", ".."):
+            raise ProtocolError(f"unexpected file {name!r}")
+        with open(directory / name, "wb") as file:
+            remaining = size
+            while remaining > 0:
+                chunk = rfile.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ProtocolError("connection closed")
+                file.write(chunk)
+                remaining -= len(chunk)
+    return message
+
+
+class _Job:
+    """
+    Shards of one distributed conversion and the pages received so far
+
+    Shared by the threads serving the workers and the conversion's thread.
+    """
+
+    def __init__(self, input_file: Path, tmpdir: Path, num_pages: int, shard_size: int,
+                 max_attempts: int, texts: bool):
+        self.input_file = input_file
+        self.tmpdir = tmpdir
+        self.num_pages = num_pages
+        self.max_attempts = max_attempts
+        self.texts = texts
+        self.pending = deque(
+            (n, first, min(first + shard_size - 1, num_pages))
+            for n, first in enumerate(range(1, num_pages + 1, shard_size))
+        )
+        self.remaining = len(self.pending)
+        self.attempts: Dict[int, int] = {}
+        self.pages: Dict[int, Optional[tuple]] = {}
+        self.error: Optional[Exception] = None
+        self.closed = False
+        self.connections = set()
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.closed or self.error is not None or not self.remaining
+
+    def take(self) -> Optional[tuple]:
+        """Wait for a shard to render; None once there is nothing left to do"""
+        with self.condition:
+            while not self.pending and not self.finished:
+                self.condition.wait()
+            return None if self.finished else self.pending.popleft()
+
+    def retry(self, shard: tuple, reason: str):
+        """Put back a shard that a worker failed to render"""
+        with self.condition:
+            if self.finished:
+                return
+            shard_id, first, last = shard
+            self.attempts[shard_id] = self.attempts.get(shard_id, 0) + 1
+            if self.attempts[shard_id] >= self.max_attempts:
+                self.error = RuntimeError(
+                    f"Pages {first}-{last} failed {self.attempts[shard_id]} times, last: {reason}")
+            else:
+                logger.warning("Reassigning pages %d-%d: %s", first, last, reason)
+                # To the front: the pages were due before the queued ones
+                self.pending.appendleft(shard)
+            self.condition.notify_all()
+
+    def complete(self, shard: tuple, staging: Path, texts: list):
+        """Move the files of a rendered shard from ``staging`` into place"""
+        shard_id, first, last = shard
+        width = len(str(self.num_pages))
+        names = [f"tmp_page_{str(page).zfill(width)}{suffix}"
+                 for page in range(first, last + 1) for suffix in (".tiff", ".html")]
+        missing = [name for name in names if not (staging / name).is_file()]
+        if missing:
+            raise ProtocolError(f"result lacks {missing[0]}")
+        if self.texts and len(texts) != last - first + 1:
+            raise ProtocolError("result lacks the page texts")
+        for name in names:
+            os.replace(staging / name, self.tmpdir / name)
+
+        with self.condition:
+            if self.texts:
+                for page, width, height, words in texts:
+                    self.pages[page] = (width, height, [tuple(word) for word in words])
+            else:
+                self.pages.update(dict.fromkeys(range(first, last + 1)))
+            self.remaining -= 1
+            self.condition.notify_all()
+
+    def ready_pages(self, first: int, timeout: float) -> List[Tuple[int, Optional[tuple]]]:
+        """
+        Wait until page ``first`` has arrived, or for ``timeout`` seconds
+
+        Returns:
+            (page, page text) for the consecutive pages from ``first`` on
+            that have arrived; the page text is None unless texts were asked for
+        """
+        with self.condition:
+            if first not in self.pages and self.error is None:
+                self.condition.wait(timeout)
+            if self.error is not None:
+                raise self.error
+            ready = []
+            while first in self.pages:
+                ready.append((first, self.pages.pop(first)))
+                first += 1
+            return ready
+
+    def close(self):
+        """Stop handing out shards, and hang up on busy workers if the conversion failed"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            if self.error is not None or self.remaining:
+                for connection in self.connections:
+                    try:
+                        connection.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+
+class DistributedConverter(DjVu2PDFConverter):
+    """
+    Converter that has the pages rendered by workers
+
+    It listens for workers from the moment it is created until close(), and
+    can start local worker processes for each conversion.
+    """
+
+    def __init__(self, bin_dir: Optional[Path] = None, progress_callback=None, tracer=None,
+                 event_callback=None, progress_interval: float = 0.1,
+                 listen: Tuple[str, int] = ("127.0.0.1", 0), local_workers: int = 0,
+                 shard_size: int = 50, heartbeat: float = 5.0, max_attempts: int = 3):
+        """
+        Initialize converter
+
+        Args:
+            bin_dir, progress_callback, tracer, event_callback, progress_interval:
+                    As for DjVu2PDFConverter; bin_dir is also passed on to local workers
+            listen: (host, port) to accept workers on; port 0 picks a free port
+            local_workers: Worker processes to start on this host for each conversion
+            shard_size: Pages per shard
+            heartbeat: Seconds between the heartbeats of busy workers. A worker
+                    that stays silent for three times as long is given up
+            max_attempts: Times a shard may fail before the conversion fails
+        """
+        super().__init__(bin_dir, progress_callback, tracer, event_callback, progress_interval)
+        if shard_size < 1 or max_attempts < 1:
+            raise ValueError("shard_size and max_attempts must be positive")
+        self.local_workers = local_workers
+        self.shard_size = shard_size
+        self.heartbeat = heartbeat
+        self.max_attempts = max_attempts
+        self._listener = socket.create_server(listen)
+        self._listener.settimeout(0.2)
+        self.address = self._listener.getsockname()[:2]
+
+    def close(self):
+        """Stop listening for workers"""
+        self._listener.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _start_local_workers(self) -> List[subprocess.Popen]:
+        host, port = self.address
+        if host in ("", "0.0.0.0", "::"):
+            host = "127.0.0.1" if host != "::" else "::1"
+        cmd = [sys.executable, str(Path(__file__).resolve()), "worker", f"{host}:{port}"]
+        if self.bin_dir:
+            cmd += ["--bin-dir", str(self.bin_dir)]
+        # In process groups of their own, to be killed with their commands on cancellation
+        return [subprocess.Popen(cmd + ["--name", f"local-{n}"], **process_group_options())
+                for n in range(1, self.local_workers + 1)]
+
+    def _accept(self, job: _Job, handlers: List[threading.Thread]):
+        """Serve every worker that connects until the job is finished"""
+        while not job.finished:
+            try:
+                connection, address = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            handler = threading.Thread(target=self._serve_worker, args=(job, connection, address), daemon=True)
+            handlers.append(handler)
+            handler.start()
+
+    def _serve_worker(self, job: _Job, connection: socket.socket, address):
+        """Hand shards to one worker until there are none left"""
+        name = "%s:%s" % address[:2]
+        shard = None
+        with job.condition:
+            job.connections.add(connection)
+        try:
+            connection.settimeout(self.heartbeat * 3)
+            rfile = connection.makefile("rb")
+            hello = receive_message(rfile)
+            if hello.get("type") != "hello":
+                raise ProtocolError(f"expected hello, got {hello.get('type')!r}")
+            name = str(hello.get("worker") or name)
+            logger.info("Worker %s joined", name)
+            send_message(connection, {"type": "document", "pages": job.num_pages, "heartbeat": self.heartbeat},
+                         [job.input_file])
+
+            while True:
+                shard = job.take()
+                if shard is None:
+                    send_message(connection, {"type": "done"})
+                    return
+                shard_id, first, last = shard
+                staging = Path(tempfile.mkdtemp(prefix="shard-", dir=job.tmpdir))
+                try:
+                    with self.tracer.span("shard", first=first, last=last, worker=name):
+                        send_message(connection, {"type": "shard", "id": shard_id, "first": first,
+                                                  "last": last, "texts": job.texts})
+                        message = receive_message(rfile, staging)
+                        while message.get("type") == "heartbeat":
+                            message = receive_message(rfile, staging)
+                    if message.get("id") != shard_id or message.get("type") not in ("result", "error"):
+                        raise ProtocolError(f"unexpected {message.get('type')!r} message")
+                    if message["type"] == "error":
+                        job.retry(shard, f"{name}: {message.get('message')}")
+                    else:
+                        job.complete(shard, staging, message.get("pages") or [])
+                    shard = None
+                finally:
+                    shutil.rmtree(staging, ignore_errors=True)
+        except (OSError, ProtocolError) as e:
+            if job.finished and shard is None:
+                return
+            if isinstance(e, socket.timeout):
+                e = f"no heartbeat for {self.heartbeat * 3:g} s"
+            if shard is not None:
+                job.retry(shard, f"lost worker {name}: {e}")
+            else:
+                logger.warning("Lost worker %s: %s", name, e)
+        finally:
+            with job.condition:
+                job.connections.discard(connection)
+            connection.close()
+
+    def _render_pages(self, session: DjVuDocumentSession, input_file: Path, tmpdir: Path, num_pages: int,
+                      extra_outputs, progress: ProgressTracker, cancel=None):
+        """Have the workers render the pages, and pass them on in page order as they come in"""
+        # The workers split the pages and extract their text as they render
+        # them, so the local conversion goes from here straight to the PDF
+        progress.skip("split", "rename", "text")
+        progress.stage("extract", "Rendering pages on the workers...", pages_total=num_pages)
+        texts = extra_outputs is not None and extra_outputs.active
+        job = _Job(input_file, tmpdir, num_pages, self.shard_size, self.max_attempts, texts)
+        handlers: List[threading.Thread] = []
+        acceptor = threading.Thread(target=self._accept, args=(job, handlers), daemon=True)
+        acceptor.start()
+        workers = self._start_local_workers()
+        strlen_num_pages = len(str(num_pages))
+
+        # Cancelling wakes up the wait for pages and hangs up on the workers
+        on_cancel = cancel.on_cancel(job.close) if cancel is not None else contextlib.nullcontext()
+        try:
+            next_page = 1
+            with on_cancel:
+                while next_page <= num_pages:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()
+                    ready = job.ready_pages(next_page, 0.5)
+                    if not ready and workers and all(worker.poll() is not None for worker in workers):
+                        with job.condition:
+                            idle = not job.connections
+                        if idle:
+                            raise RuntimeError("All local workers exited before the pages were rendered")
+                    for page, page_text in ready:
+                        page_num = str(page).zfill(strlen_num_pages)
+                        tiff_file = tmpdir / f"tmp_page_{page_num}.tiff"
+                        progress.add_bytes(tiff_file.stat().st_size + tiff_file.with_suffix(".html").stat().st_size)
+                        if texts:
+                            extra_outputs.add_page(page_num, tiff_file, page_text, self._generate_hocr(*page_text))
+                        progress.page(page, f"Rendering pages on the workers... ({page}/{num_pages})")
+                    next_page += len(ready)
+        finally:
+            job.close()
+            acceptor.join()
+            for handler in handlers:
+                handler.join()
+            for worker in workers:
+                if cancel is not None and cancel.cancelled:
+                    kill_process_group(worker)
+                try:
+                    worker.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    kill_process_group(worker)
+                    worker.wait()
+
+
+class _PageTexts:
+    """Collects the page texts of a shard, in place of the additional outputs"""
+
+    def __init__(self):
+        self.pages = []
+
+    def add_page(self, page_num: str, tiff_file: Path, page_text: tuple, ocr_output: str):
+        width, height, words = page_text
+        self.pages.append([int(page_num), width, height, words])
+
+
+class _Heartbeat:
+    """Sends heartbeats from a thread while the shard is rendered"""
+
+    def __init__(self, send, interval: float):
+        self.send = send
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.send({"type": "heartbeat"})
+            except OSError:
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+def run_worker(address: Tuple[str, int], bin_dir: Optional[Path] = None, name: Optional[str] = None) -> int:
+    """
+    Render shards for one conversion of the coordinator at ``address``
+
+    Args:
+        address: (host, port) of the coordinator
+        bin_dir: Directory containing ddjvu, tiffsplit and djvused
+        name: Name of the worker in the coordinator's logs
+
+    Returns:
+        Number of shards rendered
+    """
+    converter = DjVu2PDFConverter(bin_dir, tracer=NULL_TRACER)
+    djvused = converter._resolve_command(["djvused"])[0]
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    lock = threading.Lock()
+
+    with socket.create_connection(address) as connection, tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        rfile = connection.makefile("rb")
+
+        def send(message, files=()):
+            with lock:
+                send_message(connection, message, files)
+
+        send({"type": "hello", "worker": name})
+        document = receive_message(rfile, tmpdir)
+        if document.get("type") != "document" or len(document.get("files") or ()) != 1:
+            raise ProtocolError(f"expected a document, got {document.get('type')!r}")
+        input_file = tmpdir / document["files"][0][0]
+        num_pages = document["pages"]
+        rendered = 0
+
+        with DjVuDocumentSession(input_file, djvused) as session:
+            while True:
+                message = receive_message(rfile)
+                if message.get("type") == "done":
+                    return rendered
+                if message.get("type") != "shard":
+                    raise ProtocolError(f"unexpected {message.get('type')!r} message")
+
+                shard_dir = Path(tempfile.mkdtemp(prefix="shard-", dir=tmpdir))
+                try:
+                    page_texts = _PageTexts() if message.get("texts") else None
+                    try:
+                        with _Heartbeat(send, document.get("heartbeat") or 5.0):
+                            converter._render_page_range(session, input_file, shard_dir, message["first"],
+                                                         message["last"], num_pages, page_texts,
+                                                         ProgressTracker(lambda event: None))
+                    except Exception as e:
+                        # Whatever went wrong, the coordinator is told, so that it can
+                        # hand the shard to another worker rather than wait for it
+                        expected = isinstance(e, (OSError, RuntimeError))
+                        error = str(e) if expected else f"{type(e).__name__}: {e}"
+                        logger.warning("Pages %s-%s failed: %s", message["first"], message["last"], error,
+                                       exc_info=not expected)
+                        send({"type": "error", "id": message["id"], "message": error})
+                        continue
+                    send({"type": "result", "id": message["id"], "pages": page_texts.pages if page_texts else []},
+                         sorted(shard_dir.iterdir()))
+                    rendered += 1
+                finally:
+                    shutil.rmtree(shard_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert DjVu files to PDF with pages rendered by workers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinate = subparsers.add_parser("coordinate", help="convert a file, handing out its pages to workers")
+    coordinate.add_argument("input_file", type=Path, help="input .djvu file")
+    coordinate.add_argument("output_file", type=Path, help="output .pdf file")
+    coordinate.add_argument("--listen", type=parse_address, default=("127.0.0.1", 0), metavar="HOST:PORT",
+                            help="address to accept workers on (default: a free port on 127.0.0.1)")
+    coordinate.add_argument("--local-workers", type=int, default=os.cpu_count() or 1, metavar="N",
+                            help="worker processes to start on this host (default: one per CPU)")
+    coordinate.add_argument("--shard-size", type=int, default=50, metavar="PAGES",
+                            help="pages per shard (default: 50)")
+    coordinate.add_argument("--heartbeat", type=float, default=5.0, metavar="SECONDS",
+                            help="heartbeat interval of the workers (default: 5)")
+    coordinate.add_argument("--max-attempts", type=int, default=3,
+                            help="times a shard may fail before the conversion fails (default: 3)")
+    coordinate.add_argument("--bin-dir", type=Path, help="directory containing djvused, ddjvu, tiffsplit and pdfbeads")
+
+    worker = subparsers.add_parser("worker", help="render pages for a coordinator")
+    worker.add_argument("address", type=parse_address, metavar="HOST:PORT", help="address of the coordinator")
+    worker.add_argument("--name", help="name of the worker in the coordinator's logs")
+    worker.add_argument("--forever", action="store_true",
+                        help="keep serving conversions, waiting for the coordinator when it is not there")
+    worker.add_argument("--retry-interval", type=float, default=5.0, metavar="SECONDS",
+                        help="wait between connection attempts with --forever (default: 5)")
+    worker.add_argument("--bin-dir", type=Path, help="directory containing djvused, ddjvu and tiffsplit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.command == "worker":
+        while True:
+            try:
+                rendered = run_worker(args.address, args.bin_dir, args.name)
+                logger.info("Rendered %d shards", rendered)
+            except (OSError, ProtocolError) as e:
+                if not args.forever:
+                    sys.exit(f"Error: {e}")
+                logger.warning("Coordinator unavailable: %s", e)
+                time.sleep(args.retry_interval)
+                continue
+            if not args.forever:
+                return
+
+    with DistributedConverter(args.bin_dir, listen=args.listen, local_workers=args.local_workers,
+                              shard_size=args.shard_size, heartbeat=args.heartbeat,
+                              max_attempts=args.max_attempts,
+                              event_callback=lambda event: print(event.describe())) as converter:
+        host, port = converter.address
+        logger.info("Accepting workers on %s:%d", host, port)
+        try:
+            converter.convert(args.input_file, args.output_file, ConversionOutputs())
+        except (OSError, RuntimeError) as e:
+            sys.exit(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
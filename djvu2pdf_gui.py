@@ -14,9 +14,14 @@ from tkinter import Tk, Frame, Label, Button, filedialog, StringVar, messagebox
 from tkinter.ttk import Progressbar
 from tkinterdnd2 import DND_FILES, TkinterDnD
 import threading
+import time
 
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
 from djvu2pdf_converter import DjVu2PDFConverter
 
+# Seconds closing the window waits for a cancelled conversion to clean up
+CLOSE_TIMEOUT = 10.0
+
 
 class BinaryExtractor:
     """Extracts embedded binaries to temporary directory"""
@@ -64,8 +69,12 @@ class DjVu2PDFApp:
         self.output_file = None
         self.status_var = StringVar(value="Drag and drop a DjVu file or click 'Select File'")
         self.is_converting = False
+        self.cancel_token = None
+        self.thread = None
+        self.closing = False
 
         self._setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
 
     def _setup_ui(self):
         """Set up the user interface"""
@@ -138,6 +147,18 @@ class DjVu2PDFApp:
         )
         self.convert_btn.pack(side="left", padx=5)
 
+        # Cancel button
+        self.cancel_btn = Button(
+            button_frame,
+            text="Cancel",
+            command=self._cancel_conversion,
+            width=15,
+            height=2,
+            font=("Arial", 10),
+            state="disabled"
+        )
+        self.cancel_btn.pack(side="left", padx=5)
+
         # Progress bar
         self.progress = Progressbar(
             self.root,
@@ -221,46 +242,102 @@ class DjVu2PDFApp:
 
         # Disable buttons during conversion
         self.is_converting = True
+        self.cancel_token = CancellationToken()
         self.select_btn.config(state="disabled")
         self.convert_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
         self.progress['value'] = 0
 
         # Run conversion in separate thread
-        thread = threading.Thread(target=self._convert)
-        thread.daemon = True
-        thread.start()
+        self.thread = threading.Thread(target=self._convert, args=(self.cancel_token,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _cancel_conversion(self):
+        """Stop the running conversion; its tools are killed at once"""
+        if self.is_converting and self.cancel_token is not None:
+            self.cancel_btn.config(state="disabled")
+            self.status_var.set("Cancelling...")
+            self.cancel_token.cancel()
+
+    def _on_close(self):
+        """Cancel the conversion before quitting, so that no tool outlives the window"""
+        if self.closing:
+            return
+        self.closing = True
+        if self.thread is None or not self.thread.is_alive():
+            self.root.destroy()
+            return
+        self.cancel_token.cancel()
+        self.select_btn.config(state="disabled")
+        self.convert_btn.config(state="disabled")
+        self.cancel_btn.config(state="disabled")
+        self.status_var.set("Cancelling...")
+        self._close_when_stopped(time.monotonic() + CLOSE_TIMEOUT)
+
+    def _close_when_stopped(self, deadline):
+        """Destroy the window once the conversion thread has cleaned up its work directory"""
+        # Joining the thread here would block the event loop that the
+        # thread's root.after() calls wait for, so poll instead
+        if self.thread.is_alive() and time.monotonic() < deadline:
+            self.root.after(50, self._close_when_stopped, deadline)
+        else:
+            self.root.destroy()
 
-    def _convert(self):
+    def _convert(self, cancel_token):
         """Perform the conversion (runs in separate thread)"""
         try:
-            def progress_callback(message, percent):
-                self.root.after(0, self._update_progress, message, percent)
+            # Events are rate-limited by the converter, so forwarding each
+            # of them to the Tk event queue doesn't flood it
+            def event_callback(event):
+                self.root.after(0, self._update_progress, event)
 
             converter = DjVu2PDFConverter(
                 bin_dir=self.bin_dir,
-                progress_callback=progress_callback
+                event_callback=event_callback
             )
 
-            converter.convert(self.input_file, self.output_file)
+            converter.convert(self.input_file, self.output_file, cancel=cancel_token)
 
             # Success
             self.root.after(0, self._conversion_complete, True, None)
 
+        except ConversionCancelled:
+            self.root.after(0, self._conversion_cancelled)
+
         except Exception as e:
             # Error
             self.root.after(0, self._conversion_complete, False, str(e))
 
-    def _update_progress(self, message, percent):
+    def _update_progress(self, event):
         """Update progress bar and status (called from main thread)"""
-        self.progress['value'] = percent
-        self.status_var.set(message)
+        if self.closing:
+            return
+        self.progress['value'] = event.percent
+        self.status_var.set(event.describe())
         self.root.update_idletasks()
 
+    def _conversion_cancelled(self):
+        """Handle a cancelled conversion; the input file stays selected"""
+        self.is_converting = False
+        self.cancel_token = None
+        if self.closing:
+            return
+        self.select_btn.config(state="normal")
+        self.convert_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+        self.progress['value'] = 0
+        self.status_var.set("Conversion cancelled")
+
     def _conversion_complete(self, success, error_msg):
         """Handle conversion completion"""
         self.is_converting = False
+        self.cancel_token = None
+        if self.closing:
+            return
         self.select_btn.config(state="normal")
         self.convert_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
 
         if success:
             self.progress['value'] = 100
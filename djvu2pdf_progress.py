@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Progress events for conversions
+
+The converter reports what it is doing as a stream of ProgressEvent
+objects: the stage it is in, how many pages are done, how many bytes it
+has produced, and estimates of the overall percentage and of the time
+left. The estimates come from a per-page cost model of every stage,
+calibrated as the conversion goes by the time the finished stages actually
+took, so they follow the real work instead of fixed percentages.
+
+Page events are rate-limited: one arriving less than ``min_interval``
+after the previous event is held back, and coalesced with the pages that
+follow it, so that huge books don't flood consumers such as a GUI event
+queue. The held event is delivered once the interval has passed, or
+before the next stage change or the final event if those come first.
+Stage changes and the final event are always delivered.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# Expected cost of each stage, in seconds per page, in the order the
+# converter runs them: rendering and PDF encoding dominate, the rest is
+# mostly bookkeeping. Only the ratios matter until the first stage ends.
+STAGE_COSTS = {
+    "extract": 0.15,
+    "split": 0.01,
+    "rename": 0.0005,
+    "text": 0.005,
+    "toc": 0.0005,
+    "pdf": 0.4,
+    "finalize": 0.0005,
+}
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """
+    State of a conversion
+
+    Attributes:
+        stage: Current stage, one of STAGE_COSTS, or "done"
+        message: Human-readable description of the stage
+        percent: Estimated overall progress, 0 to 100; never decreases
+        page: Page just processed, in stages that go page by page
+        pages_done: Pages processed in the current stage
+        pages_total: Pages in the document, if known
+        bytes_done: Bytes written by the conversion so far
+        pages_per_second: Rate of the current stage, once measured
+        eta: Estimated seconds until the conversion is done
+        elapsed: Seconds since the conversion started
+    """
+    stage: str
+    message: str
+    percent: float
+    page: Optional[int] = None
+    pages_done: int = 0
+    pages_total: Optional[int] = None
+    bytes_done: int = 0
+    pages_per_second: Optional[float] = None
+    eta: Optional[float] = None
+    elapsed: float = 0.0
+
+    def describe(self) -> str:
+        """The message, followed by the rate and the time left when they are known"""
+        details = []
+        if self.pages_per_second:
+            details.append(f"{self.pages_per_second:.1f} pages/s")
+        if self.eta is not None and self.stage != "done":
+            details.append(f"about {format_duration(self.eta)} left")
+        if not details:
+            return self.message
+        return f"{self.message} - {', '.join(details)}"
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration as 42s, 3m 05s or 1h 02m"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+def _thread_timer(delay: float, function: Callable[[], None]) -> threading.Timer:
+    """Call ``function`` in a thread of its own after ``delay`` seconds"""
+    timer = threading.Timer(delay, function)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class ProgressTracker:
+    """
+    Turns the converter's stage and page notifications into ProgressEvents
+
+    Not meant to be shared between conversions. The callback is called from
+    the thread that reports progress, or from the timer delivering a held
+    page event; the events arrive one at a time and in order.
+    """
+
+    def __init__(self, callback: Callable[[ProgressEvent], None], min_interval: float = 0.1,
+                 clock: Callable[[], float] = time.monotonic,
+                 timer: Callable[[float, Callable[[], None]], object] = _thread_timer):
+        """
+        Create a tracker
+
+        Args:
+            callback: Receives the events
+            min_interval: Minimum number of seconds between two page events
+            clock: Time source, in seconds
+            timer: Calls a function after a delay in seconds, as
+                    loop.call_later() does, and returns something with a
+                    cancel() method. Delivers held page events
+        """
+        self.callback = callback
+        self.min_interval = min_interval
+        self.clock = clock
+        self.timer = timer
+        self.pages_total = None
+        self.bytes_done = 0
+        self._lock = threading.Lock()
+        # Held while an event is made and delivered, so that the timer's
+        # events don't overtake the others
+        self._delivery = threading.Lock()
+        self._pending = None
+        self._start = None
+        self._stage = None
+        self._message = ""
+        self._stage_start = None
+        self._pages_done = 0
+        self._percent = 0.0
+        self._last_emit = None
+        self._held_page = None
+        # Seconds the finished stages took, and what the model expected
+        self._actual = 0.0
+        self._expected = 0.0
+        self._finished_stages = []
+        # Stages that will not run in this conversion
+        self._skipped_stages = set()
+
+    def start(self, pages_total: Optional[int] = None):
+        """Start the clock; ``pages_total`` may also be set later with stage()"""
+        self._start = self.clock()
+        self.pages_total = pages_total
+
+    def skip(self, *stages: str):
+        """Leave out of the time left stages that this conversion will not run"""
+        with self._lock:
+            self._skipped_stages.update(stages)
+
+    def _expected_time(self, stage: str) -> float:
+        return STAGE_COSTS.get(stage, 0.0) * (self.pages_total or 1)
+
+    def _end_stage(self, now: float):
+        if self._stage is None:
+            return
+        self._actual += now - self._stage_start
+        self._expected += self._expected_time(self._stage)
+        self._finished_stages.append(self._stage)
+
+    def _speed_factor(self) -> float:
+        """How much slower than the model this machine and document are"""
+        if self._expected > 0 and self._actual > 0:
+            return self._actual / self._expected
+        return 1.0
+
+    def _rate(self, now: float) -> Optional[float]:
+        elapsed = now - self._stage_start
+        if self._pages_done and elapsed > 0:
+            return self._pages_done / elapsed
+        return None
+
+    def _eta(self, now: float) -> float:
+        factor = self._speed_factor()
+        elapsed = now - self._stage_start
+        rate = self._rate(now)
+        if rate and self.pages_total:
+            remaining = (self.pages_total - self._pages_done) / rate
+        else:
+            remaining = max(self._expected_time(self._stage) * factor - elapsed, 0.0)
+        later = [stage for stage in STAGE_COSTS
+                 if stage not in self._finished_stages and stage not in self._skipped_stages and stage != self._stage]
+        return remaining + sum(self._expected_time(stage) * factor for stage in later)
+
+    def _event(self, now: float, page: Optional[int] = None) -> ProgressEvent:
+        elapsed = now - self._start
+        eta = self._eta(now)
+        if elapsed + eta > 0:
+            # Never go backwards when the estimates change
+            self._percent = max(self._percent, min(100.0 * elapsed / (elapsed + eta), 99.0))
+        return ProgressEvent(
+            stage=self._stage,
+            message=self._message,
+            percent=self._percent,
+            page=page,
+            pages_done=self._pages_done,
+            pages_total=self.pages_total,
+            bytes_done=self.bytes_done,
+            pages_per_second=self._rate(now),
+            eta=eta,
+            elapsed=elapsed,
+        )
+
+    def _emit(self, *events: ProgressEvent):
+        for event in events:
+            self.callback(event)
+
+    def _flush(self, now: float) -> tuple:
+        """The page event held back by the rate limit, if any"""
+        self._cancel_pending()
+        if self._held_page is None:
+            return ()
+        event = self._event(now, self._held_page)
+        self._held_page = None
+        return (event,)
+
+    def _cancel_pending(self):
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+    def _deliver_held(self):
+        """Deliver the page event held back, now that its interval has passed"""
+        with self._delivery:
+            with self._lock:
+                self._pending = None
+                now = self.clock()
+                held = self._flush(now)
+                if held:
+                    self._last_emit = now
+            self._emit(*held)
+
+    def stage(self, stage: str, message: str, pages_total: Optional[int] = None):
+        """Finish the current stage and start the next one"""
+        with self._delivery:
+            with self._lock:
+                now = self.clock()
+                if self._start is None:
+                    self._start = now
+                if pages_total is not None:
+                    self.pages_total = pages_total
+                held = self._flush(now)
+                self._end_stage(now)
+                self._stage = stage
+                self._message = message
+                self._stage_start = now
+                self._pages_done = 0
+                self._last_emit = now
+                event = self._event(now)
+            self._emit(*held, event)
+
+    def page(self, page: int, message: Optional[str] = None):
+        """Record that one more page of the current stage is done"""
+        with self._delivery:
+            with self._lock:
+                now = self.clock()
+                self._pages_done += 1
+                if message is not None:
+                    self._message = message
+                if self._last_emit is not None and now - self._last_emit < self.min_interval:
+                    self._held_page = page
+                    if self._pending is None:
+                        self._pending = self.timer(self._last_emit + self.min_interval - now, self._deliver_held)
+                    return
+                self._held_page = None
+                self._cancel_pending()
+                self._last_emit = now
+                event = self._event(now, page)
+            self._emit(event)
+
+    def add_bytes(self, count: int):
+        """Count bytes written by the conversion"""
+        with self._lock:
+            self.bytes_done += count
+
+    def finish(self, message: str):
+        """Report the end of the conversion"""
+        with self._delivery:
+            with self._lock:
+                now = self.clock()
+                held = self._flush(now)
+                self._end_stage(now)
+                self._stage = "done"
+                self._message = message
+                self._stage_start = now
+                self._pages_done = 0
+                self._percent = 100.0
+                event = ProgressEvent(
+                    stage="done",
+                    message=message,
+                    percent=100.0,
+                    pages_total=self.pages_total,
+                    bytes_done=self.bytes_done,
+                    eta=0.0,
+                    elapsed=now - self._start if self._start is not None else 0.0,
+                )
+            self._emit(*held, event)
+
+    def close(self):
+        """Drop the held page event of a conversion that ended without finish()"""
+        with self._lock:
+            self._cancel_pending()
+            self._held_page = None
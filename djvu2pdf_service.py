@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+Local HTTP conversion service
+
+Accepts DjVu uploads, converts them with a bounded pool of worker threads,
+and serves the PDFs back:
+
+    POST   /jobs            upload a DjVu file (the request body); 202 with the job,
+                            429 when the queue is full, 413 when the file is too big
+    GET    /jobs/ID         job state and progress
+    GET    /jobs/ID/pdf     the PDF of a finished job; supports Range requests
+    DELETE /jobs/ID         forget a job and delete its files; a queued or
+                            running job is cancelled
+    GET    /health          queue and worker statistics
+
+Uploads are streamed to disk, and so are downloads from it. Jobs live in
+memory; their files live in the work directory until they are deleted, or
+until they expire some time after the conversion ended.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from queue import Empty, Queue
+from typing import Dict, Optional, Tuple
+
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
+from djvu2pdf_converter import DjVu2PDFConverter
+from djvu2pdf_progress import ProgressEvent
+
+logger = logging.getLogger("djvu2pdf.service")
+
+_CHUNK_SIZE = 1 << 16
+
+_range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@dataclass
+class Job:
+    """
+    A conversion requested through the service
+
+    Attributes:
+        id: Identifier used in URLs
+        directory: Holds input.djvu and, once converted, output.pdf
+        state: "queued", "running", "done", "failed" or "cancelled"
+        progress: Latest progress event of the conversion
+        error: Why the conversion failed
+        created: When the job was accepted (time.time())
+        started: When a worker picked it up
+        finished: When the conversion ended
+        cancel: Cancels the conversion when the job is deleted or the
+            service stops
+
+    The service changes state, progress, error, started and finished under
+    its lock.
+    """
+    id: str
+    directory: Path
+    state: str = "queued"
+    progress: Optional[ProgressEvent] = None
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    cancel: CancellationToken = field(default_factory=CancellationToken, repr=False, compare=False)
+
+    @property
+    def input_file(self) -> Path:
+        return self.directory / "input.djvu"
+
+    @property
+    def output_file(self) -> Path:
+        return self.directory / "output.pdf"
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "progress": asdict(self.progress) if self.progress is not None else None,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class QueueFull(Exception):
+    """Raised when a job cannot be accepted because too many are waiting"""
+
+
+class ConversionService:
+    """
+    Job queue and worker pool
+
+    At most ``max_queued`` jobs wait for a worker; a slot is reserved before
+    the upload is read, so that a full queue costs the client no upload.
+    Jobs are forgotten, and their files deleted, ``keep`` seconds after
+    their conversion ended.
+    """
+
+    def __init__(self, work_dir: Path, workers: int = 2, max_queued: int = 8,
+                 bin_dir: Optional[Path] = None, keep: Optional[float] = 3600.0):
+        """
+        Create the service; start() starts the workers
+
+        Args:
+            work_dir: Directory for the jobs' files
+            workers: Number of conversions run at the same time
+            max_queued: Number of jobs that may wait for a worker
+            bin_dir: Directory containing the conversion tools, as for DjVu2PDFConverter
+            keep: Seconds finished jobs are kept for; None keeps them until deleted
+        """
+        self.work_dir = Path(work_dir)
+        self.workers = workers
+        self.max_queued = max_queued
+        self.bin_dir = bin_dir
+        self.keep = keep
+        self.jobs: Dict[str, Job] = {}
+        self._queue = Queue()
+        self._slots = threading.BoundedSemaphore(max_queued)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._expiry = None
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._rejected = 0
+        self._expired = 0
+
+    def start(self):
+        """Start the worker threads, and the thread removing expired jobs"""
+        self._stopping.clear()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"djvu2pdf-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.keep is not None:
+            self._expiry = threading.Thread(target=self._expire_jobs, name="djvu2pdf-expiry", daemon=True)
+            self._expiry.start()
+
+    def stop(self):
+        """
+        Cancel the queued and running jobs, and wait for the threads to exit
+
+        Running conversions are killed, so this takes about as long as
+        cancelling one of them, however many jobs are queued.
+        """
+        self._stopping.set()
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except Empty:
+                break
+            if job is not None:
+                self._slots.release()
+                job.cancel.cancel()
+                self._finish(job, "cancelled")
+        with self._lock:
+            for job in self.jobs.values():
+                if job.state == "running":
+                    job.cancel.cancel()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._expiry is not None:
+            self._expiry.join()
+            self._expiry = None
+
+    def reserve(self):
+        """Reserve a place in the queue; raises QueueFull if there is none"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFull()
+
+    def release(self):
+        """Give back a reservation that did not become a job"""
+        self._slots.release()
+
+    def new_job(self) -> Job:
+        """Create a job and its directory; its input is to be written to job.input_file"""
+        job_id = uuid.uuid4().hex
+        directory = self.work_dir / job_id
+        directory.mkdir(parents=True)
+        return Job(job_id, directory)
+
+    def submit(self, job: Job):
+        """Queue a job, in the place reserved for it"""
+        with self._lock:
+            self.jobs[job.id] = job
+        self._queue.put(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def describe(self, job: Job) -> dict:
+        """The job as JSON, as one consistent snapshot"""
+        with self._lock:
+            return job.to_json()
+
+    def remove_expired(self, now: Optional[float] = None) -> int:
+        """
+        Forget the jobs that ended more than ``keep`` seconds ago, and
+        delete their files
+
+        Returns:
+            The number of jobs removed
+        """
+        if self.keep is None:
+            return 0
+        deadline = (time.time() if now is None else now) - self.keep
+        with self._lock:
+            expired = [job for job in self.jobs.values()
+                       if job.finished is not None and job.finished <= deadline]
+            for job in expired:
+                del self.jobs[job.id]
+            self._expired += len(expired)
+        for job in expired:
+            shutil.rmtree(job.directory, ignore_errors=True)
+        return len(expired)
+
+    def delete(self, job_id: str) -> Optional[Job]:
+        """
+        Forget a job and delete its files
+
+        A queued or running job is cancelled; its worker deletes the files
+        once the conversion has stopped.
+        """
+        with self._lock:
+            job = self.jobs.pop(job_id, None)
+            if job is None:
+                return None
+            job.cancel.cancel()
+            active = job.state in ("queued", "running")
+        if not active:
+            shutil.rmtree(job.directory, ignore_errors=True)
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self._queue.qsize(),
+                "max_queued": self.max_queued,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "rejected": self._rejected,
+                "expired": self._expired,
+            }
+
+    def _expire_jobs(self):
+        # Expired jobs are removed within a tenth of the retention time, but
+        # at least every minute
+        interval = min(max(self.keep / 10, 0.01), 60.0)
+        while not self._stopping.wait(interval):
+            self.remove_expired()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._slots.release()
+            self._run(job)
+
+    def _run(self, job: Job):
+        with self._lock:
+            self._running += 1
+            job.state = "running"
+            job.started = time.time()
+
+        def progress(event: ProgressEvent):
+            with self._lock:
+                job.progress = event
+
+        converter = DjVu2PDFConverter(bin_dir=self.bin_dir, event_callback=progress)
+        state, error = "failed", None
+        try:
+            converter.convert(job.input_file, job.output_file, cancel=job.cancel)
+        except ConversionCancelled:
+            state = "cancelled"
+        except Exception as e:
+            logger.warning("Job %s failed: %s", job.id, e)
+            error = str(e)
+        else:
+            state = "done"
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._finish(job, state, error)
+
+    def _finish(self, job: Job, state: str, error: Optional[str] = None):
+        """Record how a job ended, and delete what is no longer needed"""
+        job.input_file.unlink(missing_ok=True)
+        with self._lock:
+            job.state = state
+            job.error = error
+            job.finished = time.time()
+            if state == "done":
+                self._completed += 1
+            elif state == "cancelled":
+                self._cancelled += 1
+            else:
+                self._failed += 1
+            # Deleted while queued or running
+            deleted = self.jobs.get(job.id) is not job
+        if deleted:
+            shutil.rmtree(job.directory, ignore_errors=True)
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int]:
+    """
+    Parse a single-range Range header
+
+    Args:
+        header: Value of the header, such as "bytes=0-499" or "bytes=-500"
+        size: Size of the file
+
+    Returns:
+        (first, last) byte positions, inclusive
+
+    Raises:
+        ValueError: The range cannot be satisfied, or is not understood
+    """
+    match = _range_re.match(header.strip())
+    if match is None or match.group(1) == match.group(2) == "":
+        raise ValueError(f"Unsupported range: {header}")
+    first, last = match.groups()
+    if first == "":
+        # The last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty range")
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = size - 1 if last == "" else min(int(last), size - 1)
+    if first > last:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    return first, last
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a ConversionService (self.server.service)"""
+
+    server_version = "djvu2pdf"
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    @property
+    def service(self) -> ConversionService:
+        return self.server.service
+
+    def _send_json(self, status: int, data: dict, headers: Optional[dict] = None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, headers: Optional[dict] = None):
+        self._send_json(status, {"error": message}, headers)
+
+    def _job_route(self) -> Tuple[Optional[Job], str]:
+        """The job a /jobs/ID[/...] path names, and what follows the id"""
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "jobs":
+            return None, ""
+        return self.service.get(parts[1]), "/".join(parts[2:])
+
+    def do_POST(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/jobs":
+            self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+            return
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            self._send_error(HTTPStatus.LENGTH_REQUIRED, "Content-Length is required")
+            return
+        length = int(length)
+        if self.server.max_upload is not None and length > self.server.max_upload:
+            self.close_connection = True
+            self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Uploads are limited to {self.server.max_upload} bytes")
+            return
+        try:
+            self.service.reserve()
+        except QueueFull:
+            # The body is not read, so the connection cannot be reused
+            self.close_connection = True
+            self._send_error(HTTPStatus.TOO_MANY_REQUESTS, "Too many jobs are waiting",
+                             {"Retry-After": str(self.server.retry_after)})
+            return
+
+        job = None
+        try:
+            job = self.service.new_job()
+            remaining = length
+            with open(job.input_file, "wb") as output:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise ConnectionError("Upload ended early")
+                    output.write(chunk)
+                    remaining -= len(chunk)
+        except BaseException:
+            self.service.release()
+            if job is not None:
+                shutil.rmtree(job.directory, ignore_errors=True)
+            raise
+        self.service.submit(job)
+        self._send_json(HTTPStatus.ACCEPTED, job.to_json(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0].rstrip("/") == "/health":
+            self._send_json(HTTPStatus.OK, self.service.stats())
+            return
+        job, rest = self._job_route()
+        if job is None:
+            self._send_error(HTTPStatus.NOT_FOUND, "No such job")
+        elif rest == "":
+            self._send_json(HTTPStatus.OK, self.service.describe(job))
+        elif rest == "pdf":
+            self._send_pdf(job)
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Not found")
+
+    do_HEAD = do_GET
+
+    def do_DELETE(self):
+        job, rest = self._job_route()
+        if job is None or rest:
+            self._send_error(HTTPStatus.NOT_FOUND, "No such job")
+            return
+        self.service.delete(job.id)
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.end_headers()
+
+    def _send_pdf(self, job: Job):
+        state = self.service.describe(job)["state"]
+        if state != "done":
+            self._send_error(HTTPStatus.CONFLICT, f"Job is {state}")
+            return
+        try:
+            pdf = open(job.output_file, "rb")
+        except FileNotFoundError:
+            # Deleted in the meantime
+            self._send_error(HTTPStatus.NOT_FOUND, "No such job")
+            return
+        with pdf:
+            size = os.fstat(pdf.fileno()).st_size
+            first, last = 0, size - 1
+            status = HTTPStatus.OK
+            range_header = self.headers.get("Range")
+            if range_header and size:
+                try:
+                    first, last = parse_range(range_header, size)
+                except ValueError:
+                    self._send_error(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, "Range not satisfiable",
+                                     {"Content-Range": f"bytes */{size}"})
+                    return
+                status = HTTPStatus.PARTIAL_CONTENT
+            self.send_response(status)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(last - first + 1))
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+            self.end_headers()
+            if self.command == "HEAD":
+                return
+            pdf.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = pdf.read(min(_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+class ConversionServer(ThreadingHTTPServer):
+    """HTTP server of a ConversionService"""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ConversionService,
+                 max_upload: Optional[int] = None, retry_after: int = 5):
+        """
+        Create the server
+
+        Args:
+            address: (host, port) to listen on; port 0 picks a free port
+            service: Service the requests go to
+            max_upload: Largest accepted upload, in bytes
+            retry_after: Seconds clients are told to wait when the queue is full
+        """
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+        self.max_upload = max_upload
+        self.retry_after = retry_after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve DjVu to PDF conversions over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--workers", type=int, default=2, help="conversions run at the same time (default: 2)")
+    parser.add_argument("--queue", type=int, default=8, help="jobs that may wait for a worker (default: 8)")
+    parser.add_argument("--max-upload", type=int, metavar="BYTES", help="largest accepted upload")
+    parser.add_argument("--keep", type=float, default=3600.0, metavar="SECONDS",
+                        help="how long finished jobs and their PDFs are kept (default: 3600)")
+    parser.add_argument("--work-dir", type=Path, help="directory for the jobs' files (default: a temporary directory)")
+    parser.add_argument("--bin-dir", type=Path, help="directory containing djvused, ddjvu, tiffsplit and pdfbeads")
+    args = parser.parse_args()
+    if args.workers < 1 or args.queue < 1:
+        parser.error("--workers and --queue must be positive")
+    if args.keep < 0:
+        parser.error("--keep must not be negative")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        service = ConversionService(args.work_dir or Path(tmpdir), args.workers, args.queue, args.bin_dir, args.keep)
+        service.start()
+        server = ConversionServer((args.host, args.port), service, args.max_upload)
+        host, port = server.server_address[:2]
+        logger.info("Listening on http://%s:%d/", host, port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+djvused session for querying a DjVu document
+"""
+
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# Seconds to wait for djvused to print the next line of an answer
+DEFAULT_TIMEOUT = 60.0
+
+
+class DjVuDocumentSession:
+    """
+    Answers queries about one DjVu document from few djvused processes
+
+    As in upstream djvu2hocr, djvused runs a script file and its answers
+    are read in order, rather than being fed commands one at a time: that
+    would need djvused to read its commands line by line and to flush its
+    output after each of them, which it is not known to do. The page texts
+    come from a single djvused running a script for every remaining page;
+    its answers are read as the pages are asked for, and asking for any
+    other page starts a new one from there. Every answer is memoized.
+
+    Each page's commands are followed by an ``n`` command; its output (the
+    page count, printed on a line of its own) marks the end of the answer.
+    A djvused that prints nothing for ``timeout`` seconds is killed, and the
+    query fails.
+    """
+
+    _size_re = re.compile(r'\s*width=(?P<width>\d+)\s+height=(?P<height>\d+)[^\n]*\n?')
+    # A page in the output of ``ls``: number, type, size, id and an optional title
+    _ls_page_re = re.compile(
+        r'^\s*(?P<number>\d+)\s+P\s+\d+\s+(?P<id>.+?)(?:\s+T=(?P<title>.+?))?\s*$', re.MULTILINE
+    )
+
+    def __init__(self, input_file: Path, djvused: str = "djvused", timeout: Optional[float] = DEFAULT_TIMEOUT):
+        """
+        Prepare queries about a document; djvused is started when they are asked
+
+        Args:
+            input_file: Path to DjVu file
+            djvused: djvused executable to run
+            timeout: Seconds djvused may stay silent while answering; None waits forever
+        """
+        self.input_file = Path(input_file)
+        self.djvused = str(djvused)
+        self.timeout = timeout
+        self._stderr = tempfile.TemporaryFile()
+        self._scripts = tempfile.TemporaryDirectory(prefix="djvused-")
+        self._script_count = 0
+        self._lock = threading.Lock()
+        # The djvused process running, and the page whose answer it prints next
+        self._run = None
+        self._next_page = None
+        self._killed = False
+        self._page_count = None
+        self._page_sizes = {}
+        self._page_texts = {}
+        self._outline = None
+        self._page_ids = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """Stop djvused; memoized answers stay available"""
+        self._stop()
+        self._scripts.cleanup()
+        self._stderr.close()
+
+    def kill(self):
+        """Stop djvused at once, for instance from another thread to cancel a conversion"""
+        self._killed = True
+        run = self._run
+        if run is not None:
+            run.kill()
+
+    def _stop(self):
+        """Stop the djvused process running, if any"""
+        run, self._run = self._run, None
+        self._next_page = None
+        if run is not None:
+            run.kill()
+            run.process.wait()
+
+    def _error(self, message: str) -> RuntimeError:
+        """Build an error including whatever djvused printed on stderr"""
+        error_msg = f"{message}: djvused {self.input_file}\n"
+        try:
+            self._stderr.seek(0)
+            stderr = self._stderr.read().decode('utf-8', 'replace')
+        except (OSError, ValueError):
+            stderr = ''
+        if stderr:
+            error_msg += f"Error output: {stderr}"
+        return RuntimeError(error_msg)
+
+    def _script(self, commands: str) -> Path:
+        """Write a djvused script, one command per line"""
+        self._script_count += 1
+        script = Path(self._scripts.name) / f"script{self._script_count}.djvused"
+        script.write_text(commands, encoding='utf-8')
+        return script
+
+    def _start(self, commands: str):
+        """Start djvused on a script, in place of the process running"""
+        if self._killed:
+            raise self._error("djvused was killed")
+        self._stop()
+        # -u: print text as UTF-8 rather than octal escapes
+        self._run = _DjVusedRun([self.djvused, "-u", "-f", str(self._script(commands)), str(self.input_file)],
+                                self._stderr)
+        if self._killed:
+            # Killed from another thread while starting
+            self._run.kill()
+
+    def _readline(self) -> Optional[str]:
+        """The next line djvused prints, or None once it has exited successfully"""
+        run = self._run
+        try:
+            line = run.readline(self.timeout)
+        except queue.Empty:
+            self._stop()
+            raise self._error(f"djvused printed nothing for {self.timeout:g} seconds") from None
+        if line is None:
+            self._run = None
+            if run.process.wait() != 0 or self._killed:
+                raise self._error("djvused exited unexpectedly")
+        return line
+
+    def _read_answer(self, sentinel: Optional[str] = None) -> str:
+        """Everything djvused prints up to ``sentinel`` (excluded), or up to its end"""
+        lines = []
+        while True:
+            line = self._readline()
+            if line is None:
+                if sentinel is not None:
+                    raise self._error("djvused exited unexpectedly")
+                return ''.join(lines)
+            if line == sentinel:
+                return ''.join(lines)
+            lines.append(line)
+
+    def _query(self, command: str) -> str:
+        """Run djvused commands and return everything they printed"""
+        self._start(f"{command}\n")
+        return self._read_answer()
+
+    def _count_pages(self):
+        if self._page_count is None:
+            self._page_count = int(self._query("n"))
+
+    def page_count(self) -> int:
+        """Number of pages in the document"""
+        with self._lock:
+            self._count_pages()
+        return self._page_count
+
+    @staticmethod
+    def _page_query(page: int) -> str:
+        return f"select {page}; size; print-txt"
+
+    @classmethod
+    def _pages_script(cls, first: int, page_count: int) -> str:
+        """Script printing pages ``first`` to the last one, each followed by the page count"""
+        return ''.join(f"{cls._page_query(page)}\nn\n" for page in range(first, page_count + 1))
+
+    def _store_page(self, page: int, output: str):
+        """Memoize the size and text of a page from the output of _page_query()"""
+        size_match = self._size_re.match(output)
+        if size_match is None:
+            raise self._error(f"Cannot determine the size of page {page}")
+        self._page_sizes[page] = int(size_match.group('width')), int(size_match.group('height'))
+        self._page_texts[page] = output[size_match.end():].strip()
+
+    def _load_page(self, page: int):
+        with self._lock:
+            self._count_pages()
+            if not 1 <= page <= self._page_count:
+                raise self._error(f"No page {page} in a document of {self._page_count} pages")
+            if self._run is None or self._next_page != page:
+                self._start(self._pages_script(page, self._page_count))
+            self._next_page = page + 1
+            self._store_page(page, self._read_answer(f"{self._page_count}\n"))
+            if page == self._page_count:
+                self._stop()
+
+    def page_size(self, page: int) -> Tuple[int, int]:
+        """
+        Size of a page
+
+        Args:
+            page: Page number (1-indexed)
+
+        Returns:
+            (width, height) tuple
+        """
+        if page not in self._page_sizes:
+            self._load_page(page)
+        return self._page_sizes[page]
+
+    def page_text(self, page: int) -> str:
+        """
+        Hidden text of a page
+
+        Args:
+            page: Page number (1-indexed)
+
+        Returns:
+            The page's text layer as an s-expression, or '' if it has none
+        """
+        if page not in self._page_texts:
+            self._load_page(page)
+        return self._page_texts[page]
+
+    def outline(self) -> str:
+        """Document outline as printed by djvused, or '' if there is none"""
+        if self._outline is None:
+            with self._lock:
+                self._outline = self._query("print-outline").strip()
+        return self._outline
+
+    def page_ids(self) -> Dict[str, int]:
+        """
+        Page numbers by page id and by page title
+
+        Outlines can point at a page by its id or title instead of its
+        number; ids take precedence over titles.
+        """
+        if self._page_ids is None:
+            with self._lock:
+                self._page_ids = self._parse_page_ids(self._query("ls"))
+        return self._page_ids
+
+    @classmethod
+    def _parse_page_ids(cls, listing: str) -> Dict[str, int]:
+        """Page numbers by id and title, from the output of ``ls``"""
+        page_ids = {}
+        for match in cls._ls_page_re.finditer(listing):
+            number = int(match.group('number'))
+            page_ids[match.group('id')] = number
+            if match.group('title'):
+                page_ids.setdefault(match.group('title'), number)
+        return page_ids
+
+    def forget_page(self, page: int):
+        """Drop the memoized text of a page that will not be asked for again"""
+        self._page_texts.pop(page, None)
+
+
+class _DjVusedRun:
+    """A djvused process running a script, whose output is read line by line with a timeout"""
+
+    def __init__(self, argv: list, stderr):
+        self.process = subprocess.Popen(
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            encoding='utf-8',
+            errors='replace',
+        )
+        # A thread reads the output, so that waiting for a line can time out
+        # on every platform; None marks the end of the output
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        try:
+            for line in self.process.stdout:
+                self._lines.put(line)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.process.stdout.close()
+            self._lines.put(None)
+
+    def readline(self, timeout: Optional[float]) -> Optional[str]:
+        """The next line of output, or None at its end; raises queue.Empty after ``timeout`` seconds"""
+        return self._lines.get(timeout=timeout)
+
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
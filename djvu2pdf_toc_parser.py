@@ -1,42 +1,193 @@
 #!/usr/bin/python
 
+import re
 import sys
 
+# A string literal, with its escape sequences left as they are
+_string = r'"([^"\\]*(?:\\.[^"\\]*)*)"'
+
+# One token of an s-expression. A bookmark, i.e. an opening parenthesis
+# followed by two strings (its title and link), is matched as a single
+# token, as outlines are made almost entirely of them.
+_token_re = re.compile(r'''
+    \s*
+    (?:
+        \( \s* {string} \s* {string}   # 1, 2: bookmark
+    |
+        (\))                          # 3: closing parenthesis
+    |
+        (\()                          # 4: opening parenthesis
+    |
+        {string}                       # 5: string
+    |
+        ([^\s()"]+)                    # 6: any other atom
+    |
+        (\S)                           # 7: anything else
+    )
+'''.format(string=_string), re.VERBOSE | re.DOTALL)
+
+_string_re = re.compile(_string, re.DOTALL)
+
+# The beginning of a bookmark, cut short by the end of the text
+_partial_bookmark_re = re.compile(r'''
+    \( \s*
+    (?:
+        " [^"\\]* (?:\\.[^"\\]*)* \\?
+        (?: " \s* (?: " [^"\\]* (?:\\.[^"\\]*)* \\? )? )?
+    )?
+    \Z
+''', re.VERBOSE | re.DOTALL)
+
+_token_kinds = (None, 'bookmark', 'bookmark', ')', '(', 'string', 'atom', None)
+
+# How much input tokenize() collects before scanning it
+_chunk_size = 1 << 16
+
+
+def _scan_tokens(text, pos, final):
+    """
+    Generate ``kind, value`` for the tokens of ``text[pos:]``, and
+    return the index right after the last one.
+
+    ``kind`` is 'bookmark' (``value`` is then a ``title, link`` pair),
+    '(' or ')' (``value`` is then None), 'string' or 'atom'. Unless
+    ``final`` is true, tokens that might continue in the text that
+    follows are not generated.
+    """
+    length = len(text)
+    for token in _token_re.finditer(text, pos):
+        group = token.lastindex
+        if group == 2:
+            yield 'bookmark', token.group(1, 2)
+        elif group == 7:
+            # Most likely an unterminated string
+            if final:
+                raise ValueError("malformed outline: unexpected {0!r}".format(text[token.start(7):token.start(7) + 20]))
+            return pos
+        elif final:
+            yield _token_kinds[group], token.group(group)
+        elif group == 4 and _partial_bookmark_re.match(text, token.start(4)):
+            return pos
+        elif group == 6 and token.end() == length:
+            return pos
+        else:
+            yield _token_kinds[group], token.group(group)
+        pos = token.end()
+    return pos
+
+
+def tokenize(chunks):
+    """
+    Split an s-expression read piece by piece (for example line by line
+    from ``djvused``) into tokens.
+
+    Generates ``kind, value`` pairs as described in ``_scan_tokens``;
+    the tokens don't depend on how the input is split.
+    """
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= _chunk_size:
+            pos = yield from _scan_tokens(buffer, 0, False)
+            buffer = buffer[pos:]
+    yield from _scan_tokens(buffer, 0, True)
+
+
+def _format_title(title):
+    # `pdfbeads` cannot handle escaped double quotes, so every escaped
+    # double quote is replaced by a single quote. Within a string
+    # literal, every double quote is escaped.
+    return '"' + title.replace('\\"', "'") + '"'
+
+
+def _format_target(target, page_ids=None):
+    # `djvused` outputs page numbers prefixed with '#', which we don't
+    # want in our output; other '#' targets name a page by its id or title
+    if target.startswith('#'):
+        target = target[1:]
+        if page_ids and not target.isdigit():
+            target = str(page_ids.get(target, target))
+    return '"' + target + '"'
+
+
+def translate_outline(toc_input, page_ids=None):
+    """
+    Translate TOC in the s-exp format output by ``djvused`` to the
+    format understood by ``pdfbeads``, one line at a time.
+
+    ``toc_input`` is the whole '(bookmarks ...)' expression, either as
+    a string or as an iterable of strings (such as a file). Anything
+    after its closing parenthesis is disregarded. ``page_ids`` maps
+    page ids (and titles) to page numbers, for outlines that point at
+    pages by name rather than by number.
+
+    The outline is walked without recursion, so neither its size nor
+    its depth is limited. Raises ValueError if it is badly formatted.
+    """
+    if isinstance(toc_input, str):
+        toc_input = [toc_input]
+    tokens = tokenize(toc_input)
+
+    def expect(kind, what):
+        token_kind, value = next(tokens, (None, None))
+        if token_kind != kind:
+            found = 'end of input' if token_kind is None else repr(value or token_kind)
+            raise ValueError("malformed outline: expected {0}, found {1}".format(what, found))
+        return value
+
+    kind, value = next(tokens, (None, None))
+    if kind is None:
+        return
+    if kind != '(' or expect('atom', "'bookmarks'") != 'bookmarks':
+        raise ValueError("malformed outline: expected 'bookmarks'")
+    indent_str = ''
+    for kind, value in tokens:
+        if kind == 'bookmark':
+            title, target = value
+            yield indent_str + _format_title(title) + ' ' + _format_target(target, page_ids)
+            indent_str += '\t'
+        elif kind == ')':
+            if not indent_str:
+                return
+            indent_str = indent_str[:-1]
+        else:
+            raise ValueError("malformed outline: unexpected {0!r}".format(value))
+    raise ValueError("malformed outline: expected ')', found end of input")
+
+
 def parse_sexp(toc_input, toc_output, indent_str, i):
     """
     Translate TOC in the s-exp format output by ``djvused`` to a
-    format understood by ``pdfbeads``. 
+    format understood by ``pdfbeads``.
 
     ``toc_input[i:]`` is the string to parse, and ``indent_str`` is
     the string of tabulations for our current level in the output
     TOC. The output from ``djvused`` should not include the
     '(bookmarks' prefix because the caller strips it (including the
     opening parenthesis) before invoking this function. Anything after
-    its matching closing brace is disregarded.
+    its matching closing brace is disregarded, and the index right
+    after it is returned.
 
-    If the input is badly formatted, weird things will happen.
+    See ``translate_outline`` for a version that takes the whole
+    outline.
     """
-    
-    while True:
-        
-        if toc_input[i] == '(':
-            i += 1
-            i, title = next_quote(toc_input, i)
-            i, page  = next_quote(toc_input, i)
-            
-            # `djvused` outputs page numbers prefixed with '#' (the
-            # second character of the `page` variable) which we don't
-            # want in our output
-            page = page[0]+page[2:] 
-            
-            toc_output += ["{0}{1} {2}".format(indent_str, title, page)]
-            
-            i = parse_sexp(toc_input, toc_output, indent_str+'\t', i)
-
-        elif toc_input[i] == ')':
-            return i+1
-        
-        i += 1
+    depth = 0
+    for token in _token_re.finditer(toc_input, i):
+        group = token.lastindex
+        if group == 2:
+            title, page = token.group(1, 2)
+            toc_output += ["{0}{1} {2}".format(indent_str + '\t' * depth, _format_title(title), _format_target(page))]
+            depth += 1
+        elif group == 3:
+            if depth == 0:
+                return token.end()
+            depth -= 1
+        elif group == 4:
+            raise ValueError("malformed outline: expected a title and a link")
+        elif group == 7:
+            raise ValueError("malformed outline: unexpected {0!r}".format(toc_input[token.start(7):token.start(7) + 20]))
+    raise ValueError("malformed outline: expected ')', found end of input")
+
 
 def next_quote(str, i):
     """
@@ -45,47 +196,14 @@ def next_quote(str, i):
     ``res`` is ``str[k:j]`` with escaped double-quotes replaced by
     single-quotes.
     """
-    
-    # Find the opening quote. This is simple because we can safely
-    # assume there is only whitespace in between
-    j = i
-    while str[j] != '"':
-        j += 1
-    i = j
-    j += 1
-    output = ['"']
-    
-    # Find the closing quote. This is a bit more involved because the
-    # output may include escaped double quotes, which `pdfbeads`
-    # cannot handle correctly. To circumvent this bug, we replace
-    # every escaped double quote inside the literal with a single quote.
-    while True:
-        if str[j] == '"':
-            if str[j-1] == "\\":
-                output.pop()
-                output += ["'"]
-            else:
-                output += [str[j]]
-                break
-        else:
-            output += [str[j]]
-        j += 1
-        
-    return j+1, ''.join(output)
+    match = _string_re.search(str, i)
+    if match is None:
+        raise ValueError("no string literal in {0!r}".format(str[i:i + 20]))
+    return match.end(), _format_title(match.group(1))
+
 
 if __name__ == '__main__':
-    toc_input = sys.stdin.read()
-    
     # It's possible that the file does not have a table of contents,
     # in which case we won't read anything at all
-    if len(toc_input) > 0:
-        prefix = '(bookmarks'
-
-        # Skip the '(bookmarks' prefix entirely, including its opening
-        # parenthesis, before passing the rest to `parse_sexp`.
-        if len(toc_input) <= len(prefix):
-            sys.exit(0)
-
-        toc_output = []
-        parse_sexp(toc_input[len(prefix):], toc_output, '', 0)
-        print('\n'.join(toc_output))
+    for line in translate_outline(sys.stdin):
+        print(line)
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Tracing of conversion stages and external commands
+
+A tracer records spans (named, timed sections of the conversion) and the
+external commands that were run, with their wall time, CPU time, peak
+memory and output size. The trace can be saved as plain JSON or in the
+Chrome trace-event format, which chrome://tracing and Perfetto display.
+
+Tracing is off unless a Tracer is passed to the converter, or the
+DJVU2PDF_TRACE environment variable names a file to save the trace to.
+When it is off, NULL_TRACER is used: its spans do nothing, and commands
+are run with plain subprocess.run().
+
+The trace is saved once, when tracing is over: whoever creates a Tracer
+calls save(), and the tracer set up from the environment is saved when the
+process exits.
+"""
+
+import asyncio
+import atexit
+import contextlib
+import logging
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from djvu2pdf_cancel import kill_process_group, process_group_options
+
+TRACE_ENV = "DJVU2PDF_TRACE"
+TRACE_FORMAT_ENV = "DJVU2PDF_TRACE_FORMAT"
+TRACE_FORMATS = ("chrome", "json")
+
+logger = logging.getLogger("djvu2pdf.trace")
+
+# ru_maxrss is in kilobytes, except on macOS where it is in bytes
+_MAXRSS_SCALE = 1024 if sys.platform == "darwin" else 1
+
+# The tracer set up from the environment, shared by all the converters of
+# the process, and the lock guarding it
+_environment_tracer = None
+_environment_lock = threading.Lock()
+
+
+class _UsagePopen(subprocess.Popen):
+    """Popen that keeps the resource usage of the child once it has been waited for"""
+
+    rusage = None
+
+    def wait(self, timeout=None):
+        """Wait for the child, as Popen.wait() does, reaping it with os.wait4() where there is one"""
+        # communicate() ends with a call to wait(), so the output is all read
+        # by the time the child is reaped here
+        if self.returncode is None and timeout is None and hasattr(os, "wait4"):
+            try:
+                _, status, self.rusage = os.wait4(self.pid, 0)
+            except ChildProcessError:
+                # Reaped by a poll() from another thread, which kept the status
+                pass
+            else:
+                self.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        return super().wait(timeout)
+
+
+def _run_process(popen_class, args, *, input=None, capture_output=False, timeout=None, cancel=None, **kwargs):
+    """
+    Run a command to completion, as subprocess.run() does
+
+    If a CancellationToken is given, the command runs in a process group
+    of its own, which is killed when the token is cancelled.
+
+    Returns:
+        (process, stdout, stderr) tuple
+    """
+    if capture_output:
+        kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+        kwargs.update(process_group_options())
+    with popen_class(args, **kwargs) as process:
+        on_cancel = cancel.on_cancel(lambda: kill_process_group(process)) if cancel else contextlib.nullcontext()
+        with on_cancel:
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+            except BaseException:
+                process.kill()
+                raise
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    return process, stdout, stderr
+
+
+async def _communicate(args, cwd=None) -> subprocess.CompletedProcess:
+    """Run a command from a coroutine and capture its output as text; cancelling kills its process group"""
+    process = await asyncio.create_subprocess_exec(
+        *[str(arg) for arg in args], cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        **process_group_options())
+    try:
+        stdout, stderr = await process.communicate()
+    except BaseException:
+        kill_process_group(process)
+        await process.wait()
+        raise
+    return subprocess.CompletedProcess(args, process.returncode, stdout.decode("utf-8", "replace"),
+                                       stderr.decode("utf-8", "replace"))
+
+
+def _output_size(output) -> int:
+    if output is None:
+        return 0
+    if isinstance(output, str):
+        return len(output.encode("utf-8", "surrogateescape"))
+    return len(output)
+
+
+class NullTracer:
+    """Tracer that records nothing"""
+
+    enabled = False
+
+    _null_span = contextlib.nullcontext()
+
+    def span(self, name: str, **args):
+        """
+        Context manager timing a section of the conversion
+
+        Args:
+            name: Name of the section
+            **args: Details to attach to the span
+        """
+        return self._null_span
+
+    def run(self, args, *, cancel=None, check=False, **kwargs) -> subprocess.CompletedProcess:
+        """Run a command, as subprocess.run() does; cancelling ``cancel`` kills it"""
+        if cancel is None:
+            return subprocess.run(args, check=check, **kwargs)
+        process, stdout, stderr = _run_process(subprocess.Popen, args, cancel=cancel, **kwargs)
+        result = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+        if check:
+            result.check_returncode()
+        return result
+
+    async def run_async(self, args, *, cwd=None, check=False) -> subprocess.CompletedProcess:
+        """
+        Run a command from a coroutine, capturing its output as text
+
+        Cancelling the coroutine kills the command.
+        """
+        result = await _communicate(args, cwd)
+        if check:
+            result.check_returncode()
+        return result
+
+    def save(self):
+        """Save the trace, if the tracer has somewhere to save it"""
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer(NullTracer):
+    """
+    Records spans and commands
+
+    Times are kept relative to the creation of the tracer. Spans and
+    commands may be recorded from several threads.
+    """
+
+    enabled = True
+
+    def __init__(self, output: Optional[Path] = None, output_format: str = "chrome"):
+        """
+        Create a tracer
+
+        Args:
+            output: File that save() writes the trace to
+            output_format: "chrome" for the Chrome trace-event format, or "json"
+        """
+        if output_format not in TRACE_FORMATS:
+            raise ValueError(f"Unknown trace format: {output_format}")
+        # Absolute: conversions change the working directory
+        self.output = Path(output).absolute() if output is not None else None
+        self.output_format = output_format
+        self.spans = []
+        self.commands = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls) -> NullTracer:
+        """
+        Tracer saving to the file named by DJVU2PDF_TRACE
+
+        DJVU2PDF_TRACE_FORMAT selects the format (default: chrome).
+        Returns NULL_TRACER if DJVU2PDF_TRACE is not set. The converters of
+        a process share the tracer, which saves the trace when the process
+        exits.
+        """
+        global _environment_tracer
+        output = os.environ.get(TRACE_ENV)
+        if not output:
+            return NULL_TRACER
+        output = Path(output).absolute()
+        output_format = os.environ.get(TRACE_FORMAT_ENV) or "chrome"
+        with _environment_lock:
+            tracer = _environment_tracer
+            if tracer is None or (tracer.output, tracer.output_format) != (output, output_format):
+                tracer = _environment_tracer = cls(output, output_format)
+                atexit.register(_save_at_exit, tracer)
+            return tracer
+
+    def _now(self) -> float:
+        return time.perf_counter() - self._origin
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args):
+        start = self._now()
+        try:
+            yield
+        finally:
+            span = {
+                "name": name,
+                "start": start,
+                "duration": self._now() - start,
+                "thread": threading.get_ident(),
+                "args": args,
+            }
+            with self._lock:
+                self.spans.append(span)
+
+    def run(self, args, *, cancel=None, check=False, **kwargs) -> subprocess.CompletedProcess:
+        """
+        Run a command, as NullTracer.run() does, and record it
+
+        The resource usage of the command (CPU time and peak memory) is
+        only available where os.wait4() is.
+        """
+        start = self._now()
+        process, stdout, stderr = _run_process(_UsagePopen, args, cancel=cancel, **kwargs)
+        returncode = process.returncode
+        command = {
+            "argv": [str(arg) for arg in args] if not isinstance(args, (str, bytes)) else [str(args)],
+            "start": start,
+            "wall": self._now() - start,
+            "user": None,
+            "system": None,
+            "max_rss_kib": None,
+            "stdout_bytes": _output_size(stdout),
+            "stderr_bytes": _output_size(stderr),
+            "returncode": returncode,
+            "thread": threading.get_ident(),
+        }
+        if process.rusage is not None:
+            command["user"] = process.rusage.ru_utime
+            command["system"] = process.rusage.ru_stime
+            command["max_rss_kib"] = process.rusage.ru_maxrss // _MAXRSS_SCALE
+        with self._lock:
+            self.commands.append(command)
+        result = subprocess.CompletedProcess(process.args, returncode, stdout, stderr)
+        if check:
+            result.check_returncode()
+        return result
+
+    async def run_async(self, args, *, cwd=None, check=False) -> subprocess.CompletedProcess:
+        """
+        Run a command from a coroutine, as NullTracer.run_async() does, and record it
+
+        The event loop reaps the command, so its resource usage is not known.
+        """
+        start = self._now()
+        result = await _communicate(args, cwd)
+        with self._lock:
+            self.commands.append({
+                "argv": [str(arg) for arg in args],
+                "start": start,
+                "wall": self._now() - start,
+                "user": None,
+                "system": None,
+                "max_rss_kib": None,
+                "stdout_bytes": _output_size(result.stdout),
+                "stderr_bytes": _output_size(result.stderr),
+                "returncode": result.returncode,
+                "thread": threading.get_ident(),
+            })
+        if check:
+            result.check_returncode()
+        return result
+
+    def to_json(self) -> dict:
+        """The trace as plain data: times in seconds since the tracer was created"""
+        with self._lock:
+            return {"spans": list(self.spans), "commands": list(self.commands)}
+
+    def to_chrome_trace(self) -> dict:
+        """The trace in the Chrome trace-event format (JSON object form)"""
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "djvu2pdf"}}]
+        with self._lock:
+            for span in self.spans:
+                events.append({
+                    "name": span["name"],
+                    "cat": "stage",
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["duration"] * 1e6,
+                    "pid": pid,
+                    "tid": span["thread"],
+                    "args": span["args"],
+                })
+            for command in self.commands:
+                details = {key: value for key, value in command.items() if key not in ("start", "wall", "thread")}
+                events.append({
+                    "name": Path(command["argv"][0]).name,
+                    "cat": "command",
+                    "ph": "X",
+                    "ts": command["start"] * 1e6,
+                    "dur": command["wall"] * 1e6,
+                    "pid": pid,
+                    "tid": command["thread"],
+                    "args": details,
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self):
+        """
+        Write the trace to the output file, if there is one
+
+        The whole trace is written each time, so call it once tracing is over.
+        """
+        if self.output is None:
+            return
+        data = self.to_chrome_trace() if self.output_format == "chrome" else self.to_json()
+        self.output.write_text(json.dumps(data, indent=1), encoding="utf-8")
+
+
+def _save_at_exit(tracer: Tracer):
+    """Save the trace of a tracer set up from the environment, if it recorded anything"""
+    with tracer._lock:
+        if not tracer.spans and not tracer.commands:
+            return
+    try:
+        tracer.save()
+    except OSError as e:
+        logger.warning("Cannot save the trace to %s: %s", tracer.output, e)
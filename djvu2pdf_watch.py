@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Watch-folder daemon: converts DjVu files as they land in a directory
+
+New files are noticed with inotify on Linux, or by scanning the directory
+every few seconds elsewhere. A file is only converted once its size and
+modification time have stayed the same for a while (--settle), so that
+files still being copied or scanned are left alone.
+
+Conversions run in a pool of worker threads. The PDF is written to the
+output directory under a temporary name and renamed when complete. It is
+named after the DjVu file; if that PDF already exists, or another file of
+the same stem (a.djvu and a.djv) is being converted, it gets a numbered
+name such as a-2.pdf instead. The DjVu file is then moved to the "done"
+directory; if the conversion fails, it is moved to the quarantine
+directory instead, next to a .error.txt file saying why.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import shutil
+import signal
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from djvu2pdf_converter import DjVu2PDFConverter
+
+logger = logging.getLogger("djvu2pdf.watch")
+
+DJVU_SUFFIXES = (".djvu", ".djv")
+
+
+def is_candidate(name: str) -> bool:
+    """Whether a file name looks like a finished DjVu file rather than a temporary one"""
+    return not name.startswith(".") and name.lower().endswith(DJVU_SUFFIXES)
+
+
+def _signature(path: Path) -> Optional[Tuple[int, int]]:
+    """Size and modification time of a file, or None if it is gone"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class PollingWatcher:
+    """Notices changes by scanning the directory at a fixed interval"""
+
+    def __init__(self, directory: Path, interval: float = 2.0):
+        self.directory = Path(directory)
+        self.interval = interval
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._next_scan = 0.0
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Wait for changes
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            Names of the files that appeared or changed
+        """
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_scan = time.monotonic() + self.interval
+        seen = {}
+        changed = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                seen[entry.name] = signature = (stat.st_size, stat.st_mtime_ns)
+                if self._seen.get(entry.name) != signature:
+                    changed.add(entry.name)
+        self._seen = seen
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Notices changes through Linux inotify, using libc through ctypes"""
+
+    _IN_MODIFY = 0x00000002
+    _IN_CLOSE_WRITE = 0x00000008
+    _IN_MOVED_TO = 0x00000080
+    _IN_CREATE = 0x00000100
+    _IN_Q_OVERFLOW = 0x00004000
+    _event = struct.Struct("iIII")
+
+    def __init__(self, directory: Path):
+        """
+        Start watching a directory
+
+        Raises:
+            OSError: inotify is not available
+        """
+        self.directory = Path(directory)
+        libc_name = ctypes.util.find_library("c")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self._IN_MODIFY | self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_CREATE
+        if libc.inotify_add_watch(self._fd, os.fsencode(self.directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"Cannot watch {self.directory}")
+
+    def wait(self, timeout: float) -> Optional[Set[str]]:
+        """
+        Wait for changes
+
+        Args:
+            timeout: Maximum number of seconds to wait
+
+        Returns:
+            Names of the files that changed, or None if events were lost
+            and the whole directory should be looked at again
+        """
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = self._event.unpack_from(data, offset)
+                offset += self._event.size
+                if mask & self._IN_Q_OVERFLOW:
+                    changed = None
+                elif changed is not None and length:
+                    name = data[offset:offset + length].rstrip(b"\0")
+                    changed.add(os.fsdecode(name))
+                offset += length
+
+    def close(self):
+        os.close(self._fd)
+
+
+def make_watcher(directory: Path, poll_interval: float = 2.0, inotify: bool = True):
+    """An InotifyWatcher if possible, a PollingWatcher otherwise"""
+    if inotify and os.name == "posix":
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError) as e:
+            logger.info("Falling back to polling: %s", e)
+    return PollingWatcher(directory, poll_interval)
+
+
+class WatchStats:
+    """Running totals and throughput of a watch-folder daemon"""
+
+    def __init__(self, window: float = 300.0, clock=time.monotonic):
+        """
+        Args:
+            window: Seconds over which the recent throughput is computed
+            clock: Time source, in seconds
+        """
+        self.window = window
+        self.clock = clock
+        self.started = clock()
+        self.converted = 0
+        self.failed = 0
+        self.pages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.busy_seconds = 0.0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    def record(self, success: bool, seconds: float, pages: int = 0, bytes_in: int = 0, bytes_out: int = 0):
+        """Count one finished conversion"""
+        with self._lock:
+            now = self.clock()
+            if success:
+                self.converted += 1
+                self.pages += pages
+                self.bytes_in += bytes_in
+                self.bytes_out += bytes_out
+                self._recent.append((now, pages))
+            else:
+                self.failed += 1
+            self.busy_seconds += seconds
+
+    def to_json(self) -> dict:
+        with self._lock:
+            now = self.clock()
+            while self._recent and self._recent[0][0] < now - self.window:
+                self._recent.popleft()
+            uptime = now - self.started
+            window = min(self.window, uptime) or 1.0
+            return {
+                "uptime": uptime,
+                "converted": self.converted,
+                "failed": self.failed,
+                "pages": self.pages,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "busy_seconds": self.busy_seconds,
+                "files_per_minute": 60.0 * self.converted / uptime if uptime else 0.0,
+                "pages_per_second": self.pages / self.busy_seconds if self.busy_seconds else 0.0,
+                "recent_files_per_minute": 60.0 * len(self._recent) / window,
+                "recent_pages_per_second": sum(pages for _, pages in self._recent) / window,
+            }
+
+    def summary(self) -> str:
+        data = self.to_json()
+        return (f"{data['converted']} converted, {data['failed']} failed, {data['pages']} pages; "
+                f"{data['recent_files_per_minute']:.1f} files/min and "
+                f"{data['recent_pages_per_second']:.1f} pages/s over the last {self.window:.0f} s")
+
+
+class FolderWatcher:
+    """Converts the DjVu files that land in a directory"""
+
+    def __init__(self, input_dir: Path, output_dir: Path, quarantine_dir: Optional[Path] = None,
+                 done_dir: Optional[Path] = None, workers: int = 2, settle: float = 2.0,
+                 poll_interval: float = 2.0, inotify: bool = True, bin_dir: Optional[Path] = None):
+        """
+        Set up the daemon; run() starts it
+
+        Args:
+            input_dir: Directory to watch
+            output_dir: Directory the PDFs are written to
+            quarantine_dir: Where files that fail to convert go (default: INPUT/failed)
+            done_dir: Where converted files go (default: INPUT/done)
+            workers: Number of conversions run at the same time
+            settle: Seconds a file must stay unchanged before it is converted
+            poll_interval: Seconds between two scans when inotify is not used
+            inotify: Use inotify where available
+            bin_dir: Directory containing the conversion tools, as for DjVu2PDFConverter
+        """
+        self.input_dir = Path(input_dir).absolute()
+        self.output_dir = Path(output_dir).absolute()
+        self.quarantine_dir = Path(quarantine_dir or self.input_dir / "failed").absolute()
+        self.done_dir = Path(done_dir or self.input_dir / "done").absolute()
+        self.workers = workers
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.inotify = inotify
+        self.bin_dir = bin_dir
+        self.stats = WatchStats()
+        # Files waiting to settle: name -> (signature, since when)
+        self._pending: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        self._in_progress: Set[str] = set()
+        # Names of the PDFs being written
+        self._outputs: Set[str] = set()
+        # Files converted but not moved to the done directory: name -> signature.
+        # They are left alone until they change
+        self._stranded: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def run(self, stop: threading.Event, stats_interval: float = 60.0, stats_file: Optional[Path] = None):
+        """
+        Watch and convert until ``stop`` is set, then wait for the running conversions
+
+        Args:
+            stop: Event that ends the loop
+            stats_interval: Seconds between two statistics reports
+            stats_file: JSON file the statistics are written to at every report
+        """
+        for directory in (self.output_dir, self.quarantine_dir, self.done_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        watcher = make_watcher(self.input_dir, self.poll_interval, self.inotify)
+        logger.info("Watching %s with %s", self.input_dir, type(watcher).__name__)
+        next_report = time.monotonic() + stats_interval
+        try:
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="djvu2pdf-watch") as pool:
+                # Files that were there before we started
+                self._notice(name for name in os.listdir(self.input_dir))
+                while not stop.is_set():
+                    timeout = min(self.settle / 2 if self._pending else self.poll_interval, 1.0)
+                    changed = watcher.wait(timeout)
+                    self._notice(os.listdir(self.input_dir) if changed is None else changed)
+                    for name in self._settled():
+                        pool.submit(self._convert, name)
+                    if time.monotonic() >= next_report:
+                        next_report = time.monotonic() + stats_interval
+                        self._report(stats_file)
+        finally:
+            watcher.close()
+            self._report(stats_file)
+
+    def _report(self, stats_file: Optional[Path]):
+        logger.info("%s", self.stats.summary())
+        if stats_file is not None:
+            temporary = stats_file.with_name(stats_file.name + ".tmp")
+            temporary.write_text(json.dumps(self.stats.to_json(), indent=2), encoding="utf-8")
+            os.replace(temporary, stats_file)
+
+    def _notice(self, names):
+        """Start or restart the settle timer of files that appeared or changed"""
+        now = time.monotonic()
+        for name in names:
+            if not is_candidate(name):
+                continue
+            signature = _signature(self.input_dir / name)
+            with self._lock:
+                if signature is None or name in self._in_progress or self._stranded.get(name) == signature:
+                    self._pending.pop(name, None)
+                    continue
+                self._stranded.pop(name, None)
+                previous = self._pending.get(name)
+                if previous is None or previous[0] != signature:
+                    self._pending[name] = signature, now
+
+    def _settled(self) -> list:
+        """Files that stayed unchanged for long enough; they are no longer pending"""
+        now = time.monotonic()
+        ready = []
+        for name, (signature, since) in list(self._pending.items()):
+            current = _signature(self.input_dir / name)
+            if current is None:
+                del self._pending[name]
+            elif current != signature:
+                self._pending[name] = current, now
+            elif now - since >= self.settle:
+                del self._pending[name]
+                with self._lock:
+                    self._in_progress.add(name)
+                ready.append(name)
+        return ready
+
+    def _claim_output(self, name: str) -> Path:
+        """A PDF path for a DjVu file that no other file has or is being converted to"""
+        stem = Path(name).stem
+        with self._lock:
+            number = 1
+            output = self.output_dir / f"{stem}.pdf"
+            while output.name in self._outputs or output.exists():
+                number += 1
+                output = self.output_dir / f"{stem}-{number}.pdf"
+            self._outputs.add(output.name)
+        if number > 1:
+            logger.warning("%s.pdf is taken; converting %s to %s", stem, name, output.name)
+        return output
+
+    def _convert(self, name: str):
+        source = self.input_dir / name
+        output = self._claim_output(name)
+        partial = self.output_dir / f".{output.name}.part"
+        pages = 0
+
+        def progress(event):
+            nonlocal pages
+            pages = event.pages_total or pages
+
+        start = time.monotonic()
+        try:
+            bytes_in = source.stat().st_size
+            DjVu2PDFConverter(bin_dir=self.bin_dir, event_callback=progress).convert(source, partial)
+            os.replace(partial, output)
+        except Exception as e:
+            logger.warning("Cannot convert %s: %s", name, e)
+            self.stats.record(False, time.monotonic() - start)
+            partial.unlink(missing_ok=True)
+            try:
+                shutil.move(str(source), str(self.quarantine_dir / name))
+                (self.quarantine_dir / (name + ".error.txt")).write_text(f"{e}\n", encoding="utf-8")
+            except OSError as move_error:
+                logger.error("Cannot quarantine %s: %s", name, move_error)
+        else:
+            logger.info("Converted %s (%d pages) to %s in %.1f s", name, pages, output.name,
+                        time.monotonic() - start)
+            self.stats.record(True, time.monotonic() - start, pages, bytes_in, output.stat().st_size)
+            self._retire(name)
+        finally:
+            with self._lock:
+                self._in_progress.discard(name)
+                self._outputs.discard(output.name)
+
+    def _retire(self, name: str):
+        """Move a converted file to the done directory"""
+        source = self.input_dir / name
+        try:
+            shutil.move(str(source), str(self.done_dir / name))
+        except OSError as e:
+            # The PDF is there: don't count a failure, and don't convert the file again
+            logger.error("Converted %s, but cannot move it to %s: %s", name, self.done_dir, e)
+            signature = _signature(source)
+            if signature is not None:
+                with self._lock:
+                    self._stranded[name] = signature
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert DjVu files as they land in a directory")
+    parser.add_argument("input_dir", type=Path, help="directory to watch")
+    parser.add_argument("output_dir", type=Path, help="directory to write the PDFs to")
+    parser.add_argument("--quarantine", type=Path, metavar="DIR", help="where failed files go (default: INPUT/failed)")
+    parser.add_argument("--done", type=Path, metavar="DIR", help="where converted files go (default: INPUT/done)")
+    parser.add_argument("--workers", type=int, default=2, help="conversions run at the same time (default: 2)")
+    parser.add_argument("--settle", type=float, default=2.0, metavar="SECONDS",
+                        help="how long a file must stay unchanged before it is converted (default: 2)")
+    parser.add_argument("--poll", type=float, default=2.0, metavar="SECONDS",
+                        help="interval between directory scans without inotify (default: 2)")
+    parser.add_argument("--no-inotify", action="store_true", help="scan the directory even where inotify is available")
+    parser.add_argument("--stats-interval", type=float, default=60.0, metavar="SECONDS",
+                        help="interval between statistics reports (default: 60)")
+    parser.add_argument("--stats-file", type=Path, help="also write the statistics to this JSON file")
+    parser.add_argument("--bin-dir", type=Path, help="directory containing djvused, ddjvu, tiffsplit and pdfbeads")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be positive")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    FolderWatcher(
+        args.input_dir, args.output_dir, args.quarantine, args.done, args.workers, args.settle,
+        args.poll, not args.no_inotify, args.bin_dir,
+    ).run(stop, args.stats_interval, args.stats_file)
+
+
+if __name__ == "__main__":
+    main()
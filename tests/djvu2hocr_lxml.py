@@ -0,0 +1,219 @@
+"""
+The lxml tree builder djvu2hocr used before its streaming hOCR writer
+
+Kept as the reference that djvu2hocr.write_page() must match byte for byte,
+together with the s-expression-backed Zone that preceded ZoneTable.
+"""
+
+from pathlib import Path
+import sys
+
+# djvu2hocr lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+from djvu import sexpr  # noqa: E402
+
+from lib import hocr, text_zones, unicode_support  # noqa: E402
+from lib.cli.djvu2hocr import _xml_string_re  # noqa: E402
+from lib.hocr import etree  # noqa: E402
+
+const = text_zones.const
+
+
+class CharacterLevelDetails(Exception):
+    pass
+
+
+class SexprZone(object):
+
+    '''
+    Zone of a page, read from its s-expression on every access.
+    '''
+
+    def __init__(self, sexpr, page_height):
+        self._sexpr = sexpr
+        self._page_height = page_height
+
+    @property
+    def type(self):
+        return const.get_text_zone_type(self._sexpr[0].value)
+
+    @property
+    def bbox(self):
+        return text_zones.BBox(
+            self._sexpr[1].value,
+            self._page_height - self._sexpr[4].value,
+            self._sexpr[3].value,
+            self._page_height - self._sexpr[2].value,
+        )
+
+    @property
+    def text(self):
+        value = self._sexpr[5].value
+        if isinstance(value, bytes):
+            value = value.decode('UTF-8', 'replace')
+        return value
+
+    @property
+    def children(self):
+        for child in self._sexpr[5:]:
+            if isinstance(child, sexpr.ListExpression):
+                yield SexprZone(child, self._page_height)
+            else:
+                yield self.text
+                return
+
+    @property
+    def n_children(self):
+        return len(self._sexpr) - 5
+
+
+def set_text(element, text):
+    last = None
+    for match in _xml_string_re.finditer(text):
+        if match.group(1):
+            if last is None:
+                element.text = match.group(1)
+            else:
+                last.tail = match.group(1)
+        if match.group(2):
+            last = etree.Element('span')
+            last.set('class', 'djvu_char')
+            last.set('title', '#x{0:02x}'.format(ord(match.group(2))))
+            last.text = ' '
+            element.append(last)
+
+
+def break_chars(char_zone_list, options):
+    bbox_list = []
+    text = []
+    for char_zone in char_zone_list:
+        x0, y0, x1, y1 = char_zone.bbox
+        char_text = char_zone.text
+        if not char_text:
+            continue
+        for i, char in enumerate(char_text):
+            subbox = text_zones.BBox(
+                int(x0 + (x1 - x0) * 1.0 * i / len(char_text) + 0.5),
+                y0,
+                int(x0 + (x1 - x0) * 1.0 * (i + 1) / len(char_text) + 0.5),
+                y1,
+            )
+            bbox_list += [subbox]
+        text += [char_text]
+    text = ''.join(text)
+    break_iterator = unicode_support.word_break_iterator(text, options.locale)
+    element = None
+    i = 0
+    for j in break_iterator:
+        subtext = text[i:j]
+        if subtext.isspace():
+            if element is not None:
+                element.tail = ' '
+            i = j
+            continue
+        bbox = text_zones.BBox()
+        for k in range(i, j):
+            bbox.update(bbox_list[k])
+        element = etree.Element('span')
+        element.set('class', options.hocr_class('ocrx_word'))
+        element.set('title', 'bbox {bbox}; bboxes {bboxes}'.format(
+            bbox=' '.join(map(str, bbox)),
+            bboxes=', '.join(' '.join(map(str, bbox)) for bbox in bbox_list[i:j])
+        ))
+        set_text(element, subtext)
+        yield element
+        i = j
+
+
+def break_plain_text(text, bbox, options):
+    x0, y0, x1, y1 = bbox
+    break_iterator = unicode_support.word_break_iterator(text, options.locale)
+    i = 0
+    element = None
+    for j in break_iterator:
+        subtext = text[i:j]
+        if subtext.isspace():
+            if element is not None:
+                element.tail = ' '
+            i = j
+            continue
+        subbox = text_zones.BBox(
+            int(x0 + (x1 - x0) * 1.0 * i / len(text) + 0.5),
+            y0,
+            int(x0 + (x1 - x0) * 1.0 * j / len(text) + 0.5),
+            y1,
+        )
+        element = etree.Element('span')
+        element.set('class', options.hocr_class('ocrx_word'))
+        element.set('title', 'bbox ' + ' '.join(map(str, subbox)))
+        set_text(element, subtext)
+        yield element
+        i = j
+
+
+def process_zone(parent, zone, last, options):
+    zone_type = zone.type
+    if zone_type <= const.TEXT_ZONE_LINE and parent is not None:
+        parent.tail = '\n'
+    try:
+        hocr_tag, hocr_class = hocr.djvu_zone_to_hocr(zone_type)
+    except LookupError as ex:
+        if ex.args[0] == const.TEXT_ZONE_CHARACTER:
+            raise CharacterLevelDetails
+        raise
+    self = etree.Element(hocr_tag)
+    self.set('class', options.hocr_class(hocr_class))
+    if zone_type == const.TEXT_ZONE_PAGE:
+        bbox = options.page_bbox
+    else:
+        bbox = zone.bbox
+    self.set('title', 'bbox ' + ' '.join(map(str, bbox)))
+    n_children = zone.n_children
+    character_level_details = False
+    for n, child_zone in enumerate(zone.children):
+        last_child = n == n_children - 1
+        if not isinstance(child_zone, str):
+            try:
+                process_zone(self, child_zone, last=last_child, options=options)
+            except CharacterLevelDetails:
+                # Do word segmentation by hand.
+                character_level_details = True
+                break
+    if character_level_details:
+        # Do word segmentation by hand.
+        child = None
+        for child in break_chars(zone.children, options):
+            parent.append(child)
+        if child is not None and zone_type == const.TEXT_ZONE_WORD and not last:
+            child.tail = ' '
+        self = None
+    elif isinstance(child_zone, str):
+        text = child_zone
+        if zone_type >= const.TEXT_ZONE_WORD and options.icu is not None and parent is not None:
+            # Do word segmentation by hand.
+            child = None
+            for child in break_plain_text(text, bbox, options):
+                parent.append(child)
+            if child is not None and zone_type == const.TEXT_ZONE_WORD and not last:
+                child.tail = ' '
+            self = None
+        else:
+            # Word segmentation as provided by DjVu.
+            # There's no point in doing word segmentation if only line coordinates are provided.
+            set_text(self, text)
+            if zone_type == const.TEXT_ZONE_WORD and not last:
+                self.tail = ' '
+    if parent is not None and self is not None:
+        parent.append(self)
+    return self
+
+
+def process_page(page_text, options, file=None):
+    if file is None:
+        file = sys.stdout
+    result = process_zone(None, page_text, last=True, options=options)
+    tree = etree.ElementTree(result)
+    file.write(etree.tostring(tree, encoding='utf8', method='xml').decode('utf-8'))
+
@@ -0,0 +1,165 @@
+from pathlib import Path
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the async module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_async import AsyncDjVu2PDFConverter
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
+from djvu2pdf_converter import ConversionOutputs, DjVu2PDFConverter
+from djvu2pdf_trace import Tracer
+
+FAKE_TOOLS = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+
+
+def make_document(path, pages=5):
+    path.write_text(json.dumps({'pages': pages, 'lines': 2, 'words': 3, 'bookmarks': 2}), encoding='utf-8')
+    return path
+
+
+def test_matches_synchronous_conversion(tmp_path):
+    document = make_document(tmp_path / 'book.djvu')
+    DjVu2PDFConverter(FAKE_TOOLS).convert(document, tmp_path / 'expected.pdf',
+                                          ConversionOutputs(text=tmp_path / 'expected.txt'))
+
+    events = []
+
+    async def on_event(event):
+        await asyncio.sleep(0)
+        events.append(event)
+
+    converter = AsyncDjVu2PDFConverter(FAKE_TOOLS, event_callback=on_event)
+    asyncio.run(converter.convert(document, tmp_path / 'output.pdf', ConversionOutputs(text=tmp_path / 'output.txt')))
+
+    assert (tmp_path / 'output.pdf').read_bytes() == (tmp_path / 'expected.pdf').read_bytes()
+    assert (tmp_path / 'output.txt').read_text(encoding='utf-8') == (tmp_path / 'expected.txt').read_text(encoding='utf-8')
+    assert events[-1].stage == 'done'
+    assert [event.percent for event in events] == sorted(event.percent for event in events)
+
+
+def test_streams(tmp_path):
+    document = make_document(tmp_path / 'book.djvu')
+    DjVu2PDFConverter(FAKE_TOOLS).convert(document, tmp_path / 'expected.pdf')
+    output = io.BytesIO()
+
+    asyncio.run(AsyncDjVu2PDFConverter(FAKE_TOOLS).convert(document.read_bytes(), output))
+
+    assert output.getvalue() == (tmp_path / 'expected.pdf').read_bytes()
+
+
+def test_stage_limits(tmp_path, monkeypatch):
+    monkeypatch.setenv('DJVU2PDF_FAKE_LATENCY', '0.05')
+    tracer = Tracer()
+    converter = AsyncDjVu2PDFConverter(FAKE_TOOLS, tracer=tracer, stage_limits={'pdf': 1, 'extract': None})
+    documents = [make_document(tmp_path / f'book{n}.djvu', pages=2) for n in range(4)]
+
+    async def convert_all():
+        await asyncio.gather(*(converter.convert(path, path.with_suffix('.pdf')) for path in documents))
+
+    asyncio.run(convert_all())
+
+    assert all(path.with_suffix('.pdf').read_bytes().startswith(b'%PDF') for path in documents)
+    pdfbeads = sorted((command['start'], command['start'] + command['wall'])
+                      for command in tracer.commands if Path(command['argv'][0]).name == 'pdfbeads')
+    assert len(pdfbeads) == 4
+    assert all(end <= next_start for (_, end), (next_start, _) in zip(pdfbeads, pdfbeads[1:]))
+    ddjvu = sorted((command['start'], command['start'] + command['wall'])
+                   for command in tracer.commands if Path(command['argv'][0]).name == 'ddjvu')
+    # Unlimited: all four ran at the same time
+    assert ddjvu[-1][0] < min(end for _, end in ddjvu)
+
+
+def test_unknown_stage_limit():
+    with pytest.raises(ValueError):
+        AsyncDjVu2PDFConverter(stage_limits={'ocr': 1})
+
+
+def test_cancellation_kills_the_command(tmp_path, monkeypatch):
+    # ddjvu would take 20 s
+    monkeypatch.setenv('DJVU2PDF_FAKE_PAGE_LATENCY', '1')
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(work_dir))
+    document = make_document(tmp_path / 'book.djvu', pages=20)
+    converter = AsyncDjVu2PDFConverter(FAKE_TOOLS)
+
+    async def convert_and_cancel():
+        task = asyncio.ensure_future(converter.convert(document, tmp_path / 'output.pdf'))
+        await asyncio.sleep(0.5)
+        start = time.monotonic()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.monotonic() - start
+
+    assert asyncio.run(convert_and_cancel()) < 1
+    assert not list(work_dir.iterdir())
+    assert not (tmp_path / 'output.pdf').exists()
+
+
+def test_cancellation_token(tmp_path, monkeypatch):
+    monkeypatch.setenv('DJVU2PDF_FAKE_PAGE_LATENCY', '1')
+    document = make_document(tmp_path / 'book.djvu', pages=20)
+    token = CancellationToken()
+
+    async def convert():
+        # Cancelled from another thread, as a GUI or a request handler would
+        threading.Timer(0.5, token.cancel).start()
+        start = time.monotonic()
+        with pytest.raises(ConversionCancelled):
+            await AsyncDjVu2PDFConverter(FAKE_TOOLS).convert(document, tmp_path / 'output.pdf', cancel=token)
+        return time.monotonic() - start
+
+    assert asyncio.run(convert()) < 1.5
+    assert not (tmp_path / 'output.pdf').exists()
+
+
+def test_cancellation_token_between_pages(tmp_path):
+    document = make_document(tmp_path / 'book.djvu', pages=200)
+    token = CancellationToken()
+    tracer = Tracer()
+
+    def on_event(event):
+        if event.stage == 'text' and event.page:
+            token.cancel()
+
+    converter = AsyncDjVu2PDFConverter(FAKE_TOOLS, tracer=tracer, event_callback=on_event, progress_interval=0)
+    with pytest.raises(ConversionCancelled):
+        asyncio.run(converter.convert(document, tmp_path / 'output.pdf', cancel=token))
+
+    pages = [span for span in tracer.spans if span['name'] == 'page']
+    assert 0 < len(pages) < 200
+    assert not any(Path(command['argv'][0]).name == 'pdfbeads' for command in tracer.commands)
+
+
+def test_streams_are_copied_in_a_thread(tmp_path):
+    document = make_document(tmp_path / 'book.djvu')
+    loop_thread = threading.get_ident()
+    threads = []
+
+    class Stream(io.BytesIO):
+        def read(self, *args):
+            threads.append(threading.get_ident())
+            return super().read(*args)
+
+        def write(self, data):
+            threads.append(threading.get_ident())
+            return super().write(data)
+
+    output = Stream()
+    asyncio.run(AsyncDjVu2PDFConverter(FAKE_TOOLS).convert(Stream(document.read_bytes()), output))
+
+    assert output.getvalue().startswith(b'%PDF')
+    assert threads and loop_thread not in threads
@@ -0,0 +1,125 @@
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the converter module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
+from djvu2pdf_converter import DjVu2PDFConverter
+from djvu2pdf_trace import NULL_TRACER
+
+FAKE_TOOLS = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+
+needs_proc = pytest.mark.skipif(not os.path.isdir('/proc/self'), reason='looks for processes in /proc')
+
+
+def running_commands(text):
+    """Command lines of the live processes that contain ``text``"""
+    commands = []
+    for entry in os.listdir('/proc'):
+        try:
+            with open(f'/proc/{entry}/cmdline', 'rb') as file:
+                cmdline = file.read().replace(b'\0', b' ').decode('utf-8', 'replace')
+            with open(f'/proc/{entry}/stat', 'rb') as file:
+                zombie = file.read().rsplit(b')', 1)[1].split()[0] == b'Z'
+        except (OSError, IndexError):
+            continue
+        if text in cmdline and not zombie:
+            commands.append(cmdline)
+    return commands
+
+
+def test_token_callbacks():
+    token = CancellationToken()
+    calls = []
+    with token.on_cancel(lambda: calls.append('inside')):
+        pass
+    with token.on_cancel(lambda: calls.append('registered')):
+        token.cancel()
+        token.cancel()
+    with token.on_cancel(lambda: calls.append('late')):
+        pass
+
+    assert calls == ['registered', 'late']
+    assert token.cancelled and token.wait(0)
+    with pytest.raises(ConversionCancelled):
+        token.raise_if_cancelled()
+
+
+def test_cancelled_token_runs_nothing(tmp_path):
+    token = CancellationToken()
+    token.cancel()
+    with pytest.raises(ConversionCancelled):
+        NULL_TRACER.run([sys.executable, '-c', 'pass'], cancel=token)
+    with pytest.raises(ConversionCancelled):
+        DjVu2PDFConverter().convert(tmp_path / 'missing.djvu', tmp_path / 'out.pdf', cancel=token)
+
+
+@needs_proc
+@pytest.mark.skipif(os.name != 'posix', reason='uses sh')
+def test_cancel_kills_the_process_group():
+    token = CancellationToken()
+    # Built here so that it appears on no other command line, such as the one running pytest
+    marker = f'sleep {29 + 0.25}'
+    errors = []
+
+    def run():
+        try:
+            NULL_TRACER.run(['sh', '-c', f'{marker} & {marker}; wait'], cancel=token, capture_output=True)
+        except ConversionCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while len(running_commands(marker)) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    token.cancel()
+    thread.join(5)
+
+    assert errors
+    # The background sleep was killed with the shell
+    assert not running_commands(marker)
+
+
+@needs_proc
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_cancel_conversion(tmp_path, monkeypatch):
+    # ddjvu would take 20 s
+    monkeypatch.setenv('DJVU2PDF_FAKE_PAGE_LATENCY', '1')
+    work_dir = tmp_path / 'work'
+    work_dir.mkdir()
+    monkeypatch.setattr(tempfile, 'tempdir', str(work_dir))
+    input_file = tmp_path / 'book.djvu'
+    input_file.write_text(json.dumps({'pages': 20}), encoding='utf-8')
+    token = CancellationToken()
+    outcome = []
+
+    def convert():
+        try:
+            DjVu2PDFConverter(bin_dir=FAKE_TOOLS).convert(input_file, tmp_path / 'book.pdf', cancel=token)
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=convert)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not running_commands(f'ddjvu -format=tiff {work_dir}') and time.monotonic() < deadline:
+        time.sleep(0.01)
+    start = time.monotonic()
+    token.cancel()
+    thread.join(5)
+
+    assert time.monotonic() - start < 1
+    assert len(outcome) == 1 and isinstance(outcome[0], ConversionCancelled)
+    assert not running_commands(str(work_dir))
+    assert not list(work_dir.iterdir())
+    assert not (tmp_path / 'book.pdf').exists()
@@ -0,0 +1,110 @@
+from pathlib import Path
+import io
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Ensure repository root is on the path so the converter module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_converter import ConversionOutputs, DjVu2PDFConverter, _ExtraOutputWriter
+
+
+class FakeSession:
+
+    def page_size(self, page):
+        return 100, 200
+
+    def page_text(self, page):
+        if page == 2:
+            return ''
+        return '(page 0 0 100 200 (line 10 10 90 30 (word 10 10 40 30 "Hello") (word 50 10 90 30 "world")))'
+
+
+def test_page_text_parses_words():
+    converter = DjVu2PDFConverter()
+
+    assert converter._page_text(FakeSession().page_size(1), FakeSession().page_text(1)) == (
+        100, 200, [('Hello', 10, 10, 40, 30), ('world', 50, 10, 90, 30)]
+    )
+
+
+def test_page_text_without_text():
+    converter = DjVu2PDFConverter()
+
+    assert converter._page_text(FakeSession().page_size(2), FakeSession().page_text(2)) == (100, 200, [])
+
+
+def test_extra_outputs_share_parsed_pages(tmp_path):
+    converter = DjVu2PDFConverter()
+    outputs = ConversionOutputs(hocr=tmp_path / 'book.html', text=tmp_path / 'book.txt')
+    pages = [(100, 200, [('Hello', 10, 10, 40, 30)]), (100, 200, [])]
+
+    with _ExtraOutputWriter(converter, outputs) as writer:
+        for i, page_text in enumerate(pages, start=1):
+            writer.add_page(str(i), tmp_path / f'{i}.tiff', page_text, '')
+
+    hocr = (tmp_path / 'book.html').read_text(encoding='utf-8')
+    assert hocr.count('class="ocr_page"') == 2
+    assert '>Hello</span>' in hocr
+    assert hocr.rstrip().endswith('</html>')
+    assert (tmp_path / 'book.txt').read_text(encoding='utf-8') == 'Hello\n\f\n'
+
+
+def test_extra_outputs_per_page_hocr(tmp_path):
+    converter = DjVu2PDFConverter()
+    outputs = ConversionOutputs(hocr=tmp_path / 'hocr', hocr_per_page=True)
+
+    with _ExtraOutputWriter(converter, outputs) as writer:
+        writer.add_page('01', tmp_path / '01.tiff', (100, 200, []), '<html/>')
+
+    assert (tmp_path / 'hocr' / 'page_01.html').read_text(encoding='utf-8') == '<html/>'
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_convert_with_fake_tools(tmp_path):
+    fake_tools = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+    input_file = tmp_path / 'book.djvu'
+    input_file.write_text(json.dumps({'pages': 3, 'lines': 2, 'words': 2, 'bookmarks': 2}), encoding='utf-8')
+    converter = DjVu2PDFConverter(bin_dir=fake_tools)
+
+    converter.convert(input_file, tmp_path / 'book.pdf', ConversionOutputs(text=tmp_path / 'book.txt'))
+
+    pdf = (tmp_path / 'book.pdf').read_bytes()
+    assert pdf.startswith(b'%PDF') and b'"Chapter 1" "1"' in pdf
+    assert (tmp_path / 'book.txt').read_text(encoding='utf-8').count('\f') == 2
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_convert_streams(tmp_path):
+    fake_tools = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+    document = json.dumps({'pages': 3, 'lines': 2, 'words': 2, 'bookmarks': 2}).encode('utf-8')
+    (tmp_path / 'book.djvu').write_bytes(document)
+    converter = DjVu2PDFConverter(bin_dir=fake_tools)
+    converter.convert(tmp_path / 'book.djvu', tmp_path / 'book.pdf')
+    expected = (tmp_path / 'book.pdf').read_bytes()
+
+    output = io.BytesIO()
+    converter.convert(io.BytesIO(document), output)
+    assert output.getvalue() == expected
+
+    output = io.BytesIO()
+    converter.convert(document, output)
+    assert output.getvalue() == expected
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_command_line_standard_streams(tmp_path):
+    fake_tools = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+    document = json.dumps({'pages': 3, 'lines': 2, 'words': 2, 'bookmarks': 2}).encode('utf-8')
+    env = dict(os.environ, PATH=f"{fake_tools}{os.pathsep}{os.environ['PATH']}")
+
+    result = subprocess.run([sys.executable, str(PROJECT_ROOT / 'djvu2pdf_converter.py'), '-', '-'],
+                            input=document, capture_output=True, env=env, check=True)
+
+    assert result.stdout.startswith(b'%PDF') and result.stdout.rstrip().endswith(b'%%EOF')
+    assert b'Successfully converted' in result.stderr
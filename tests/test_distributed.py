@@ -0,0 +1,200 @@
+from pathlib import Path
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the distributed module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_cancel import CancellationToken, ConversionCancelled
+from djvu2pdf_converter import ConversionOutputs, DjVu2PDFConverter
+from djvu2pdf_distributed import (DistributedConverter, ProtocolError, parse_address, receive_message,
+                                  run_worker, send_message)
+from djvu2pdf_progress import STAGE_COSTS
+
+FAKE_TOOLS = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+
+posix_only = pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / 'book.djvu'
+    path.write_text(json.dumps({'pages': 7, 'lines': 2, 'words': 3, 'bookmarks': 2}), encoding='utf-8')
+    return path
+
+
+def test_parse_address():
+    assert parse_address('example.org:8000') == ('example.org', 8000)
+    assert parse_address('[::1]:8000') == ('::1', 8000)
+    with pytest.raises(ValueError):
+        parse_address('example.org')
+
+
+def test_messages_carry_files(tmp_path):
+    source = tmp_path / 'page.tiff'
+    source.write_bytes(b'\0' * 100000)
+    received = tmp_path / 'received'
+    received.mkdir()
+
+    left, right = socket.socketpair()
+    with left, right:
+        send_message(left, {'type': 'result', 'id': 1}, [source])
+        rfile = right.makefile('rb')
+        message = receive_message(rfile, received)
+        assert message == {'type': 'result', 'id': 1, 'files': [['page.tiff', 100000]]}
+        assert (received / 'page.tiff').read_bytes() == source.read_bytes()
+
+        # The receiver refuses files without a directory, and names with one
+        send_message(left, {'type': 'done'}, [source])
+        with pytest.raises(ProtocolError):
+            receive_message(rfile)
+
+        header = json.dumps({'type': 'result', 'files': [['../escape', 1]]}).encode('utf-8')
+        left.sendall(len(header).to_bytes(4, 'big') + header + b'x')
+        with pytest.raises(ProtocolError):
+            receive_message(rfile, received)
+        assert not (tmp_path / 'escape').exists()
+
+        left.close()
+        with pytest.raises(ProtocolError):
+            receive_message(rfile)
+
+
+@posix_only
+def test_local_workers_match_local_conversion(tmp_path, document):
+    expected_pdf = tmp_path / 'expected.pdf'
+    expected_text = tmp_path / 'expected.txt'
+    DjVu2PDFConverter(FAKE_TOOLS).convert(document, expected_pdf, ConversionOutputs(text=expected_text))
+
+    output_pdf = tmp_path / 'output.pdf'
+    output_text = tmp_path / 'output.txt'
+    events = []
+    with DistributedConverter(FAKE_TOOLS, local_workers=3, shard_size=2, event_callback=events.append) as converter:
+        converter.convert(document, output_pdf, ConversionOutputs(text=output_text))
+
+    assert output_pdf.read_bytes() == expected_pdf.read_bytes()
+    assert output_text.read_text(encoding='utf-8') == expected_text.read_text(encoding='utf-8')
+    pages = [event.page for event in events if event.page is not None]
+    assert pages == sorted(pages) and pages[-1] == 7
+    # The workers split the pages and extract their text: the local
+    # conversion doesn't expect to spend time on that
+    assert {event.stage for event in events}.isdisjoint({'split', 'rename', 'text'})
+    local_stages = ['extract', 'toc', 'pdf', 'finalize']
+    assert events[0].stage == 'extract'
+    assert events[0].eta == pytest.approx(7 * sum(STAGE_COSTS[stage] for stage in local_stages))
+
+
+@posix_only
+@pytest.mark.parametrize('behaviour', ['hang-up', 'silent'])
+def test_shards_of_lost_workers_are_reassigned(tmp_path, document, behaviour, caplog):
+    caplog.set_level(logging.WARNING, logger='djvu2pdf.distributed')
+    output_pdf = tmp_path / 'output.pdf'
+    has_shard = threading.Event()
+
+    def unreliable_worker(address):
+        with socket.create_connection(address) as connection:
+            rfile = connection.makefile('rb')
+            send_message(connection, {'type': 'hello', 'worker': behaviour})
+            received = tmp_path / 'unreliable'
+            received.mkdir()
+            assert receive_message(rfile, received)['type'] == 'document'
+            assert receive_message(rfile)['type'] == 'shard'
+            has_shard.set()
+            if behaviour == 'silent':
+                # Until the coordinator gives up on it
+                rfile.read()
+
+    with DistributedConverter(FAKE_TOOLS, shard_size=3, heartbeat=0.2) as converter:
+        threads = [threading.Thread(target=converter.convert, args=(document, output_pdf)),
+                   threading.Thread(target=unreliable_worker, args=(converter.address,))]
+        for thread in threads:
+            thread.start()
+        assert has_shard.wait(30)
+        assert run_worker(converter.address, FAKE_TOOLS) == 3
+        for thread in threads:
+            thread.join(30)
+
+    assert output_pdf.read_bytes().startswith(b'%PDF')
+    assert any('Reassigning pages' in record.getMessage() for record in caplog.records)
+
+
+@posix_only
+def test_failing_shard_fails_the_conversion(tmp_path, document):
+    def failing_worker(address):
+        with socket.create_connection(address) as connection:
+            rfile = connection.makefile('rb')
+            send_message(connection, {'type': 'hello', 'worker': 'failing'})
+            received = tmp_path / 'failing'
+            received.mkdir()
+            receive_message(rfile, received)
+            while True:
+                try:
+                    message = receive_message(rfile)
+                except ProtocolError:
+                    # The coordinator hangs up once the conversion has failed
+                    return
+                if message['type'] != 'shard':
+                    return
+                send_message(connection, {'type': 'error', 'id': message['id'], 'message': 'out of disk space'})
+
+    with DistributedConverter(FAKE_TOOLS, shard_size=3, max_attempts=2) as converter:
+        thread = threading.Thread(target=failing_worker, args=(converter.address,))
+        thread.start()
+        with pytest.raises(RuntimeError, match='out of disk space'):
+            converter.convert(document, tmp_path / 'output.pdf')
+        thread.join(30)
+    assert not (tmp_path / 'output.pdf').exists()
+
+
+@posix_only
+def test_worker_reports_unexpected_errors(tmp_path, document, monkeypatch, caplog):
+    caplog.set_level(logging.WARNING, logger='djvu2pdf.distributed')
+
+    def broken_render(*args):
+        raise ValueError('bad page size')
+
+    monkeypatch.setattr(DjVu2PDFConverter, '_render_page_range', broken_render)
+
+    def worker(address):
+        try:
+            run_worker(address, FAKE_TOOLS)
+        except ProtocolError:
+            # The coordinator hangs up once the conversion has failed
+            pass
+
+    with DistributedConverter(FAKE_TOOLS, shard_size=3, max_attempts=1) as converter:
+        thread = threading.Thread(target=worker, args=(converter.address,))
+        thread.start()
+        with pytest.raises(RuntimeError, match='ValueError: bad page size'):
+            converter.convert(document, tmp_path / 'output.pdf')
+        thread.join(30)
+    assert not thread.is_alive()
+    assert any(record.exc_info for record in caplog.records if 'failed' in record.getMessage())
+
+
+@posix_only
+def test_cancel(tmp_path, document, monkeypatch):
+    # Each shard takes the workers' ddjvu 3 s
+    monkeypatch.setenv('DJVU2PDF_FAKE_PAGE_LATENCY', '1')
+    token = CancellationToken()
+    cancelled_at = []
+
+    def cancel():
+        cancelled_at.append(time.monotonic())
+        token.cancel()
+
+    with DistributedConverter(FAKE_TOOLS, local_workers=2, shard_size=3) as converter:
+        timer = threading.Timer(1.5, cancel)
+        timer.start()
+        with pytest.raises(ConversionCancelled):
+            converter.convert(document, tmp_path / 'output.pdf', cancel=token)
+        assert time.monotonic() - cancelled_at[0] < 1
+    assert not (tmp_path / 'output.pdf').exists()
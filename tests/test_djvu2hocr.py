@@ -0,0 +1,130 @@
+from pathlib import Path
+import io
+import sys
+
+import pytest
+
+# djvu2hocr lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+sexpr = pytest.importorskip('djvu.sexpr')
+
+from lib import text_zones  # noqa: E402
+from lib.cli import djvu2hocr  # noqa: E402
+
+from djvu2hocr_lxml import SexprZone, process_page  # noqa: E402
+
+const = text_zones.const
+
+PAGE_WIDTH = 600
+PAGE_HEIGHT = 800
+
+WORD_PAGE = '''
+(page 0 0 600 800
+ (column 0 0 600 800
+  (region 0 0 600 800
+   (para 10 500 590 790
+    (line 10 700 590 790 (word 10 700 200 790 "Fish") (word 220 700 400 790 "&") (word 420 700 590 790 "<chips>"))
+    (line 10 500 590 600 (word 10 500 300 600 "\\"quoted\\"") (word 320 500 590 600 "bell\\007and tab\\t")))
+   (para 10 10 590 400
+    (line 10 10 590 400 "a whole line of text, without words")))))
+'''
+
+CHARACTER_PAGE = '''
+(page 0 0 600 800
+ (line 10 700 590 790
+  (word 10 700 200 790 (char 10 700 100 790 "F") (char 100 700 200 790 "i"))
+  (word 220 700 590 790 (char 220 700 300 790 "s") (char 300 700 400 790 " ") (char 400 700 590 790 "sh")))
+ (line 10 500 590 600
+  (word 10 500 590 600 (char 10 500 300 600 "\\302\\275") (char 300 500 590 600 "x\\001"))))
+'''
+
+
+def rotated_page():
+    '''
+    Text layer of a landscape page whose text runs bottom to top, as
+    hocr2djvused writes it for a page rotated by 90 degrees.
+    '''
+    page = text_zones.Zone(const.TEXT_ZONE_PAGE, (0, 0, PAGE_HEIGHT, PAGE_WIDTH))
+    line = text_zones.Zone(const.TEXT_ZONE_LINE, (100, 20, 700, 80))
+    line += [
+        text_zones.Zone(const.TEXT_ZONE_WORD, (100, 20, 380, 80), ['rotated']),
+        text_zones.Zone(const.TEXT_ZONE_WORD, (400, 20, 700, 80), ['text']),
+    ]
+    page += [line]
+    page.rotate(90)
+    return page.sexpr
+
+
+def make_options(*args):
+    options = djvu2hocr.ArgumentParser().parse_args(list(args) + ['book.djvu'])
+    options.page_bbox = text_zones.BBox(0, 0, PAGE_WIDTH, PAGE_HEIGHT)
+    return options
+
+
+def render(write, zone, options):
+    output = io.StringIO()
+    write(zone, options, file=output)
+    return output.getvalue()
+
+
+PAGES = {
+    'word': lambda: sexpr.Expression.from_string(WORD_PAGE),
+    'character': lambda: sexpr.Expression.from_string(CHARACTER_PAGE),
+    'rotated': rotated_page,
+}
+
+
+@pytest.mark.parametrize('page', sorted(PAGES))
+@pytest.mark.parametrize('args', [(), ('--pdfbeads',)])
+def test_write_page_matches_lxml(page, args):
+    options = make_options(*args)
+    root = djvu2hocr.ZoneTable(PAGES[page](), PAGE_HEIGHT).root
+
+    expected = render(process_page, root, options)
+
+    assert 'ocrx_word' in expected or 'ocr_word' in expected
+    assert render(djvu2hocr.write_page, root, options) == expected
+
+
+@pytest.mark.parametrize('page', sorted(PAGES))
+def test_zone_table_matches_sexpr_zones(page):
+    page_text = PAGES[page]()
+    options = make_options()
+
+    expected = render(process_page, SexprZone(page_text, PAGE_HEIGHT), options)
+
+    table = djvu2hocr.ZoneTable(page_text, PAGE_HEIGHT)
+    assert render(process_page, table.root, options) == expected
+    assert render(djvu2hocr.write_page, table.root, options) == expected
+
+
+def test_zone_table_structure():
+    table = djvu2hocr.ZoneTable(sexpr.Expression.from_string(CHARACTER_PAGE), PAGE_HEIGHT)
+    page = table.root
+    assert page.type == const.TEXT_ZONE_PAGE
+    assert page.parent is None
+    assert page.n_children == 2
+    first_line, second_line = page.children
+    assert first_line.parent is page
+    assert first_line.bbox == (10, 10, 590, 100)
+    word = list(first_line.children)[1]
+    assert [char.text for char in word.children] == ['s', ' ', 'sh']
+    assert list(second_line.children)[0].n_children == 2
+
+
+@pytest.mark.parametrize('page', ['word', 'character'])
+def test_uax29_word_segmentation(page):
+    pytest.importorskip('icu')
+    page_text = PAGES[page]()
+    options = make_options('--word-segmentation', 'uax29')
+    root = djvu2hocr.ZoneTable(page_text, PAGE_HEIGHT).root
+
+    expected = render(process_page, SexprZone(page_text, PAGE_HEIGHT), options)
+
+    assert render(process_page, root, options) == expected
+    assert render(djvu2hocr.write_page, root, options) == expected
+    if page == 'word':
+        # The line without word zones is split into words too
+        assert '>without</span>' in expected
@@ -0,0 +1,28 @@
+from pathlib import Path
+import pickle
+import sys
+
+import pytest
+
+# errors lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+from lib import errors  # noqa: E402
+
+
+@pytest.mark.parametrize('error_class, prefix', [
+    (errors.MalformedOcrOutput, 'malformed OCR output: '),
+    (errors.MalformedHocr, 'malformed hOCR document: '),
+])
+def test_pickle_round_trip(error_class, prefix):
+    # Errors raised in hocr2djvused worker processes are pickled on their
+    # way back to the main process
+    error = error_class('no bounding box')
+
+    copy = pickle.loads(pickle.dumps(error, protocol=pickle.HIGHEST_PROTOCOL))
+
+    assert type(copy) is error_class
+    assert copy.message == 'no bounding box'
+    assert str(copy) == prefix + 'no bounding box'
+    assert isinstance(copy, errors.MalformedOcrOutput)
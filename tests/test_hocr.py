@@ -0,0 +1,255 @@
+from pathlib import Path
+import io
+import logging
+import sys
+
+import pytest
+
+# hocr lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+pytest.importorskip('djvu.sexpr')
+
+from lxml import etree  # noqa: E402
+
+from lib import errors, hocr  # noqa: E402
+
+HEAD_TEMPLATE = '''\
+<!DOCTYPE html>
+<html>
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+{meta}</head>
+<body>
+'''
+
+HEAD = HEAD_TEMPLATE.format(meta='<meta name="ocr-system" content="djvu2hocr 0.12" />\n')
+
+FOOT = '''\
+</body>
+</html>
+'''
+
+
+def make_page(n, second_line='<span class="ocr_line" title="bbox 10 100 990 160">'):
+    return (
+        '<div class="ocr_page" title="bbox 0 0 1000 1400">\n'
+        '<p class="ocr_par" title="bbox 10 10 990 200">\n'
+        '<span class="ocr_line" title="bbox 10 10 990 60">'
+        '<span class="ocrx_word" title="bbox 10 10 400 60">page{n}</span> '
+        '<span class="ocrx_word" title="bbox 500 10 990 60">first</span></span>\n'
+        '{second_line}<span class="ocrx_word" title="bbox 10 100 990 160">second</span></span>\n'
+        '</p>\n'
+        '</div>\n'
+    ).format(n=n, second_line=second_line)
+
+
+def make_document(*pages, head=HEAD):
+    return (head + ''.join(pages) + FOOT).encode('UTF-8')
+
+
+def extract(document, **kwargs):
+    return [zone.format_sexpr() for zone in hocr.extract_zones(io.BytesIO(document), **kwargs)]
+
+
+def test_fallback_on_clean_document(caplog):
+    document = make_document(make_page(1), make_page(2))
+    assert extract(document, fallback=True) == extract(document)
+    assert not caplog.records
+
+
+def test_fallback_reparses_broken_pages(caplog):
+    pytest.importorskip('html5lib')
+    expected = extract(make_document(make_page(1), make_page(2), make_page(3)))
+    # The HTML parser nests page 3 inside the unclosed table of page 2
+    broken = make_page(2, second_line='<table><span class="ocr_line" title="bbox 10 100 990 160">')
+    document = make_document(make_page(1), broken, make_page(3))
+    assert len(extract(document)) == 2
+
+    with caplog.at_level(logging.WARNING, logger='ocrodjvu.hocr'):
+        assert extract(document, fallback=True) == expected
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 1
+    assert 're-parsing page(s) 2-2 with html5lib' in messages[0]
+
+
+def test_fallback_sanitizes_utf8(caplog):
+    document = make_document(make_page(1), make_page(2))
+    position = document.index(b'page2')
+    document = document[:position] + b'\xff' + document[position:]
+
+    with caplog.at_level(logging.WARNING, logger='ocrodjvu.hocr'):
+        zones = extract(document, fallback=True)
+
+    assert zones == extract(document, fix_utf8=True)
+    assert '"\N{REPLACEMENT CHARACTER}page2"' in zones[1]
+    messages = [record.getMessage() for record in caplog.records]
+    assert messages == ['hOCR is not clean UTF-8 (byte 0xff in position {0}: invalid UTF-8); sanitizing it'.format(position)]
+
+
+# Cuneiform ≤ 0.8 names neither itself nor its zones: the body is the page,
+# paragraphs are plain <p> elements and every character is a <span>.
+CUNEIFORM_08_DOCUMENT = (
+    HEAD_TEMPLATE.format(meta='') +
+    '<p>'
+    '<span title="bbox 10 20 30 60">a</span><span title="bbox 30 20 50 60">b</span> '
+    '<span title="bbox 60 20 80 60">c</span>\n'
+    '</p>\n' +
+    FOOT
+).encode('UTF-8')
+
+TESSERACT_DOCUMENT = make_document(
+    '<div class="ocr_page" title="bbox 0 0 100 200">\n'
+    '<div class="ocr_carea" title="bbox 10 20 80 60">\n'
+    '<p class="ocr_par" title="bbox 10 20 80 60">\n'
+    '<span class="ocr_line" title="bbox 10 20 80 60">'
+    '<span class="ocrx_word" title="bbox 10 20 50 60">ab</span> '
+    '<span class="ocrx_word" title="bbox 60 20 80 60">c</span>\n'
+    '</span>\n'
+    '</p>\n'
+    '</div>\n'
+    '</div>\n'
+    # Character bounding boxes, as ocrodjvu saves them from Tesseract's
+    # "makebox" output: counted from the bottom of the page.
+    '<script type="application/x-ocrodjvu-tesseract">\n'
+    'a 10 140 30 180 0\n'
+    'b 30 140 50 180 0\n'
+    'c 60 140 80 180 0\n'
+    '</script>\n',
+    head=HEAD_TEMPLATE.format(meta='<meta name="ocr-system" content="tesseract 3.02" />\n'),
+)
+
+
+@pytest.mark.parametrize('details, expected', [
+    (hocr.TEXT_DETAILS_WORD, [
+        '(page 0 0 100 200 (para 10 140 80 180 (word 10 140 50 180 "ab") (word 60 140 80 180 "c")))',
+    ]),
+    (hocr.TEXT_DETAILS_CHARACTER, [
+        '(page 0 0 100 200 (para 10 140 80 180'
+        ' (word 10 140 50 180 (char 10 140 30 180 "a") (char 30 140 50 180 "b"))'
+        ' (word 60 140 80 180 (char 60 140 80 180 "c"))))',
+    ]),
+])
+def test_cuneiform_08_document(details, expected):
+    assert extract(CUNEIFORM_08_DOCUMENT, details=details, page_size=(100, 200)) == expected
+
+
+@pytest.mark.parametrize('details, expected', [
+    (hocr.TEXT_DETAILS_WORD, [
+        '(page 0 0 100 200 (column 10 140 80 180 (para 10 140 80 180 (line 10 140 80 180'
+        ' (word 10 140 50 180 "ab") (word 60 140 80 180 "c")))))',
+    ]),
+    (hocr.TEXT_DETAILS_CHARACTER, [
+        '(page 0 0 100 200 (column 10 140 80 180 (para 10 140 80 180 (line 10 140 80 180'
+        ' (word 10 140 50 180 (char 10 140 30 180 "a") (char 30 140 50 180 "b"))'
+        ' (word 60 140 80 180 (char 60 140 80 180 "c"))))))',
+    ]),
+])
+def test_tesseract_document(details, expected):
+    assert extract(TESSERACT_DOCUMENT, details=details) == expected
+
+
+def test_nesting_deeper_than_recursion_limit():
+    # The HTML parser gives up on such documents, so the tree is built by hand.
+    body = etree.Element('body')
+    page = etree.SubElement(body, 'div', {'class': 'ocr_page', 'title': 'bbox 0 0 100 200'})
+    element = etree.SubElement(page, 'span', {'class': 'ocr_line', 'title': 'bbox 10 20 50 60'})
+    for i in range(sys.getrecursionlimit() + 100):
+        element = etree.SubElement(element, 'span')
+    word = etree.SubElement(element, 'span', {'class': 'ocrx_word', 'title': 'bbox 10 20 50 60'})
+    word.text = 'deep'
+    zones = hocr.scan(body, hocr.ExtractSettings())
+    assert [zone.format_sexpr() for zone in zones] == [
+        '(page 0 0 100 200 (line 10 140 50 180 (word 10 140 50 180 "deep")))',
+    ]
+
+
+LINE = '<span class="ocr_line" title="bbox 10 20 50 60">{0}</span>'
+WORD = '<span class="ocrx_word" title="bbox 10 20 50 60">ab</span>'
+
+
+def in_page(contents):
+    return '<div class="ocr_page" title="bbox 0 0 100 200">{0}</div>'.format(contents)
+
+
+@pytest.mark.parametrize('ocr_system, body, message', [
+    ('djvu2hocr 0.12', '<div class="ocr_page">' + LINE.format(WORD) + '</div>',
+        "page without bounding box information"),
+    ('djvu2hocr 0.12', '<div class="ocr_page" title="bbox 5 0 100 200">' + LINE.format(WORD) + '</div>',
+        r"page's bounding box should start with \(0, 0\)"),
+    ('djvu2hocr 0.12', LINE.format(WORD),
+        "unable to determine page size"),
+    ('djvu2hocr 0.12', in_page(LINE.format(WORD + ' stray')),
+        "plain text intermixed with structural elements"),
+    ('djvu2hocr 0.12', in_page('<p class="ocr_par" title="bbox 10 20 50 60">' + WORD + LINE.format(WORD) + '</p>'),
+        "character zones intermixed with non-character zones"),
+    ('djvu2hocr 0.12', in_page(LINE.format('<span class="ocrx_word">ab</span>')),
+        "zone without bounding box information"),
+    ('djvu2hocr 0.12', in_page('<span class="ocr_line"><em>ab</em></span>'),
+        "text zone without bounding box information"),
+    ('djvu2hocr 0.12', in_page('<span class="ocr_line" title="bbox 10 20 50 60; bboxes 10 20 30 60">ab</span>'),
+        "number of bboxes doesn't match text length"),
+    ('openocr', in_page('<span class="ocr_line" title="bbox 10 20 50 60; bboxes -1 -1 -1 -1, 30 20 50 60">ab</span>'),
+        "missing bbox for non-whitespace character"),
+    ('djvu2hocr 0.12', 'stray' + in_page(LINE.format(WORD)),
+        "plain text intermixed with structural elements"),
+], ids=[
+    'page-without-bbox', 'page-not-at-origin', 'no-page', 'stray-text-in-zone', 'mixed-zones',
+    'word-without-bbox', 'line-without-bbox', 'bboxes-mismatch', 'missing-char-bbox', 'stray-text-in-body',
+])
+def test_malformed_hocr(ocr_system, body, message):
+    head = HEAD_TEMPLATE.format(meta='<meta name="ocr-system" content="{0}" />\n'.format(ocr_system))
+    document = make_document(body, head=head)
+    with pytest.raises(errors.MalformedHocr, match=message):
+        extract(document)
+    with pytest.raises(errors.MalformedHocr, match=message):
+        list(hocr.extract_zones_iter(io.BytesIO(document)))
+
+
+def extract_iter(document, **kwargs):
+    return [zone.format_sexpr() for zone in hocr.extract_zones_iter(io.BytesIO(document), **kwargs)]
+
+
+def test_iter_matches_extract_zones(monkeypatch):
+    # Pages are wrapped in elements that are not zones, so that both zones
+    # and plain elements are dropped once dealt with.
+    document = make_document(*[
+        '<div class="chapter">\n' + make_page(n) + make_page(n + 1) + make_page(n + 2) + '</div>\n'
+        for n in range(1, 10, 3)
+    ])
+    expected = extract(document)
+    preceding = []
+    scan = hocr._scan
+
+    def scan_page(node, settings, page_size=None):
+        chapter = node.getparent()
+        preceding.append((
+            len(list(node.itersiblings(preceding=True))),
+            len(list(chapter.itersiblings(preceding=True))),
+        ))
+        return scan(node, settings, page_size)
+
+    monkeypatch.setattr(hocr, '_scan', scan_page)
+    zones = extract_iter(document)
+    assert zones == expected
+    assert len(zones) == 9
+    # Only the page (or chapter) just before is still in the tree.
+    assert preceding == [(0, 0), (1, 0), (1, 0)] + [(0, 1), (1, 1), (1, 1)] * 2
+
+
+def test_iter_rejects_stray_text_between_pages():
+    document = make_document(make_page(1), 'stray', make_page(2), make_page(3))
+    with pytest.raises(errors.MalformedHocr, match='plain text intermixed with structural elements'):
+        extract(document)
+    with pytest.raises(errors.MalformedHocr, match='plain text intermixed with structural elements'):
+        extract_iter(document)
+
+
+@pytest.mark.parametrize('details', [hocr.TEXT_DETAILS_LINE, hocr.TEXT_DETAILS_WORD])
+def test_iter_whole_body_zone(details):
+    # With Cuneiform ≤ 0.8 the body itself is the page.
+    zones = extract_iter(CUNEIFORM_08_DOCUMENT, details=details, page_size=(100, 200))
+    assert zones == extract(CUNEIFORM_08_DOCUMENT, details=details, page_size=(100, 200))
+    assert len(zones) == 1
@@ -0,0 +1,100 @@
+from pathlib import Path
+import os
+import sys
+
+import pytest
+
+# hocr2djvused lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+pytest.importorskip('djvu.sexpr')
+
+from lib import errors  # noqa: E402
+from lib.cli import hocr2djvused  # noqa: E402
+
+HOCR_PAGE = '''\
+<!DOCTYPE html>
+<html>
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+<meta name="ocr-system" content="djvu2hocr 0.12" />
+</head>
+<body>
+<div class="ocr_page" title="bbox 0 0 1000 1400">
+<p class="ocr_par" title="bbox 10 10 990 200">
+<span class="ocr_line" title="bbox 10 10 990 60"><span class="ocrx_word" title="bbox 10 10 400 60">page{n}</span> <span class="ocrx_word" title="bbox 500 10 990 60">Größe</span></span>
+<span class="ocr_line" title="bbox 10 100 990 160"><span class="ocrx_word" title="bbox 10 100 990 160">{words}</span></span>
+</p>
+</div>
+</body>
+</html>
+'''
+
+# Records the script it is given on standard input
+FAKE_DJVUSED = '''\
+import sys
+assert sys.argv[1] == '-s'
+with open(sys.argv[2] + '.script', 'wb') as script:
+    script.write(sys.stdin.buffer.read())
+'''
+
+
+@pytest.fixture
+def hocr_files(tmp_path):
+    paths = []
+    for n in range(1, 6):
+        path = tmp_path / 'page{0}.html'.format(n)
+        path.write_text(HOCR_PAGE.format(n=n, words=' '.join(['word'] * 8 * n)), encoding='UTF-8')
+        paths.append(str(path))
+    return paths
+
+
+def run(capsys, *args):
+    hocr2djvused.main(['hocr2djvused'] + list(args))
+    return capsys.readouterr().out
+
+
+def test_jobs(capsys, hocr_files):
+    expected = run(capsys, '--jobs', '1', *hocr_files)
+
+    assert run(capsys, '--jobs', '2', *hocr_files) == expected
+    assert [line for line in expected.split('\n') if line.startswith('select')] == ['select {0}'.format(n) for n in range(1, 6)]
+    assert '"page5"' in expected
+
+
+def test_jobs_error(tmp_path, hocr_files):
+    broken = tmp_path / 'broken.html'
+    broken.write_text(HOCR_PAGE.replace('title="bbox 0 0 1000 1400"', ''), encoding='UTF-8')
+    # The error raised in a worker process reaches the main process intact
+    with pytest.raises(errors.MalformedHocr) as error:
+        hocr2djvused.main(['hocr2djvused', '--jobs', '2', hocr_files[0], str(broken)])
+    with pytest.raises(errors.MalformedHocr) as expected:
+        hocr2djvused.main(['hocr2djvused', str(broken)])
+    assert error.value.message == expected.value.message
+
+
+def test_compact(capsys, hocr_files):
+    compact = run(capsys, '--compact', *hocr_files[:2])
+    pretty = run(capsys, *hocr_files[:2])
+
+    texts = compact.split('\n.\n\n')
+    assert len(texts) == 3 and texts[-1] == ''
+    assert all(text.count('\n') == 3 for text in texts[:-1])
+    assert ' '.join(compact.split()) == ' '.join(pretty.split())
+    assert max(len(line) for line in pretty.split('\n')) <= 80 < max(len(line) for line in compact.split('\n'))
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='uses an executable script as djvused')
+def test_djvu(capsys, tmp_path, monkeypatch, hocr_files):
+    djvused = tmp_path / 'bin' / 'djvused'
+    djvused.parent.mkdir()
+    djvused.write_text('#!{0}\n{1}'.format(sys.executable, FAKE_DJVUSED))
+    djvused.chmod(0o755)
+    monkeypatch.setenv('PATH', str(djvused.parent) + os.pathsep + os.environ['PATH'])
+    document = tmp_path / 'book.djvu'
+
+    expected = run(capsys, '--jobs', '2', *hocr_files)
+    assert run(capsys, '--jobs', '2', '--djvu', str(document), *hocr_files) == ''
+
+    assert Path(str(document) + '.script').read_bytes().decode('UTF-8') == expected
@@ -0,0 +1,40 @@
+from pathlib import Path
+import logging
+import os
+import sys
+
+import pytest
+
+# ipc lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+pytest.importorskip('six')
+
+from lib import ipc  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'wait4'), reason='needs os.wait4()')
+
+
+def test_wait_keeps_resource_usage(caplog):
+    child = ipc.Subprocess([sys.executable, '-c', 'print(sum(range(10 ** 6)))'], stdout=ipc.PIPE)
+    with caplog.at_level(logging.DEBUG, logger='ocrodjvu.ipc'):
+        assert child.stdout.read() == b'499999500000\n'
+        child.wait()
+
+    assert child.returncode == 0
+    assert child.rusage.ru_maxrss > 0
+    assert 'KiB max RSS' in caplog.records[-1].getMessage()
+
+
+def test_wait_raises_on_failure():
+    child = ipc.Subprocess([sys.executable, '-c', 'raise SystemExit(3)'])
+    with pytest.raises(ipc.CalledProcessError) as error:
+        child.wait()
+    assert error.value.returncode == 3 and child.returncode == 3
+    assert child.rusage is not None
+
+    child = ipc.Subprocess([sys.executable, '-c', 'import os, signal; os.kill(os.getpid(), signal.SIGKILL)'])
+    with pytest.raises(ipc.CalledProcessInterrupted):
+        child.wait()
+    assert child.returncode == -9
@@ -0,0 +1,180 @@
+from pathlib import Path
+import sys
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the progress module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_progress import STAGE_COSTS, ProgressEvent, ProgressTracker, format_duration
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_page_events_are_coalesced():
+    clock = Clock()
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=1.0, clock=clock)
+    tracker.start(100)
+    tracker.stage('text', 'Text')
+    for page in range(1, 101):
+        clock.now += 0.125
+        tracker.page(page)
+    tracker.stage('pdf', 'PDF')
+
+    stages = [event.stage for event in events]
+    assert stages[0] == 'text' and stages[-1] == 'pdf'
+    # One event every eight pages, the last page held back, and the two
+    # stage changes
+    assert len(events) == 15
+    assert events[-2].pages_done == 100 and events[-2].page == 100
+
+
+class Timer:
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.pending = []
+
+    def __call__(self, delay, function):
+        handle = Handle(self.clock.now + delay, function)
+        self.pending.append(handle)
+        return handle
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        for handle in list(self.pending):
+            if handle.when <= self.clock.now:
+                self.pending.remove(handle)
+                if not handle.cancelled:
+                    handle.function()
+
+
+class Handle:
+
+    def __init__(self, when, function):
+        self.when = when
+        self.function = function
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def test_held_page_event_is_delivered_when_its_interval_ends():
+    clock = Clock()
+    timer = Timer(clock)
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=1.0, clock=clock, timer=timer)
+    tracker.start(10)
+    tracker.stage('text', 'Text')
+    timer.advance(0.25)
+    tracker.page(1)
+    timer.advance(0.25)
+    tracker.page(2)
+    assert len(events) == 1 and len(timer.pending) == 1
+
+    # The pages stall; the held event still arrives a second after the last one
+    timer.advance(0.25)
+    assert len(events) == 1
+    timer.advance(0.25)
+    assert [(event.page, event.pages_done) for event in events[1:]] == [(2, 2)]
+    assert events[1].message == 'Text'
+
+    # The next page counts its interval from the delivered event
+    timer.advance(0.5)
+    tracker.page(3)
+    assert len(events) == 2
+    tracker.stage('pdf', 'PDF')
+    assert [(event.stage, event.page) for event in events[2:]] == [('text', 3), ('pdf', None)]
+    assert all(handle.cancelled for handle in timer.pending)
+
+
+def test_held_page_event_is_dropped_on_close():
+    clock = Clock()
+    timer = Timer(clock)
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=1.0, clock=clock, timer=timer)
+    tracker.start(10)
+    tracker.stage('text', 'Text')
+    tracker.page(1)
+    tracker.close()
+    timer.advance(2)
+
+    assert [event.stage for event in events] == ['text']
+
+
+def test_held_page_event_with_threads():
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=0.2)
+    tracker.start(10)
+    tracker.stage('text', 'Text')
+    tracker.page(1)
+    for _ in range(100):
+        if len(events) == 2:
+            break
+        time.sleep(0.01)
+
+    assert [(event.stage, event.page) for event in events] == [('text', None), ('text', 1)]
+
+
+def test_rate_and_eta_follow_observed_work():
+    clock = Clock()
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=0, clock=clock)
+    tracker.start(10)
+    tracker.stage('text', 'Text')
+    for page in range(1, 6):
+        clock.now += 0.5
+        tracker.page(page)
+
+    event = events[-1]
+    assert event.pages_per_second == pytest.approx(2.0)
+    # Five pages left at two pages a second, plus the later stages
+    assert event.eta > 2.5
+    assert event.pages_total == 10
+
+
+def test_skipped_stages_leave_the_eta():
+    clock = Clock()
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=0, clock=clock)
+    tracker.start(10)
+    tracker.skip('split', 'rename', 'text')
+    tracker.stage('extract', 'Extract')
+
+    # Nothing measured yet: the model's cost of the stages left to run
+    stages = ['extract', 'toc', 'pdf', 'finalize']
+    assert events[-1].eta == pytest.approx(10 * sum(STAGE_COSTS[stage] for stage in stages))
+
+
+def test_percent_never_decreases():
+    clock = Clock()
+    events = []
+    tracker = ProgressTracker(events.append, min_interval=0, clock=clock)
+    tracker.start(10)
+    for stage in ('extract', 'split', 'rename', 'text', 'toc', 'pdf', 'finalize'):
+        tracker.stage(stage, stage)
+        # Much slower than expected, so the estimates keep growing
+        clock.now += 100
+    tracker.finish('Done')
+
+    percents = [event.percent for event in events]
+    assert percents == sorted(percents)
+    assert events[-1].percent == 100 and events[-1].stage == 'done'
+
+
+def test_describe():
+    event = ProgressEvent('text', 'Extracting', 50.0, pages_per_second=12.5, eta=125)
+
+    assert event.describe() == 'Extracting - 12.5 pages/s, about 2m 05s left'
+    assert format_duration(3725) == '1h 02m'
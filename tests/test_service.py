@@ -0,0 +1,189 @@
+from pathlib import Path
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the service module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_service import ConversionServer, ConversionService, parse_range
+
+FAKE_TOOLS = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+DOCUMENT = json.dumps({'pages': 3, 'lines': 2, 'words': 2, 'bookmarks': 2}).encode('utf-8')
+
+
+@pytest.fixture
+def serve(tmp_path):
+    servers = []
+
+    def serve(workers=1, max_queued=2, **kwargs):
+        service = ConversionService(tmp_path / 'work', workers, max_queued, FAKE_TOOLS, kwargs.pop('keep', 3600.0))
+        service.start()
+        server = ConversionServer(('127.0.0.1', 0), service, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+        server.service.stop()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=30)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def wait_for(server, job_id, states=('done', 'failed')):
+    for _ in range(300):
+        status, _, body = request(server, 'GET', f'/jobs/{job_id}')
+        job = json.loads(body)
+        if job['state'] in states:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'the job did not reach {states}')
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-9', (0, 9)),
+    ('bytes=90-', (90, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=95-200', (95, 99)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=100-', 'bytes=5-1', 'bytes=-', 'items=0-1', 'bytes=0-1,3-4'])
+def test_parse_range_rejects(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 100)
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_convert_and_download(serve):
+    server = serve()
+
+    status, headers, body = request(server, 'POST', '/jobs', DOCUMENT)
+    assert status == 202
+    job_id = json.loads(body)['id']
+    assert headers['Location'] == f'/jobs/{job_id}'
+
+    job = wait_for(server, job_id)
+    assert job['state'] == 'done'
+    assert job['progress']['stage'] == 'done'
+
+    status, headers, pdf = request(server, 'GET', f'/jobs/{job_id}/pdf')
+    assert status == 200 and pdf.startswith(b'%PDF')
+    assert headers['Accept-Ranges'] == 'bytes'
+
+    status, headers, part = request(server, 'GET', f'/jobs/{job_id}/pdf', headers={'Range': 'bytes=-5'})
+    assert status == 206 and part == pdf[-5:]
+    assert headers['Content-Range'] == f'bytes {len(pdf) - 5}-{len(pdf) - 1}/{len(pdf)}'
+
+    status, _, _ = request(server, 'GET', f'/jobs/{job_id}/pdf', headers={'Range': f'bytes={len(pdf)}-'})
+    assert status == 416
+
+    assert request(server, 'DELETE', f'/jobs/{job_id}')[0] == 204
+    assert request(server, 'GET', f'/jobs/{job_id}')[0] == 404
+
+
+def test_full_queue_is_rejected(serve):
+    server = serve(workers=1, max_queued=1)
+    # Without workers, accepted jobs stay queued
+    server.service.stop()
+
+    assert request(server, 'POST', '/jobs', DOCUMENT)[0] == 202
+    status, headers, _ = request(server, 'POST', '/jobs', DOCUMENT)
+    assert status == 429
+    assert headers['Retry-After'] == '5'
+    assert json.loads(request(server, 'GET', '/health')[2])['rejected'] == 1
+
+
+def test_upload_limit(serve):
+    server = serve(max_upload=10)
+
+    assert request(server, 'POST', '/jobs', DOCUMENT)[0] == 413
+    assert request(server, 'GET', '/jobs/nonexistent')[0] == 404
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_delete_cancels_running_job(serve, monkeypatch):
+    # ddjvu would take 20 s
+    monkeypatch.setenv('DJVU2PDF_FAKE_PAGE_LATENCY', '1')
+    server = serve()
+    job_id = json.loads(request(server, 'POST', '/jobs', json.dumps({'pages': 20}).encode('utf-8'))[2])['id']
+    for _ in range(100):
+        if json.loads(request(server, 'GET', f'/jobs/{job_id}')[2])['state'] == 'running':
+            break
+        time.sleep(0.02)
+
+    assert request(server, 'DELETE', f'/jobs/{job_id}')[0] == 204
+    assert request(server, 'GET', f'/jobs/{job_id}')[0] == 404
+    for _ in range(100):
+        if json.loads(request(server, 'GET', '/health')[2])['cancelled']:
+            break
+        time.sleep(0.02)
+    assert json.loads(request(server, 'GET', '/health')[2])['cancelled'] == 1
+    assert not (server.service.work_dir / job_id).exists()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_stop_cancels_jobs(serve, monkeypatch):
+    # ddjvu would take 20 s
+    monkeypatch.setenv('DJVU2PDF_FAKE_PAGE_LATENCY', '1')
+    server = serve()
+    document = json.dumps({'pages': 20}).encode('utf-8')
+    running = json.loads(request(server, 'POST', '/jobs', document)[2])['id']
+    queued = json.loads(request(server, 'POST', '/jobs', document)[2])['id']
+    wait_for(server, running, states=('running',))
+
+    start = time.monotonic()
+    server.service.stop()
+    assert time.monotonic() - start < 5
+
+    for job_id in (running, queued):
+        assert json.loads(request(server, 'GET', f'/jobs/{job_id}')[2])['state'] == 'cancelled'
+    health = json.loads(request(server, 'GET', '/health')[2])
+    assert health['cancelled'] == 2 and health['queued'] == 0 and health['running'] == 0
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_finished_jobs_expire(serve):
+    server = serve(keep=0.2)
+    job_id = json.loads(request(server, 'POST', '/jobs', DOCUMENT)[2])['id']
+    assert wait_for(server, job_id)['state'] == 'done'
+
+    for _ in range(100):
+        if request(server, 'GET', f'/jobs/{job_id}')[0] == 404:
+            break
+        time.sleep(0.02)
+    assert request(server, 'GET', f'/jobs/{job_id}')[0] == 404
+    assert not (server.service.work_dir / job_id).exists()
+    assert json.loads(request(server, 'GET', '/health')[2])['expired'] == 1
+
+
+def test_remove_expired(tmp_path):
+    service = ConversionService(tmp_path / 'work', keep=60)
+    recent, old, queued = service.new_job(), service.new_job(), service.new_job()
+    for job in (recent, old, queued):
+        service.submit(job)
+    recent.finished, old.finished = 1000.0, 900.0
+
+    assert service.remove_expired(now=950.0) == 0
+    assert service.remove_expired(now=1000.0) == 1
+    assert service.get(old.id) is None and not old.directory.exists()
+    assert set(service.jobs) == {recent.id, queued.id}
@@ -0,0 +1,183 @@
+from pathlib import Path
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the session module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_async import AsyncDjVuDocumentSession
+from djvu2pdf_session import DjVuDocumentSession
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='uses an executable script as djvused')
+
+# Answers the commands of a djvused script (-f) for a three-page document,
+# and logs the commands of every script it runs on a line of its own. A
+# document reading "hang" stops answering at page 2, and one reading "fail"
+# makes it exit with an error there.
+FAKE_DJVUSED = '''\
+import sys, time
+assert sys.argv[1:3] == ['-u', '-f']
+with open(sys.argv[3]) as script:
+    commands = [command.strip() for line in script for command in line.split(';') if command.strip()]
+with open(sys.argv[-1]) as document:
+    mode = document.read()
+with open(sys.argv[-1] + '.log', 'a') as log:
+    log.write('; '.join(commands) + '\\n')
+page = None
+for command in commands:
+    if command == 'n':
+        print(3)
+    elif command.startswith('select'):
+        page = int(command.split()[1])
+    elif command == 'size':
+        print('width=%d height=200' % (100 * page))
+    elif command == 'print-txt':
+        if page == 2 and mode == 'hang':
+            sys.stdout.flush()
+            time.sleep(30)
+        if page == 2 and mode == 'fail':
+            sys.exit('cannot decode page 2')
+        if page != 2:
+            print('(page 0 0 100 200\\n  (word 1 2 3 4 "p%d"))' % page)
+    elif command == 'print-outline':
+        print('(bookmarks\\n ("Intro" "#1"))')
+    elif command == 'ls':
+        print('   1 P     1000 p0001.djvu')
+        print('   2 P     1200 intro.djvu T=Introduction')
+        print('   3 P      900 p0003.djvu T=p0001.djvu')
+        print('     S      100 shared_anno.iff')
+'''
+
+PAGES_FROM_1 = 'select 1; size; print-txt; n; select 2; size; print-txt; n; select 3; size; print-txt; n'
+
+
+@pytest.fixture
+def make_session(tmp_path):
+    djvused = tmp_path / 'djvused'
+    djvused.write_text('#!{0}\n{1}'.format(sys.executable, FAKE_DJVUSED))
+    djvused.chmod(0o755)
+    sessions = []
+
+    def make_session(mode='', **kwargs):
+        document = tmp_path / 'book.djvu'
+        document.write_text(mode)
+        session = DjVuDocumentSession(document, djvused, **kwargs)
+        sessions.append(session)
+        return session
+
+    yield make_session
+    for session in sessions:
+        session.close()
+
+
+@pytest.fixture
+def session(make_session):
+    return make_session()
+
+
+def commands(session):
+    """The scripts djvused ran, one line of commands each"""
+    return Path(str(session.input_file) + '.log').read_text().split('\n')[:-1]
+
+
+def test_page_queries(session):
+    assert session.page_count() == 3
+    assert session.page_size(1) == (100, 200)
+    assert session.page_text(1) == '(page 0 0 100 200\n  (word 1 2 3 4 "p1"))'
+    assert session.page_size(3) == (300, 200)
+    assert session.page_text(2) == ''
+
+
+def test_outline(session):
+    assert session.outline() == '(bookmarks\n ("Intro" "#1"))'
+
+
+def test_page_ids(session):
+    assert session.page_ids() == {
+        'p0001.djvu': 1,
+        'intro.djvu': 2,
+        'Introduction': 2,
+        'p0003.djvu': 3,
+    }
+    session.page_ids()
+    assert commands(session).count('ls') == 1
+
+
+def test_answers_are_memoized(session):
+    session.page_text(1)
+    session.page_size(1)
+    session.outline()
+    session.outline()
+
+    assert commands(session) == ['n', PAGES_FROM_1, 'print-outline']
+
+
+def test_pages_are_read_from_one_script(session):
+    assert [session.page_text(page) for page in (1, 2, 3)] == [
+        '(page 0 0 100 200\n  (word 1 2 3 4 "p1"))', '', '(page 0 0 100 200\n  (word 1 2 3 4 "p3"))',
+    ]
+    # Going back starts again from the page asked for
+    session.forget_page(2)
+    session.page_text(2)
+
+    assert commands(session) == ['n', PAGES_FROM_1, 'select 2; size; print-txt; n; select 3; size; print-txt; n']
+
+
+def test_timeout(make_session):
+    session = make_session('hang', timeout=0.5)
+    session.page_text(1)
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='printed nothing for 0.5 seconds'):
+        session.page_text(2)
+    assert time.monotonic() - start < 5
+
+
+def test_djvused_error(make_session):
+    session = make_session('fail')
+    session.page_text(1)
+
+    with pytest.raises(RuntimeError, match='exited unexpectedly') as error:
+        session.page_text(2)
+    assert 'cannot decode page 2' in str(error.value)
+
+
+def test_kill(make_session):
+    session = make_session('hang')
+    session.page_text(1)
+    threading.Timer(0.5, session.kill).start()
+
+    with pytest.raises(RuntimeError, match='exited unexpectedly'):
+        session.page_text(2)
+    with pytest.raises(RuntimeError, match='killed'):
+        session.outline()
+
+
+def test_forget_page(session):
+    session.page_text(1)
+    session.forget_page(1)
+    session.page_size(1)
+    session.page_text(1)
+
+    assert commands(session) == ['n', PAGES_FROM_1, PAGES_FROM_1]
+
+
+def test_async_session(make_session):
+    session = make_session('hang', timeout=0.5)
+
+    async def query():
+        async with AsyncDjVuDocumentSession(session.input_file, session.djvused, timeout=0.5) as async_session:
+            assert await async_session.page_count() == 3
+            assert await async_session.page_text(1) == session.page_text(1)
+            assert await async_session.page_size(1) == session.page_size(1)
+            assert await async_session.outline() == session.outline()
+            with pytest.raises(RuntimeError, match='printed nothing for 0.5 seconds'):
+                await async_session.page_text(2)
+
+    asyncio.run(query())
@@ -0,0 +1,145 @@
+from pathlib import Path
+import io
+import sys
+
+import pytest
+
+# text_zones lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+pytest.importorskip('djvu.sexpr')
+
+from lib import hocr, text_zones  # noqa: E402
+
+const = text_zones.const
+Zone = text_zones.Zone
+
+STRINGS = [
+    'plain',
+    'Zürich',
+    '日本語のテキスト',
+    '"quoted" and back\\slash',
+    'tab\there, new\nline, return\r',
+    'bell\x07, escape\x1b, delete\x7f',
+    '',
+]
+
+HOCR_DOCUMENT = '''\
+<!DOCTYPE html>
+<html>
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=UTF-8" />
+<meta name="ocr-system" content="tesseract 4.1.1" />
+</head>
+<body>
+<div class="ocr_page" title="bbox 0 0 1000 1400">
+<div class="ocr_carea" title="bbox 50 50 950 500">
+<p class="ocr_par" title="bbox 50 50 950 500">
+<span class="ocr_line" title="bbox 50 50 950 120">
+<span class="ocrx_word" title="bbox 50 50 300 120">Größe</span>
+<span class="ocrx_word" title="bbox 320 50 600 120">&quot;quoted&quot;</span>
+<span class="ocrx_word" title="bbox 620 50 950 120">back\\slash</span>
+</span>
+<span class="ocr_line" title="bbox 50 200 950 280">
+<span class="ocrx_word" title="bbox 50 200 500 280">日本語のテキスト</span>
+<span class="ocrx_word" title="bbox 520 200 950 280">done.</span>
+</span>
+</p>
+</div>
+</div>
+<div class="ocr_page" title="bbox 0 0 1000 1400">
+<span class="ocr_line" title="bbox 10 10 990 60"><span class="ocrx_word" title="bbox 10 10 990 60">second</span></span>
+</div>
+</body>
+</html>
+'''
+
+
+def reference(zone, width):
+    '''
+    The zone as python-djvulibre prints it, which is what djvused reads
+    '''
+    output = io.StringIO()
+    text_zones.print_sexpr(zone.sexpr, output, width=width)
+    return output.getvalue()
+
+
+def make_page(words_per_line=4, strings=STRINGS):
+    page = Zone(const.TEXT_ZONE_PAGE, (0, 0, 2480, 3508))
+    paragraph = Zone(const.TEXT_ZONE_PARAGRAPH, (100, 100, 2380, 3400))
+    for n, text in enumerate(strings):
+        y0 = 100 + 200 * n
+        line = Zone(const.TEXT_ZONE_LINE, (100, y0, 2380, y0 + 150))
+        for m in range(words_per_line):
+            x0 = 100 + 500 * m
+            line += [Zone(const.TEXT_ZONE_WORD, (x0, y0, x0 + 400, y0 + 150), [text])]
+            line += [text_zones.Space()]
+        paragraph += [line]
+    page += [Zone(const.TEXT_ZONE_COLUMN, (0, 0, 2480, 3508), [Zone(const.TEXT_ZONE_REGION, (0, 0, 2480, 3508), [paragraph])])]
+    return page
+
+
+def make_character_page():
+    word = Zone(const.TEXT_ZONE_WORD, (10, 10, 90, 40), [
+        Zone(const.TEXT_ZONE_CHARACTER, (10 + 10 * n, 10, 20 + 10 * n, 40), [char])
+        for n, char in enumerate('ä"\\\tx\x01日本')
+    ])
+    line = Zone(const.TEXT_ZONE_LINE, (10, 10, 90, 40), [word])
+    return Zone(const.TEXT_ZONE_PAGE, (0, 0, 100, 50), [line])
+
+
+@pytest.mark.parametrize('text', STRINGS)
+def test_format_sexpr_string(text):
+    zone = Zone(const.TEXT_ZONE_WORD, (1, 2, 3, 4), [text])
+    assert zone.format_sexpr() == reference(zone, None)
+    assert zone.format_sexpr().endswith(' ' + text_zones.format_sexpr_string(text) + ')')
+
+
+def test_format_sexpr_string_escapes():
+    assert text_zones.format_sexpr_string('a"b\\c') == '"a\\"b\\\\c"'
+    assert text_zones.format_sexpr_string('\t\n\x01\x7f') == '"\\t\\n\\001\\177"'
+    assert text_zones.format_sexpr_string('Zürich 日本') == '"Zürich 日本"'
+
+
+@pytest.mark.parametrize('width', [None, 80, 40, 10])
+@pytest.mark.parametrize('page', ['words', 'characters'])
+def test_format_sexpr_matches_expression(page, width):
+    zone = make_page() if page == 'words' else make_character_page()
+    formatted = zone.format_sexpr(width=width)
+    assert formatted == reference(zone, width)
+    if width is None:
+        assert '\n' not in formatted
+    else:
+        assert formatted.count('\n') > 1
+
+
+def test_format_sexpr_wraps_by_bytes():
+    # 78 characters on a single line, but 118 bytes in UTF-8
+    text = 'ä' * 40
+    line = Zone(const.TEXT_ZONE_LINE, (0, 0, 100, 10), [Zone(const.TEXT_ZONE_WORD, (0, 0, 100, 10), [text])])
+    assert line.format_sexpr(width=100) == '(line 0 0 100 10\n (word 0 0 100 10 "{0}"))'.format(text)
+    assert line.format_sexpr(width=100) == reference(line, 100)
+
+
+def test_format_sexpr_normalises_zones():
+    # Degenerate and reversed bounding boxes, no children
+    zone = Zone(const.TEXT_ZONE_LINE, (5, 9, 5, 2), [Zone(const.TEXT_ZONE_WORD, (8, 8, 7, 8))])
+    assert zone.format_sexpr() == '(line 5 2 6 9 (word 7 8 8 9 ""))'
+    assert zone.format_sexpr() == reference(zone, None)
+
+
+@pytest.mark.parametrize('details', [hocr.TEXT_DETAILS_LINE, hocr.TEXT_DETAILS_WORD, hocr.TEXT_DETAILS_CHARACTER])
+def test_extract_zones(details):
+    document = HOCR_DOCUMENT.encode('UTF-8')
+    zones = hocr.extract_zones(io.BytesIO(document), details=details)
+
+    assert len(zones) == 2
+    for zone in zones:
+        for width in (None, 80):
+            assert zone.format_sexpr(width=width) == reference(zone, width)
+    assert [zone.sexpr for zone in zones] == hocr.extract_text(io.BytesIO(document), details=details)
+    streamed = hocr.extract_zones_iter(io.BytesIO(document), details=details)
+    assert [zone.format_sexpr() for zone in streamed] == [zone.format_sexpr() for zone in zones]
+    if details == hocr.TEXT_DETAILS_WORD:
+        assert '(word 50 1280 300 1350 "Größe")' in zones[0].format_sexpr()
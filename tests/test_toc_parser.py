@@ -7,7 +7,8 @@ import pytest
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.append(str(PROJECT_ROOT))
 
-from djvu2pdf_toc_parser import parse_sexp, next_quote
+import djvu2pdf_toc_parser
+from djvu2pdf_toc_parser import parse_sexp, next_quote, translate_outline
 
 
 def test_next_quote_replaces_escaped_quotes():
@@ -29,3 +30,52 @@ def test_parse_sexp_bookmarks_structure():
     parse_sexp(toc_input[1:], toc_output, '', 0)
 
     assert toc_output == ['"Intro" "1"', '"Chapter 1" "5"', '\t"Section" "7"']
+
+
+def test_parse_sexp_consecutive_closing_parentheses():
+    toc_input = '(bookmarks ("A" "#1" ("B" "#2")) ("C" "#3"))'
+    toc_output = []
+
+    index = parse_sexp(toc_input[len('(bookmarks'):], toc_output, '', 0)
+
+    assert toc_output == ['"A" "1"', '\t"B" "2"', '"C" "3"']
+    assert index == len(toc_input) - len('(bookmarks')
+
+
+def test_translate_outline_resolves_page_ids():
+    toc_input = '(bookmarks\n ("Intro" "#intro.djvu"\n  ("Part" "#Part I")) ("Web" "http://example.org/"))'
+
+    toc_output = list(translate_outline(toc_input, {'intro.djvu': 2, 'Part I': 4}))
+
+    assert toc_output == ['"Intro" "2"', '\t"Part" "4"', '"Web" "http://example.org/"']
+
+
+def test_translate_outline_streams_chunks(monkeypatch):
+    # Scan every chunk as soon as it arrives
+    monkeypatch.setattr(djvu2pdf_toc_parser, '_chunk_size', 1)
+    toc_input = '(bookmarks ("A \\"x\\"" "#1" ("B" "#2" ("C" "#3"))) ("D" "#4"))'
+    chunks = [toc_input[i:i + 3] for i in range(0, len(toc_input), 3)]
+
+    assert list(translate_outline(chunks)) == list(translate_outline(toc_input)) == [
+        '"A \'x\'" "1"', '\t"B" "2"', '\t\t"C" "3"', '"D" "4"',
+    ]
+
+
+def test_translate_outline_deep_nesting():
+    depth = 5000
+    toc_input = '(bookmarks ' + '("T" "#1" ' * depth + ')' * (depth + 1)
+
+    toc_output = list(translate_outline(toc_input))
+
+    assert len(toc_output) == depth
+    assert toc_output[-1] == '\t' * (depth - 1) + '"T" "1"'
+
+
+@pytest.mark.parametrize('toc_input', ['(bookmarks ("A"))', '(bookmarks ("A" "#1")', '(outline)'])
+def test_translate_outline_rejects_malformed_input(toc_input):
+    with pytest.raises(ValueError):
+        list(translate_outline(toc_input))
+
+
+def test_translate_outline_empty():
+    assert list(translate_outline('')) == []
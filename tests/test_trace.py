@@ -0,0 +1,114 @@
+from pathlib import Path
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Ensure repository root is on the path so the trace module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_converter import DjVu2PDFConverter
+from djvu2pdf_trace import NULL_TRACER, Tracer
+
+
+def test_null_tracer_runs_commands():
+    result = NULL_TRACER.run([sys.executable, '-c', 'print("hi")'], capture_output=True, text=True)
+
+    assert result.stdout == 'hi\n'
+    with NULL_TRACER.span('step', page=1):
+        pass
+
+
+def test_tracer_records_commands():
+    tracer = Tracer()
+
+    with tracer.span('step', page=1):
+        result = tracer.run([sys.executable, '-c', 'print("x" * 1000)'], capture_output=True, text=True)
+
+    assert result.stdout == 'x' * 1000 + '\n'
+    [span] = tracer.spans
+    assert span['name'] == 'step' and span['args'] == {'page': 1}
+    [command] = tracer.commands
+    assert command['argv'][0] == sys.executable
+    assert command['stdout_bytes'] == 1001
+    assert command['returncode'] == 0
+    assert span['start'] <= command['start']
+    assert command['start'] + command['wall'] <= span['start'] + span['duration']
+    if hasattr(os, 'wait4'):
+        assert command['user'] is not None
+        assert command['max_rss_kib'] > 0
+
+
+def test_tracer_records_failed_commands():
+    tracer = Tracer()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        tracer.run([sys.executable, '-c', 'raise SystemExit(3)'], check=True)
+
+    assert tracer.commands[0]['returncode'] == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'wait4'), reason='needs os.wait4()')
+def test_tracer_records_killed_commands():
+    tracer = Tracer()
+
+    result = tracer.run([sys.executable, '-c', 'import os, signal; os.kill(os.getpid(), signal.SIGKILL)'])
+
+    assert result.returncode == tracer.commands[0]['returncode'] == -9
+    assert tracer.commands[0]['system'] is not None
+
+
+@pytest.mark.parametrize('output_format', ['chrome', 'json'])
+def test_tracer_save(tmp_path, output_format):
+    tracer = Tracer(tmp_path / 'trace.json', output_format)
+    with tracer.span('step'):
+        tracer.run([sys.executable, '-c', 'pass'])
+
+    tracer.save()
+
+    data = json.loads((tmp_path / 'trace.json').read_text(encoding='utf-8'))
+    if output_format == 'chrome':
+        events = [event for event in data['traceEvents'] if event['ph'] == 'X']
+        assert sorted(event['cat'] for event in events) == ['command', 'stage']
+        assert all(event['dur'] >= 0 for event in events)
+    else:
+        assert [span['name'] for span in data['spans']] == ['step']
+        assert len(data['commands']) == 1
+
+
+def test_tracer_from_environment(tmp_path, monkeypatch):
+    monkeypatch.delenv('DJVU2PDF_TRACE', raising=False)
+    assert DjVu2PDFConverter().tracer is NULL_TRACER
+
+    monkeypatch.setenv('DJVU2PDF_TRACE', str(tmp_path / 'trace.json'))
+    monkeypatch.setenv('DJVU2PDF_TRACE_FORMAT', 'json')
+    tracer = DjVu2PDFConverter().tracer
+    assert tracer.enabled
+    assert tracer.output == tmp_path / 'trace.json'
+    assert tracer.output_format == 'json'
+
+    assert DjVu2PDFConverter().tracer is tracer
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_tracer_from_environment_saves_at_exit(tmp_path):
+    trace = tmp_path / 'trace.json'
+    document = tmp_path / 'book.djvu'
+    document.write_text(json.dumps({'pages': 2}), encoding='utf-8')
+    script = (
+        'import sys\n'
+        'from djvu2pdf_converter import DjVu2PDFConverter\n'
+        'for n in range(2):\n'
+        '    DjVu2PDFConverter(sys.argv[1]).convert(sys.argv[2], sys.argv[3] + str(n))\n'
+        '    assert not __import__("os").path.exists(sys.argv[4])\n'
+    )
+    env = dict(os.environ, DJVU2PDF_TRACE=str(trace), DJVU2PDF_TRACE_FORMAT='json', PYTHONPATH=str(PROJECT_ROOT))
+
+    subprocess.run([sys.executable, '-c', script, str(PROJECT_ROOT / 'benchmarks' / 'fake_tools'), str(document),
+                    str(tmp_path / 'book.pdf'), str(trace)], env=env, check=True)
+
+    data = json.loads(trace.read_text(encoding='utf-8'))
+    assert [span['name'] for span in data['spans']].count('convert') == 2
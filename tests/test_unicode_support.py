@@ -0,0 +1,77 @@
+from pathlib import Path
+import sys
+import threading
+
+import pytest
+
+# unicode_support lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+pytest.importorskip('six')
+icu = pytest.importorskip('icu')
+
+from lib import unicode_support  # noqa: E402
+
+# The POSIX locale breaks "a.b" in three; Swedish keeps "E:s" in one piece.
+LOCALES = ['en_US_POSIX', 'sv']
+TEXTS = ['E:s och K:ssa', '3.14 a.b', 'ภาษาไทยง่ายนิดเดียว', '']
+
+
+def expected_breaks():
+    breaks = {}
+    for name in LOCALES:
+        for text in TEXTS:
+            break_iterator = icu.BreakIterator.createWordInstance(icu.Locale(name))
+            break_iterator.setText(text)
+            breaks[name, text] = list(break_iterator)
+    return breaks
+
+
+def test_locales_disagree():
+    breaks = expected_breaks()
+    assert breaks['en_US_POSIX', TEXTS[0]] != breaks['sv', TEXTS[0]]
+    assert breaks['en_US_POSIX', TEXTS[1]] != breaks['sv', TEXTS[1]]
+
+
+def test_breaks_survive_reuse():
+    breaks = expected_breaks()
+    locale = icu.Locale('sv')
+    first = unicode_support.word_break_iterator(TEXTS[0], locale=locale)
+    second = unicode_support.word_break_iterator(TEXTS[1], locale=locale)
+    assert list(first) == breaks['sv', TEXTS[0]]
+    assert list(second) == breaks['sv', TEXTS[1]]
+
+
+def test_interleaved_locales_and_threads():
+    breaks = expected_breaks()
+    barrier = threading.Barrier(2)
+    results = {}
+    iterators = {}
+
+    def work(n):
+        locales = [icu.Locale(name) for name in LOCALES]
+        # Keep both threads running at once, so that their caches are alive
+        # together and their calls interleave.
+        barrier.wait()
+        mismatches = []
+        for i in range(200):
+            for name, locale in zip(LOCALES, locales):
+                text = TEXTS[(i + n) % len(TEXTS)]
+                positions = unicode_support.word_break_iterator(text, locale=locale)
+                if list(positions) != breaks[name, text]:
+                    mismatches += [(name, text, list(positions))]
+        iterators[n] = [unicode_support._get_icu_word_break_iterator(locale) for locale in locales]
+        barrier.wait()
+        results[n] = mismatches
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {0: [], 1: []}
+    # One iterator per thread and locale:
+    all_iterators = iterators[0] + iterators[1]
+    assert len(set(map(id, all_iterators))) == 4
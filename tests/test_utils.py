@@ -0,0 +1,74 @@
+from pathlib import Path
+import sys
+import warnings
+
+import pytest
+
+# utils lives in the bundled ocrodjvu package under bin/
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT / 'bin'))
+
+pytest.importorskip('six')
+
+from lib import utils  # noqa: E402
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'plain ASCII\r\n\twith CR, LF and TAB',
+    'Zürich, 日本語, \U0001F600'.encode('UTF-8'),
+])
+def test_find_utf8_problem_valid(data):
+    assert utils.find_utf8_problem(data) is None
+
+
+@pytest.mark.parametrize('data, problem', [
+    # Truncated sequences, at the end and in the middle
+    (b'abc\xc3', 'byte 0xc3 in position 3: invalid UTF-8'),
+    ('ä'.encode('UTF-8') + b'\xe2\x82 euro', 'byte 0xe2 in position 2: invalid UTF-8'),
+    (b'\xf0\x9f\x98', 'byte 0xf0 in position 0: invalid UTF-8'),
+    # Stray continuation byte and bytes that never occur in UTF-8
+    (b'ab\x80', 'byte 0x80 in position 2: invalid UTF-8'),
+    (b'ab\xff\xfe', 'byte 0xff in position 2: invalid UTF-8'),
+    # Overlong encodings of '/' and NUL
+    (b'ab\xc0\xaf', 'byte 0xc0 in position 2: invalid UTF-8'),
+    (b'ab\xe0\x80\xaf', 'byte 0xe0 in position 2: invalid UTF-8'),
+    (b'\xc0\x80', 'byte 0xc0 in position 0: invalid UTF-8'),
+    # Surrogates, and code points above U+10FFFF
+    ('日本'.encode('UTF-8') + b'\xed\xa0\x80', 'byte 0xed in position 6: invalid UTF-8'),
+    (b'x\xf4\x90\x80\x80', 'byte 0xf4 in position 1: invalid UTF-8'),
+    # Control characters; the position is still a byte offset
+    (b'ab\x01', 'byte 0x01 in position 2: control character'),
+    ('日本\x1b'.encode('UTF-8'), 'byte 0x1b in position 6: control character'),
+])
+def test_find_utf8_problem(data, problem):
+    assert utils.find_utf8_problem(data) == problem
+
+
+def test_sanitize_utf8_valid():
+    data = 'Zürich\r\n\t日本'.encode('UTF-8')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert utils.sanitize_utf8(data) == data
+        assert utils.sanitize_utf8(data.decode('UTF-8')) == data.decode('UTF-8')
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'ab\xc3', 'ab�'),
+    (b'a\xed\xa0\x80b', 'a���b'),
+    (b'a\xc0\xafb', 'a��b'),
+    (b'a\x01b\x1f', 'a�b�'),
+])
+def test_sanitize_utf8(data, expected):
+    with pytest.warns(utils.EncodingWarning):
+        assert utils.sanitize_utf8(data) == expected.encode('UTF-8')
+    # Whatever find_utf8_problem() reports is gone afterwards
+    assert utils.find_utf8_problem(data) is not None
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert utils.find_utf8_problem(utils.sanitize_utf8(data)) is None
+
+
+def test_sanitize_utf8_text():
+    with pytest.warns(utils.EncodingWarning, match='control character'):
+        assert utils.sanitize_utf8('a\x07b') == 'a�b'
@@ -0,0 +1,151 @@
+from pathlib import Path
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import pytest
+
+# Ensure repository root is on the path so the watch module can be imported
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from djvu2pdf_watch import FolderWatcher, InotifyWatcher, PollingWatcher, WatchStats, is_candidate
+
+FAKE_TOOLS = PROJECT_ROOT / 'benchmarks' / 'fake_tools'
+
+
+def test_is_candidate():
+    assert is_candidate('book.djvu') and is_candidate('SCAN.DJV')
+    assert not is_candidate('.book.djvu') and not is_candidate('book.djvu.part')
+
+
+def test_polling_watcher_reports_changes(tmp_path):
+    watcher = PollingWatcher(tmp_path, interval=0)
+    assert watcher.wait(0) == set()
+
+    (tmp_path / 'a.djvu').write_bytes(b'1')
+    assert watcher.wait(0) == {'a.djvu'}
+    assert watcher.wait(0) == set()
+
+    (tmp_path / 'a.djvu').write_bytes(b'12')
+    assert watcher.wait(0) == {'a.djvu'}
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is Linux-only')
+def test_inotify_watcher_reports_changes(tmp_path):
+    watcher = InotifyWatcher(tmp_path)
+    try:
+        assert watcher.wait(0) == set()
+        (tmp_path / 'a.djvu').write_bytes(b'1')
+        assert watcher.wait(1) == {'a.djvu'}
+    finally:
+        watcher.close()
+
+
+def test_stats():
+    now = [0.0]
+    stats = WatchStats(window=60, clock=lambda: now[0])
+    now[0] = 30.0
+    stats.record(True, 10.0, pages=100, bytes_in=1000, bytes_out=500)
+    stats.record(False, 1.0)
+
+    data = stats.to_json()
+    assert data['converted'] == 1 and data['failed'] == 1
+    assert data['pages_per_second'] == pytest.approx(100 / 11)
+    assert data['files_per_minute'] == pytest.approx(2.0)
+
+    now[0] = 120.0
+    assert stats.to_json()['recent_files_per_minute'] == 0
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+@pytest.mark.parametrize('inotify', [True, False])
+def test_folder_watcher(tmp_path, inotify):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    (input_dir / 'early.djvu').write_text(json.dumps({'pages': 2}), encoding='utf-8')
+    watcher = FolderWatcher(input_dir, output_dir, workers=2, settle=0.2, poll_interval=0.05,
+                            inotify=inotify, bin_dir=FAKE_TOOLS)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        (input_dir / 'late.djvu').write_text(json.dumps({'pages': 3}), encoding='utf-8')
+        (input_dir / 'broken.djvu').write_text('not a document', encoding='utf-8')
+        (input_dir / 'notes.txt').write_text('ignored', encoding='utf-8')
+        deadline = time.monotonic() + 30
+        while watcher.stats.converted + watcher.stats.failed < 3 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert sorted(path.name for path in output_dir.iterdir()) == ['early.pdf', 'late.pdf']
+    assert sorted(path.name for path in (input_dir / 'done').iterdir()) == ['early.djvu', 'late.djvu']
+    assert (input_dir / 'failed' / 'broken.djvu').exists()
+    assert (input_dir / 'failed' / 'broken.djvu.error.txt').read_text(encoding='utf-8')
+    assert (input_dir / 'notes.txt').exists()
+    assert watcher.stats.pages == 5
+
+
+def run_watcher(watcher, until, timeout=30):
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while not until() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        thread.join()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_folder_watcher_output_collisions(tmp_path):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    output_dir.mkdir()
+    for name, pages in (('a.djvu', 2), ('a.djv', 3), ('b.djvu', 4)):
+        (input_dir / name).write_text(json.dumps({'pages': pages}), encoding='utf-8')
+    (output_dir / 'b.pdf').write_bytes(b'an older PDF')
+    watcher = FolderWatcher(input_dir, output_dir, workers=2, settle=0.1, poll_interval=0.05,
+                            inotify=False, bin_dir=FAKE_TOOLS)
+
+    run_watcher(watcher, lambda: watcher.stats.converted == 3)
+
+    assert sorted(path.name for path in output_dir.iterdir()) == ['a-2.pdf', 'a.pdf', 'b-2.pdf', 'b.pdf']
+    assert (output_dir / 'b.pdf').read_bytes() == b'an older PDF'
+    assert (output_dir / 'a.pdf').read_bytes() != (output_dir / 'a-2.pdf').read_bytes()
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='runs the fake tools through their #! line')
+def test_folder_watcher_done_move_failure(tmp_path, monkeypatch):
+    input_dir = tmp_path / 'in'
+    output_dir = tmp_path / 'out'
+    input_dir.mkdir()
+    (input_dir / 'book.djvu').write_text(json.dumps({'pages': 2}), encoding='utf-8')
+    move = shutil.move
+
+    def failing_move(source, destination):
+        if Path(destination).parent.name == 'done':
+            raise PermissionError('read-only')
+        return move(source, destination)
+
+    monkeypatch.setattr(shutil, 'move', failing_move)
+    watcher = FolderWatcher(input_dir, output_dir, workers=1, settle=0.1, poll_interval=0.05,
+                            inotify=False, bin_dir=FAKE_TOOLS)
+    started = time.monotonic()
+
+    # Long enough for several scans, which must not convert the file again
+    run_watcher(watcher, lambda: time.monotonic() - started > 1.5)
+
+    assert watcher.stats.converted == 1 and watcher.stats.failed == 0
+    assert [path.name for path in output_dir.iterdir()] == ['book.pdf']
+    assert (input_dir / 'book.djvu').exists()
+    assert not list((input_dir / 'failed').iterdir())